@@ -1,10 +1,13 @@
 __all__ = (
+    "batch_metadata",
+    "AsyncPandarusRemote",
     "cg",
     "calculate_needed_intersections",
     "create_ecoinvent_collections",
     "create_empty_intersection",
     "create_restofworlds_collections",
     "create_world_collections",
+    "datapackage_layout",
     "divide_by_area",
     "extension_tables",
     "ExtensionTable",
@@ -16,7 +19,9 @@ __all__ = (
     "import_regionalized_cfs",
     "Intersection",
     "calculate_intersection",
+    "intersection_store",
     "intersections",
+    "IntersectionStore",
     "label_activity_geocollections",
     "Loading",
     "loadings",
@@ -25,12 +30,17 @@ __all__ = (
     "remote",
     "reset_all_geo",
     "reset_geo_meta",
+    "set_datapackage_layout",
     "sha256",
+    "stream_import_from_pandarus",
     "topocollections",
     "Topography",
     "TwoSpatialScalesLCA",
     "TwoSpatialScalesWithGenericLoadingLCA",
+    "unpack_datapackage",
+    "update_intersection",
     "raster_as_extension_table",
+    "RegionalResult",
 )
 
 # ignore future warning from pandas that we can't fix
@@ -49,6 +59,7 @@ from bw2data import config
 from .topography import Topography
 from .loading import Loading
 from .meta import (
+    batch_metadata,
     extension_tables,
     geocollections,
     intersections,
@@ -65,23 +76,32 @@ from .lca import (
     TwoSpatialScalesLCA,
     TwoSpatialScalesWithGenericLoadingLCA,
 )
+from .results import RegionalResult
 
 from .base_data import (
     create_ecoinvent_collections,
     create_restofworlds_collections,
     create_world_collections,
 )
-from .gis_tasks import calculate_intersection, raster_as_extension_table
+from .gis_tasks import (
+    calculate_intersection,
+    raster_as_extension_table,
+    update_intersection,
+)
+from .intersection_store import IntersectionStore, intersection_store
 from .hashing import sha256
-from .pandarus import import_from_pandarus
-from .pandarus_remote import PandarusRemote, remote
+from .pandarus import import_from_pandarus, stream_import_from_pandarus
+from .pandarus_remote import AsyncPandarusRemote, PandarusRemote, remote
 from .utils import (
     create_empty_intersection,
+    datapackage_layout,
     get_spatial_dataset_kind,
     hash_collection,
     import_regionalized_cfs,
     reset_all_geo,
     reset_geo_meta,
+    set_datapackage_layout,
+    unpack_datapackage,
 )
 
 config.metadata.extend(
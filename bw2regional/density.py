@@ -1,11 +1,16 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import rasterio
+from rasterio import windows
+from rasterio.windows import Window
 
 
 def get_area(lat1, lat2, width):
     """Get area of a spherical quadrangle.
 
-    lat1, lat2, and width should all be in degrees.
+    lat1, lat2, and width should all be in degrees. lat1 and lat2 can also be arrays.
 
     Uses the formula derived and demonstrated in https://gis.stackexchange.com/questions/127165/more-accurate-way-to-calculate-area-of-rasters."""
     a = 6378137  # Meters
@@ -24,24 +29,28 @@ def get_area(lat1, lat2, width):
             * (2 * np.arctanh(e * o) / (2 * e) + o / ((1 + e * o) * (1 - e * o)))
         )
 
-    if lat1 >= 0 and lat2 <= 0:
-        return width * (area(lat1) + area(lat2))
-    else:
-        return width * abs(area(lat1) - area(lat2))
+    # ``area`` is an odd function, so this also works across the equator
+    return width * np.abs(area(lat1) - area(lat2))
 
 
 def get_column_array(affine, rows, width):
-    return np.array(
-        [
-            get_area(affine[5] + i * affine[4], affine[5] + (i + 1) * affine[4], width)
-            for i in range(rows)
-        ]
-    ).reshape((1, -1, 1))
+    """Get areas of the raster cells in each of ``rows`` rows, starting at the top of ``affine``, as an array with shape ``(1, rows, 1)``"""
+    latitudes = affine[5] + np.arange(rows + 1) * affine[4]
+    return get_area(latitudes[:-1], latitudes[1:], width).reshape((1, -1, 1))
+
 
+def _row_windows(height, width, block_rows):
+    for row in range(0, height, block_rows):
+        yield Window(0, row, width, min(block_rows, height - row))
 
-def divide_by_area(source_fp, destination_fp):
+
+def divide_by_area(source_fp, destination_fp, block_rows=None, threads=1):
     """Create a new raster file at ``destination_fp``, dividing the values in ``source_fp`` by their cell's area.
 
+    The raster is processed in blocks of ``block_rows`` complete rows, so memory use doesn't depend on the raster size. The default block size follows the internal blocks of ``source_fp``, with at least one million cells per block. Blocks are processed by ``threads`` threads; reading and writing are serialized, as rasterio datasets are not thread-safe.
+
+    Integer rasters are written as ``float64``, as densities are fractional.
+
     Will raise an error is the CRS is not geographic, or the raster is rotated."""
     with rasterio.open(source_fp) as src:
         meta = src.meta
@@ -53,11 +62,39 @@ def divide_by_area(source_fp, destination_fp):
             Try https://geographiclib.sourceforge.io/html/python/interface.html"""
             raise ValueError(ERROR)
 
-        areas = get_column_array(affine, src.height, abs(affine[0]))
-        original = src.read()
-        array = original / areas.astype(original.dtype)
-        array[original == meta["nodata"]] = meta["nodata"]
+        profile = src.profile
+        if not np.issubdtype(np.dtype(profile["dtype"]), np.floating):
+            profile["dtype"] = "float64"
+        nodata = meta["nodata"]
+        if block_rows is None:
+            block_height = src.block_shapes[0][0]
+            block_rows = max(
+                block_height, 2**20 // src.width // block_height * block_height
+            )
+        width = abs(affine[0])
+
+        with rasterio.open(destination_fp, "w", **profile) as sink:
+            read_lock, write_lock = threading.Lock(), threading.Lock()
+
+            def process(window):
+                with read_lock:
+                    original = src.read(window=window)
+                areas = get_column_array(
+                    windows.transform(window, affine), window.height, width
+                )
+                array = original / areas.astype(profile["dtype"])
+                if nodata is not None:
+                    array[original == nodata] = nodata
+                with write_lock:
+                    sink.write(
+                        array.astype(profile["dtype"], copy=False), window=window
+                    )
 
-        with rasterio.open(destination_fp, "w", **src.meta) as sink:
-            for i, a in enumerate(array):
-                sink.write(a, i + 1)
+            blocks = _row_windows(src.height, src.width, block_rows)
+            if threads > 1:
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    # Consume results to raise any errors
+                    list(executor.map(process, blocks))
+            else:
+                for window in blocks:
+                    process(window)
@@ -0,0 +1,18 @@
+import os
+from pathlib import Path
+
+import platformdirs
+
+DATA_DIR_ENVIRONMENT_VARIABLE = "BW2REGIONAL_DATA_DIR"
+
+
+def shared_data_dir(*names):
+    """Get a directory for regional data shared by all projects, like the intersection store and the hash and download caches, creating it if needed.
+
+    The base directory is the ``BW2REGIONAL_DATA_DIR`` environment variable, or the ``bw2regional`` user data directory from ``platformdirs``. ``names`` are subdirectories of the base directory."""
+    dirpath = Path(
+        os.environ.get(DATA_DIR_ENVIRONMENT_VARIABLE)
+        or platformdirs.user_data_dir("bw2regional", "pylca")
+    ).joinpath(*names)
+    dirpath.mkdir(parents=True, exist_ok=True)
+    return dirpath
@@ -1,20 +1,30 @@
 import hashlib
+import json
 import os
 import warnings
-from collections import defaultdict
 from functools import partial
 
 import bw2data as bd
 import fiona
 import geopandas as gp
 import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
 from scipy.sparse import coo_matrix
-from shapely.geometry import shape
 
 from bw2regional import geocollections
+from bw2regional.hashing import sha256
+from bw2regional.utils import raster_cell_indices
 
 
 def add_attributes(dct, func, row_index, col_index):
+    """Deprecated: ``create_geodataframe`` now calls ``attribute_adder`` directly."""
+    warnings.warn(
+        "`add_attributes` is deprecated and will be removed in a future release",
+        DeprecationWarning,
+        stacklevel=2,
+    )
     if func is None:
         return dct
     else:
@@ -26,6 +36,82 @@ def unplottable(key):
     return key == "GLO" or (isinstance(key, tuple) and key[0] == "RoW")
 
 
+class GeometryIndex:
+    """Cache of the feature geometries of geocollections, reused across ``create_geodataframe`` calls.
+
+    Geometries are read once per geocollection, with only the id field, into a ``GeoSeries`` indexed by feature id. Cached geometries are read again if the geocollection filepath, layer, field, or ``sha256`` change."""
+
+    def __init__(self):
+        self._cache = {}
+
+    def _signature(self, geocollection):
+        metadata = geocollections[geocollection]
+        return tuple(
+            metadata.get(key) for key in ("filepath", "layer", "field", "sha256")
+        )
+
+    def __getitem__(self, geocollection):
+        signature = self._signature(geocollection)
+        cached = self._cache.get(geocollection)
+        if cached is None or cached[0] != signature:
+            filepath, layer, field, _ = signature
+            if not filepath or not field:
+                raise KeyError(geocollection)
+            gdf = gp.read_file(filepath, layer=layer, columns=[field])
+            # Like a dict, later features replace earlier ones with the same id
+            gdf = gdf.drop_duplicates(subset=field, keep="last")
+            cached = self._cache[geocollection] = (
+                signature,
+                gdf.set_index(field).geometry,
+            )
+        return cached[1]
+
+    def clear(self):
+        self._cache.clear()
+
+
+geometry_index = GeometryIndex()
+
+
+class ReversedGeomapping:
+    """Cached lookup of ``geomapping`` keys from their integer ids.
+
+    The reversed mapping is only built again when the project changes, or an id is not found."""
+
+    def __init__(self):
+        self._source, self._series = None, None
+
+    def _build(self):
+        self._source = bd.geomapping.data
+        keys = np.empty(len(self._source), dtype=object)
+        keys[:] = list(self._source)
+        self._series = pd.Series(
+            keys, index=np.fromiter(self._source.values(), dtype=np.int64)
+        )
+
+    def lookup(self, ids):
+        """Get array of ``geomapping`` keys for array of ``ids``"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._source is not bd.geomapping.data:
+            self._build()
+        found = self._series.index.get_indexer(ids)
+        if (found == -1).any():
+            self._build()
+            found = self._series.index.get_indexer(ids)
+            if (found == -1).any():
+                raise KeyError(ids[found == -1][0])
+        return self._series.values[found]
+
+
+reversed_geomapping = ReversedGeomapping()
+
+
+def _reverse(dct, indices):
+    """Vectorized lookup of matrix ``indices`` in ``dct.reversed``"""
+    unique, inverse = np.unique(indices, return_inverse=True)
+    return np.array([dct.reversed[x] for x in unique.tolist()])[inverse.ravel()]
+
+
 def create_geodataframe(
     matrix,
     used_geocollections,
@@ -34,7 +120,13 @@ def create_geodataframe(
     spatial_dim="col",
     attribute_adder=None,
     cutoff=None,
+    location_keys=None,
 ):
+    """Create a ``GeoDataFrame`` with one row per nonzero entry in the results ``matrix``.
+
+    Geometries come from the cached ``geometry_index``, and the frame is built from the matrix row, column, and data arrays. Entries below ``cutoff`` (relative to the total), and at unplottable locations, are filtered out. Entries at locations without a geometry get an empty geometry, with a warning.
+
+    Location keys are looked up in ``geomapping``, unless ``location_keys``, an array of the keys of the matrix rows or columns (following ``spatial_dim``), is given."""
     if cutoff is not None and not (0 < cutoff < 1):
         warnings.warn(f"Ignoring invalid cutoff value {cutoff}")
         cutoff = None
@@ -43,63 +135,119 @@ def create_geodataframe(
         matrix = matrix.tocoo()
 
     total = matrix.sum()
+    rows, cols, values = matrix.row, matrix.col, matrix.data
 
-    include = lambda x: x / total >= cutoff if cutoff is not None else True
+    if spatial_dim == "row":
+        spatial_dict, spatial = row_dict, rows
+    else:
+        spatial_dict, spatial = col_dict, cols
+
+    # Location lookups are only done once for each spatial unit
+    unique, inverse = np.unique(spatial, return_inverse=True)
+    inverse = inverse.ravel()
+    if location_keys is None:
+        keys = reversed_geomapping.lookup(
+            [spatial_dict.reversed[x] for x in unique.tolist()]
+        )
+    else:
+        keys = location_keys[unique]
+    plottable = np.array([not unplottable(key) for key in keys], dtype=bool)
+
+    mask = plottable[inverse]
+    if cutoff is not None:
+        mask &= values / total >= cutoff
+    rows, cols, values, inverse = rows[mask], cols[mask], values[mask], inverse[mask]
 
-    geom_mapping = {}
+    geometries = np.full(len(keys), None, dtype=object)
     for gc in used_geocollections:
         try:
-            field = geocollections[gc]["field"]
-            gdf = gp.read_file(geocollections[gc]["filepath"])
-            for _, row in gdf.iterrows():
-                if gc != "world":
-                    geom_mapping[(gc, row[field])] = row.geometry
-                else:
-                    geom_mapping[row[field]] = row.geometry
+            index = geometry_index[gc]
         except KeyError:
-            pass
-
-    reversed_geomapping = {v: k for k, v in bd.geomapping.items()}
-
-    if spatial_dim == "row":
-        spatial_dict = row_dict
-        spatial_index = lambda x, y: x
-    else:
-        spatial_dict = col_dict
-        spatial_index = lambda x, y: y
-
-    return gp.GeoDataFrame(
-        [
-            add_attributes(
-                {
-                    "row_id": int(row),
-                    "row_index": row_dict.reversed[row],
-                    "col_id": int(col),
-                    "col_index": col_dict.reversed[col],
-                    "score_abs": value,
-                    "score_rel": value / total,
-                    "location_key": str(
-                        reversed_geomapping[
-                            spatial_dict.reversed[spatial_index(row, col)]
-                        ]
-                    ),
-                    "geometry": geom_mapping[
-                        reversed_geomapping[
-                            spatial_dict.reversed[spatial_index(row, col)]
-                        ]
-                    ],
-                },
-                attribute_adder,
-                row_dict.reversed[row],
-                col_dict.reversed[col],
+            continue
+        if gc != "world":
+            selected = np.array(
+                [isinstance(key, tuple) and key[0] == gc for key in keys], dtype=bool
+            )
+            ids = [key[1] for key in keys[selected]]
+        else:
+            selected = np.array(
+                [not isinstance(key, tuple) for key in keys], dtype=bool
             )
-            for row, col, value in zip(matrix.row, matrix.col, matrix.data)
-            if include(value)
-            and not unplottable(
-                reversed_geomapping[spatial_dict.reversed[spatial_index(row, col)]]
+            ids = list(keys[selected])
+        if ids:
+            geometries[selected] = index.reindex(ids).values
+
+    missing = np.array([x is None for x in geometries], dtype=bool)[inverse]
+    if missing.any():
+        locations = np.unique(inverse[missing])
+        warnings.warn(
+            "{} results at {} locations have no geometry, e.g. {}".format(
+                missing.sum(), len(locations), keys[locations[0]]
             )
-        ]
+        )
+
+    row_index = _reverse(row_dict, rows) if len(rows) else np.zeros(0, dtype=int)
+    col_index = _reverse(col_dict, cols) if len(cols) else np.zeros(0, dtype=int)
+    df = gp.GeoDataFrame(
+        {
+            "row_id": rows.astype(int),
+            "row_index": row_index,
+            "col_id": cols.astype(int),
+            "col_index": col_index,
+            "score_abs": values,
+            "score_rel": values / total,
+            "location_key": np.array([str(key) for key in keys], dtype=object)[inverse],
+            "geometry": gp.GeoSeries(geometries[inverse]),
+        }
     )
+    if attribute_adder is not None:
+        attributes = pd.DataFrame(
+            [
+                attribute_adder(x, y)
+                for x, y in zip(row_index.tolist(), col_index.tolist())
+            ],
+            index=df.index,
+        )
+        df = df.join(attributes)
+    return df
+
+
+COLUMNAR_FORMATS = {
+    ".parquet": "parquet",
+    ".geoparquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+}
+
+
+def columnar_format(filepath):
+    """Get ``"parquet"`` or ``"arrow"`` from the extension of ``filepath``, or ``None`` for other files"""
+    return COLUMNAR_FORMATS.get(os.path.splitext(str(filepath))[1].lower())
+
+
+def write_columnar(gdf, filepath, compression="zstd"):
+    """Write the ``GeoDataFrame`` ``gdf`` to a GeoParquet (``.parquet``, ``.geoparquet``) or Arrow IPC (``.arrow``, ``.feather``) file.
+
+    Geometries are encoded to WKB for the whole column at once. ``compression`` can be ``"zstd"``, ``"lz4"``, or ``None``; Parquet also allows ``"snappy"`` and ``"gzip"``.
+
+    Returns the filepath."""
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("`pyarrow` is required for this function")
+
+    kind = columnar_format(filepath)
+    if kind == "parquet":
+        gdf.to_parquet(filepath, compression=compression, index=False)
+    elif kind == "arrow":
+        gdf.to_feather(filepath, compression=compression or "uncompressed")
+    else:
+        raise ValueError(
+            "Unknown columnar file extension; must be one of {}".format(
+                ", ".join(COLUMNAR_FORMATS)
+            )
+        )
+    return filepath
 
 
 def _generic_exporter(
@@ -111,7 +259,11 @@ def _generic_exporter(
     score_column_absolute="score_abs",
     score_column_relative="score_rel",
     cutoff=1e-3,
+    compression="zstd",
 ):
+    """Export the results of ``lca`` on the spatial units of ``geocollection``, keeping features whose absolute score is at least ``cutoff`` times the LCA score.
+
+    Writes GeoParquet or Arrow IPC if ``filepath`` has a ``.parquet``, ``.geoparquet``, ``.arrow``, or ``.feather`` extension (see ``write_columnar``; ``compression`` is only used for these formats), and GeoJSON otherwise."""
     from bw2regional.lca.base_class import RegionalizationBase
 
     assert isinstance(lca, RegionalizationBase)
@@ -128,7 +280,8 @@ def _generic_exporter(
     assert field
 
     # TODO: Might need to make this nicer/more robust
-    if not filepath.endswith(".geojson"):
+    kind = columnar_format(filepath)
+    if kind is None and not filepath.endswith(".geojson"):
         filepath += ".geojson"
 
     if geocollection == "world":
@@ -145,6 +298,17 @@ def _generic_exporter(
             if abs(vector[index]) >= cut
         }
 
+    if kind is not None:
+        gdf = gp.read_file(
+            geocollections[geocollection]["filepath"],
+            layer=geocollections[geocollection].get("layer"),
+        )
+        scores = gdf[field].map(results)
+        gdf = gdf[scores.notna().values].copy()
+        gdf[score_column_absolute] = scores.dropna().values
+        gdf[score_column_relative] = np.abs(gdf[score_column_absolute].values / total)
+        return write_columnar(gdf, filepath, compression)
+
     with fiona.Env():
         with fiona.open(geocollections[geocollection]["filepath"]) as source:
             meta = source.meta
@@ -185,10 +349,253 @@ as_xt_spatial_scale = partial(
 )
 
 
-def _hash_feature(feature):
-    """Calculate SHA256 hash of feature geometry as WKT"""
-    geom = shape(feature["geometry"])
-    return hashlib.sha256(geom.wkt.encode("utf-8")).hexdigest()
+def as_ia_raster(
+    lca,
+    geocollection,
+    filepath,
+    flows=None,
+    nodata=-9999.0,
+    block_rows=None,
+    compress="deflate",
+):
+    """Write the results of ``lca`` on the IA spatial scale to a GeoTIFF on the grid of the raster ``geocollection``.
+
+    Each raster cell gets the result of its ``Cell(x, y)`` spatial unit, with cell positions parsed by ``raster_cell_indices``, so labels written by Pandarus or ``raster_cell_labels`` both work. Cells without results get ``nodata``, and spatial units which aren't cells of the raster are skipped with a warning. With ``flows=None``, the raster has one band with results summed over all flows; otherwise it has one band per biosphere flow in ``flows``, in the same order, with the flow as band description.
+
+    Results are scattered into blocks of ``block_rows`` complete rows, which are written one at a time, so no vector features are created.
+
+    Returns the filepath."""
+    assert geocollection in geocollections
+    assert geocollections[geocollection].get("kind") == "raster"
+
+    matrix = lca.results_ia_spatial_scale().tocsr()
+    if flows is None:
+        values = np.asarray(matrix.sum(axis=0))
+    else:
+        rows = [lca.dicts.biosphere[bd.get_id(flow)] for flow in flows]
+        values = matrix[rows, :].toarray()
+
+    with rasterio.open(geocollections[geocollection]["filepath"]) as src:
+        height, width, crs, transform = src.height, src.width, src.crs, src.transform
+
+    keys = lca.location_keys("ia")
+    selected = np.flatnonzero(
+        [isinstance(key, tuple) and key[0] == geocollection for key in keys]
+    )
+    cells = raster_cell_indices(
+        [key[1] for key in keys[selected]], (height, width), transform
+    )
+    if (cells < 0).any():
+        warnings.warn(
+            "Skipping {} spatial units which aren't cells of raster {}".format(
+                (cells < 0).sum(), geocollection
+            )
+        )
+    selected, cells = selected[cells >= 0], cells[cells >= 0]
+    order = np.argsort(cells)
+    cells, values = cells[order], values[:, selected][:, order]
+
+    bands = values.shape[0]
+    block_rows = block_rows or max(1, 2**20 // width)
+    with rasterio.open(
+        filepath,
+        "w",
+        driver="GTiff",
+        height=height,
+        width=width,
+        count=bands,
+        dtype="float64",
+        crs=crs,
+        transform=transform,
+        nodata=nodata,
+        compress=compress,
+    ) as sink:
+        if flows is not None:
+            for index, flow in enumerate(flows):
+                sink.set_band_description(index + 1, str(flow))
+        for row in range(0, height, block_rows):
+            window = Window(0, row, width, min(block_rows, height - row))
+            start = row * width
+            first, last = np.searchsorted(cells, (start, start + window.height * width))
+            block = np.full((bands, window.height * width), nodata, dtype=np.float64)
+            block[:, cells[first:last] - start] = values[:, first:last]
+            sink.write(block.reshape((bands, window.height, width)), window=window)
+    return filepath
+
+
+class GeometryHashes:
+    """Cache of the SHA256 hashes of the WKB geometries of each feature in a file, keyed by the file's own SHA256 hash."""
+
+    def __init__(self):
+        self._cache = {}
+
+    def __call__(self, filepath, gdf):
+        key = sha256(filepath)
+        if key not in self._cache:
+            self._cache[key] = np.array(
+                [hashlib.sha256(wkb).digest() for wkb in gdf.geometry.to_wkb()],
+                dtype=object,
+            )
+        return self._cache[key]
+
+    def clear(self):
+        self._cache.clear()
+
+
+geometry_hashes = GeometryHashes()
+
+
+def _read_results(filepath):
+    if columnar_format(filepath) == "parquet":
+        return gp.read_parquet(filepath)
+    elif columnar_format(filepath) == "arrow":
+        return gp.read_feather(filepath)
+    return gp.read_file(filepath)
+
+
+class FeatureWriter:
+    """Write a ``GeoDataFrame`` to a GeoJSON, GeoParquet, or Arrow IPC file one chunk at a time, like ``write_columnar`` does for a whole ``GeoDataFrame``.
+
+    Later chunks are aligned on the columns of the first chunk, and, for columnar formats, cast to its Arrow schema. Empty chunks are skipped; if all chunks are empty, the first one is written when the writer is closed, so the file always exists."""
+
+    def __init__(self, filepath, compression="zstd"):
+        self.filepath = str(filepath)
+        self.kind = columnar_format(filepath)
+        self.compression = compression
+        self.columns, self.schema, self.written = None, None, False
+        self._empty = self._sink = self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, gdf):
+        if self.columns is None:
+            self.columns, self._empty = gdf.columns, gdf.iloc[:0]
+        else:
+            gdf = gdf.reindex(columns=self.columns)
+        if len(gdf):
+            self._write(gdf.reset_index(drop=True))
+
+    def _write(self, gdf):
+        if self.kind is None:
+            gdf.to_file(
+                self.filepath, driver="GeoJSON", mode="a" if self.written else "w"
+            )
+            self.written = True
+            return
+
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("`pyarrow` is required for this function")
+        from geopandas.io.arrow import _geopandas_to_arrow
+
+        table = _geopandas_to_arrow(gdf, index=False)
+        if self.schema is None:
+            # The bounding box and geometry types of the first chunk don't
+            # describe the whole file
+            geo = json.loads(table.schema.metadata[b"geo"])
+            for column in geo["columns"].values():
+                column.pop("bbox", None)
+                column["geometry_types"] = []
+            self.schema = table.schema.with_metadata(
+                {**table.schema.metadata, b"geo": json.dumps(geo).encode("utf-8")}
+            )
+            if self.kind == "parquet":
+                self._writer = pyarrow.parquet.ParquetWriter(
+                    self.filepath, self.schema, compression=self.compression
+                )
+            else:
+                self._sink = pyarrow.OSFile(self.filepath, "wb")
+                self._writer = pyarrow.ipc.new_file(
+                    self._sink,
+                    self.schema,
+                    options=pyarrow.ipc.IpcWriteOptions(compression=self.compression),
+                )
+        self._writer.write_table(table.cast(self.schema))
+        self.written = True
+
+    def close(self):
+        if not self.written and self._empty is not None:
+            self._write(self._empty)
+        if self._writer is not None:
+            self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        self._writer = self._sink = None
+
+
+def add_results(
+    filepaths,
+    output_filepath,
+    column_names="score_abs",
+    field=None,
+    score_column_absolute="score_abs",
+    score_column_relative="score_rel",
+    cutoff=1e-4,
+    compression="zstd",
+):
+    """Sum results from any number of regionalized LCA calculations on the same spatial scale.
+
+    ``filepaths`` are result files, e.g. from ``as_ia_spatial_scale``, and ``column_names`` their score columns, either one name for all files or a list with one name per file. Features are matched on the feature id ``field`` if given, and otherwise on the hashes of their geometries, which are cached across calls.
+
+    The first pass over the files only accumulates the scores in an array. The second pass reads each file again and writes its features to the output as they are read, so only one file is in memory at a time. As in ``add_two_geojson_results``, the last feature for each spatial unit is kept, and the output has the columns of the first file. Features are written file by file, in the order of the files in which they were kept. Features whose absolute score is below ``cutoff`` times the total are left out. The output is GeoParquet or Arrow IPC depending on the ``output_filepath`` extension (see ``write_columnar``), and GeoJSON otherwise.
+
+    Returns the output filepath."""
+    if isinstance(column_names, str):
+        column_names = [column_names] * len(filepaths)
+    if len(column_names) != len(filepaths):
+        raise ValueError("Need one column name per file")
+
+    if columnar_format(output_filepath) is None and not str(output_filepath).endswith(
+        ".geojson"
+    ):
+        output_filepath = str(output_filepath) + ".geojson"
+
+    index, scores = pd.Index([]), np.zeros(0)
+    owner_file, owner_row = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    for number, (filepath, column) in enumerate(zip(filepaths, column_names)):
+        gdf = _read_results(filepath)
+        keys = (
+            gdf[field].to_numpy()
+            if field is not None
+            else geometry_hashes(filepath, gdf)
+        )
+
+        new = index.get_indexer(keys) == -1
+        new &= ~pd.Index(keys).duplicated()
+        if new.any():
+            index = index.append(pd.Index(keys[new]))
+            scores = np.hstack([scores, np.zeros(new.sum())])
+            owner_file = np.hstack([owner_file, np.zeros(new.sum(), dtype=np.int64)])
+            owner_row = np.hstack([owner_row, np.zeros(new.sum(), dtype=np.int64)])
+        positions = index.get_indexer(keys)
+        np.add.at(scores, positions, gdf[column].to_numpy(np.float64))
+        last = ~pd.Index(keys).duplicated(keep="last")
+        owner_file[positions[last]] = number
+        owner_row[positions[last]] = np.flatnonzero(last)
+
+    if not len(index):
+        raise ValueError("No features in result files")
+    total = scores.sum()
+    kept = np.abs(scores) >= abs(total * cutoff)
+
+    with FeatureWriter(output_filepath, compression) as writer:
+        for number, filepath in enumerate(filepaths):
+            selected = np.flatnonzero(kept & (owner_file == number))
+            if not len(selected) and writer.columns is not None:
+                continue
+            selected = selected[np.argsort(owner_row[selected])]
+            gdf = _read_results(filepath).iloc[owner_row[selected]].copy()
+            gdf[score_column_absolute] = scores[selected]
+            gdf[score_column_relative] = np.abs(scores[selected] / total)
+            writer.write(gdf)
+    return output_filepath
 
 
 def add_two_geojson_results(
@@ -201,40 +608,14 @@ def add_two_geojson_results(
     score_column_relative="score_rel",
     cutoff=1e-4,
 ):
-    """Sum results from two regionalized LCA calculations on the same spatial scale."""
-    results, features = defaultdict(float), {}
-
-    # TODO: Might need to make this nicer/more robust
-    if not output_filepath.endswith(".geojson"):
-        output_filepath += ".geojson"
-
-    with fiona.open(first, "r") as obj:
-        meta = obj.meta
-
-        for feature in obj:
-            hashed = _hash_feature(feature)
-            features[hashed] = feature
-            results[hashed] += feature["properties"][first_column_name]
-
-    with fiona.open(second, "r") as obj:
-        for feature in obj:
-            hashed = _hash_feature(feature)
-            features[hashed] = feature
-            results[hashed] += feature["properties"][second_column_name]
-
-    total = sum(results.values())
-
-    meta["driver"] = "GeoJSON"
-    meta["schema"]["properties"].update(
-        {score_column_absolute: "float", score_column_relative: "float"}
+    """Sum results from two regionalized LCA calculations on the same spatial scale.
+
+    Features in both files are written with the properties and geometry of ``second``. See ``add_results``, which can sum any number of result files."""
+    return add_results(
+        [first, second],
+        output_filepath,
+        column_names=[first_column_name, second_column_name],
+        score_column_absolute=score_column_absolute,
+        score_column_relative=score_column_relative,
+        cutoff=cutoff,
     )
-
-    with fiona.open(output_filepath, "w", **meta) as sink:
-        for k, feature in features.items():
-            score = results[k]
-            if abs(score) < abs(total * cutoff):
-                continue
-
-            feature["properties"][score_column_absolute] = score
-            feature["properties"][score_column_relative] = abs(score / total)
-            sink.write(feature)
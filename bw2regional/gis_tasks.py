@@ -1,7 +1,11 @@
-import bw2data as bd
+import hashlib
+import json
 
+import bw2data as bd
 import geopandas as gp
+import numpy as np
 import rasterstats
+from bw_processing import INDICES_DTYPE, clean_datapackage_name, safe_filename
 
 from . import (
     Intersection,
@@ -11,8 +15,11 @@ from . import (
     intersections,
     topocollections,
 )
+from .intersection_store import intersection_store
 from .pandarus import import_from_pandarus, import_xt_from_rasterstats
 from .pandarus_remote import PandarusRemote, remote, run_job
+from .utils import bulk_geomapping, create_certain_datapackage
+from .zonal import zonal_means
 
 try:
     import pandarus
@@ -24,8 +31,17 @@ CPU_COUNT = multiprocessing.cpu_count()
 
 
 def raster_as_extension_table(
-    vector, raster, name=None, engine=remote, overwrite=False, mask_negative=True
+    vector,
+    raster,
+    name=None,
+    engine=remote,
+    overwrite=False,
+    mask_negative=True,
+    **kwargs
 ):
+    """Create an ``ExtensionTable`` with the mean value of ``raster`` in each spatial unit of ``vector``.
+
+    ``engine`` can be a ``PandarusRemote`` instance, ``"rasterstats"``, ``"pandarus"``, or ``"windowed"``. The ``windowed`` engine reads only the raster window around each spatial unit, works in parallel, and takes the additional keyword arguments of ``zonal_means`` (``weighted``, ``supersample``, and ``processes``)."""
     if vector not in geocollections or raster not in geocollections:
         raise ValueError("Vector or raster not a valid geocollection")
     if vector in topocollections:
@@ -72,12 +88,32 @@ def raster_as_extension_table(
         field = geocollections[vector]['field']
         xt.write(
             [
-                (row.properties['mean'], (vector, row.properties[field]))
+                (row['properties']['mean'], (vector, row['properties'][field]))
                 for row in stats
-                if row.properties['mean'] is not None
+                if row['properties']['mean'] is not None
             ]
         )
         return xt
+    elif engine == "windowed":
+        ids, means = zonal_means(
+            geocollections[vector]["filepath"],
+            geocollections[vector]["field"],
+            geocollections[raster]["filepath"],
+            band=geocollections[raster].get("band") or 1,
+            layer=geocollections[vector].get("layer"),
+            nodata=geocollections[raster].get("nodata"),
+            mask_negative=mask_negative,
+            **kwargs
+        )
+        xt = ExtensionTable(name)
+        xt.register(
+            filepath=fp,
+            vector=geocollections[vector]["filepath"],
+            raster=geocollections[raster]["filepath"],
+            geocollection=vector,
+        )
+        xt.write_arrays(ids, means)
+        return xt
     elif engine == "pandarus":
         if not pandarus:
             raise ImportError("`pandarus` library required for this function")
@@ -105,11 +141,148 @@ def raster_as_extension_table(
         raise ValueError(f"Can't understand engine {engine}")
 
 
-def calculate_intersection(first, second, engine=remote, overwrite=False, cpus=None):
-    """Calculate and write areal intersections between two vector geocollections"""
+def overlay_areas(df1, df2, id1, id2):
+    """Intersect two GeoDataFrames.
+
+    Returns arrays of feature ids in ``df1`` and ``df2``, and intersected areas in square meters."""
+    if not len(df1) or not len(df2):
+        return np.array([]), np.array([]), np.array([])
+    # Only keep the id columns, other columns with the same name would be renamed
+    intersection = gp.overlay(
+        df1[[id1, "geometry"]], df2[[id2, "geometry"]], keep_geom_type=False
+    )
+    areas = intersection.to_crs("esri:54009").area  # World Mollweidge in square meters
+    return intersection[id1].values, intersection[id2].values, areas.values
+
+
+def hash_features(df, field):
+    """Return dictionary of feature ids to SHA256 hashes of their WKB geometry"""
+    return {
+        label: hashlib.sha256(wkb).hexdigest()
+        for label, wkb in zip(df[field].tolist(), df.geometry.to_wkb())
+    }
+
+
+def _feature_hashes_filepath(geocollection):
+    dirpath = bd.projects.request_directory("regional") / "feature-hashes"
+    dirpath.mkdir(exist_ok=True)
+    metadata = geocollections[geocollection]
+    return dirpath / "{}-{}.json".format(
+        metadata["sha256"], safe_filename(metadata["field"])
+    )
+
+
+def save_feature_hashes(geocollection, df=None):
+    """Save per-feature geometry hashes for the current spatial data of ``geocollection``.
+
+    Hashes are stored by the ``sha256`` of the whole file, which is returned."""
+    if df is None:
+        df = gp.read_file(geocollections[geocollection]["filepath"])
+    hashes = hash_features(df, geocollections[geocollection]["field"])
+    with open(_feature_hashes_filepath(geocollection), "w", encoding="utf-8") as f:
+        json.dump(list(hashes.items()), f)
+    return geocollections[geocollection]["sha256"]
+
+
+def load_feature_hashes(geocollection, sha256):
+    """Load saved per-feature geometry hashes of ``geocollection`` when its file had hash ``sha256``"""
+    dirpath = bd.projects.request_directory("regional") / "feature-hashes"
+    filepath = dirpath / "{}-{}.json".format(
+        sha256, safe_filename(geocollections[geocollection]["field"])
+    )
+    if not filepath.is_file():
+        raise ValueError(
+            "No feature hashes saved for geocollection {} with hash {}".format(
+                geocollection, sha256
+            )
+        )
+    with open(filepath, encoding="utf-8") as f:
+        return {label: hashed for label, hashed in json.load(f)}
+
+
+def update_intersection(first, second):
+    """Update ``Intersection`` ``(first, second)`` after features in one or both geocollections were added, removed, or redrawn.
+
+    Compares saved per-feature geometry hashes with the current spatial data, drops the rows of removed and changed features from the processed datapackage, and only intersects added and changed features again. Requires an intersection calculated with the ``geopandas`` engine, which saves the feature hashes.
+
+    Returns the number of changed features in ``first`` and ``second``."""
+    obj = Intersection((first, second))
+    if obj.is_reversed:
+        return update_intersection(second, first)[::-1]
+    if "sha256" not in obj.metadata:
+        raise ValueError(
+            "Intersection {} has no feature hashes; recalculate it with the "
+            "`geopandas` engine".format((first, second))
+        )
+
+    names, ids, dfs, changed, stale = (first, second), [], [], [], []
+    for name, sha in zip(names, obj.metadata["sha256"]):
+        field = geocollections[name]["field"]
+        df = gp.read_file(geocollections[name]["filepath"])
+        old = load_feature_hashes(name, sha)
+        new = hash_features(df, field)
+        added_or_modified = {k for k, v in new.items() if old.get(k) != v}
+        ids.append(field)
+        dfs.append(df)
+        changed.append(added_or_modified)
+        stale.append(added_or_modified.union(set(old).difference(new)))
+
+    if any(stale):
+        package = obj.datapackage()
+        resource = clean_datapackage_name(str(obj.name) + " matrix data")
+        indices = package.get_resource(resource + ".indices")[0]
+        data = package.get_resource(resource + ".data")[0]
+
+        drop = np.zeros(len(data), dtype=bool)
+        for field, name, labels in zip(("row", "col"), names, stale):
+            keys = [(name, x) for x in labels if (name, x) in bd.geomapping]
+            drop |= np.isin(indices[field], [bd.geomapping[key] for key in keys])
+
+        mask1 = dfs[0][ids[0]].isin(changed[0]).values
+        mask2 = dfs[1][ids[1]].isin(changed[1]).values
+        arrays = [
+            overlay_areas(dfs[0][mask1], dfs[1], *ids),
+            overlay_areas(dfs[0][~mask1], dfs[1][mask2], *ids),
+        ]
+        new_indices = np.empty(sum(len(x[2]) for x in arrays), dtype=INDICES_DTYPE)
+        new_indices["row"] = np.hstack([bulk_geomapping(x[0], first) for x in arrays])
+        new_indices["col"] = np.hstack([bulk_geomapping(x[1], second) for x in arrays])
+        create_certain_datapackage(
+            np.hstack([indices[~drop], new_indices]),
+            np.hstack([data[~drop]] + [np.asarray(x[2], float) for x in arrays]),
+            obj,
+        )
+
+    for name in names:
+        # Refresh ``sha256`` of the changed spatial data files
+        geocollections[name] = geocollections[name]
+    obj.metadata["sha256"] = [
+        save_feature_hashes(name, df) for name, df in zip(names, dfs)
+    ]
+    intersections.flush()
+    obj._refresh_reversed()
+    intersection_store.add(first, second)
+    return len(stale[0]), len(stale[1])
+
+
+def calculate_intersection(
+    first, second, engine=remote, overwrite=False, cpus=None, use_store=True
+):
+    """Calculate and write areal intersections between two vector geocollections.
+
+    If ``use_store``, reuse intersections from the cross-project ``intersection_store`` when available, and add newly calculated intersections to it."""
     if (first, second) in intersections and not overwrite:
         return
+    if use_store and not overwrite and intersection_store.retrieve(first, second):
+        return first, second
+
+    result = _calculate_intersection(first, second, engine, cpus)
+    if use_store and (first, second) in intersections:
+        intersection_store.add(first, second)
+    return result
+
 
+def _calculate_intersection(first, second, engine, cpus):
     if engine == "geopandas":
         for gc in (first, second):
             assert (
@@ -126,17 +299,13 @@ def calculate_intersection(first, second, engine=remote, overwrite=False, cpus=N
 
         assert id1 != id2, "Conflicting ID labels"
 
-        intersection = gp.overlay(df1, df2, keep_geom_type=False)
-        areas = intersection.to_crs(
-            "esri:54009"
-        ).area  # World Mollweidge in square meters
-
-        data = []
-        for index, feature in intersection.iterrows():
-            data.append(((first, feature[id1]), (second, feature[id2]), areas[index]))
-
         obj = Intersection((first, second))
-        obj.write(data)
+        obj.write_arrays(*overlay_areas(df1, df2, id1, id2))
+        obj.metadata["sha256"] = [
+            save_feature_hashes(first, df1),
+            save_feature_hashes(second, df2),
+        ]
+        intersections.flush()
         obj.create_reversed_intersection()
     elif engine == "pandarus":
         try:
@@ -1,12 +1,116 @@
 import hashlib
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
+from .directories import shared_data_dir
 
-def sha256(filepath, blocksize=65536):
-    """Generate SHA 256 hash for file at `filepath`"""
+CACHE_FILENAME = "regional-hash-cache.json"
+
+
+class HashCache(object):
+    """Cache of file hashes shared by all projects.
+
+    Entries are keyed by the resolved file path, and are only valid if the file size, modification time (in nanoseconds) and inode are unchanged. The cache is kept in memory and written to ``regional-hash-cache.json`` in ``shared_data_dir``; concurrent processes merge their entries when writing."""
+
+    def __init__(self, filepath=None):
+        self._filepath = filepath
+        self._data = None
+        self._lock = threading.Lock()
+
+    @property
+    def filepath(self):
+        return Path(self._filepath or shared_data_dir() / CACHE_FILENAME)
+
+    def _read(self):
+        try:
+            with open(self.filepath, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._read()
+        return self._data
+
+    @staticmethod
+    def signature(filepath):
+        stat = os.stat(filepath)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def get(self, filepath):
+        """Return cached hash for ``filepath``, or ``None`` if missing or stale"""
+        entry = self.data.get(str(Path(filepath).resolve()))
+        if entry and entry[:3] == self.signature(filepath):
+            return entry[3]
+        return None
+
+    def set(self, filepath, signature, digest):
+        """Add hash of ``filepath`` with file ``signature`` from before hashing started"""
+        key = str(Path(filepath).resolve())
+        with self._lock:
+            merged = self._read()
+            merged.update(self.data)
+            merged[key] = signature + [digest]
+            self._data = merged
+            try:
+                tmp = self.filepath.with_name(
+                    "{}.{}.tmp".format(CACHE_FILENAME, uuid.uuid4().hex)
+                )
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(merged, f)
+                os.replace(tmp, self.filepath)
+            except OSError:
+                # Cache is only an optimization
+                pass
+
+    def clear(self):
+        self._data = {}
+        if self.filepath.is_file():
+            self.filepath.unlink()
+
+
+hash_cache = HashCache()
+
+
+def _sha256(filepath, blocksize):
     hasher = hashlib.sha256()
-    fo = open(filepath, "rb")
-    buf = fo.read(blocksize)
-    while len(buf) > 0:
-        hasher.update(buf)
-        buf = fo.read(blocksize)
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    with open(filepath, "rb", buffering=0) as fo:
+        for size in iter(lambda: fo.readinto(buf), 0):
+            hasher.update(view[:size])
     return hasher.hexdigest()
+
+
+def sha256(filepath, blocksize=2**20, use_cache=True):
+    """Generate SHA 256 hash for file at `filepath`.
+
+    Hashes are cached in ``hash_cache`` and reused until the file size, modification time or inode changes. Set ``use_cache`` to ``False`` to always read the file."""
+    if not use_cache:
+        return _sha256(filepath, blocksize)
+    cached = hash_cache.get(filepath)
+    if cached:
+        return cached
+    signature = HashCache.signature(filepath)
+    digest = _sha256(filepath, blocksize)
+    # Don't cache if the file changed while being hashed
+    if HashCache.signature(filepath) == signature:
+        hash_cache.set(filepath, signature, digest)
+    return digest
+
+
+def sha256_many(filepaths, max_workers=None, **kwargs):
+    """Generate SHA 256 hashes for many files in parallel.
+
+    Uses threads, as ``hashlib`` releases the GIL while hashing large buffers. Returns a list of hashes in the same order as ``filepaths``."""
+    filepaths = list(filepaths)
+    if len(filepaths) < 2:
+        return [sha256(fp, **kwargs) for fp in filepaths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda fp: sha256(fp, **kwargs), filepaths))
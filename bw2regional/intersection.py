@@ -2,12 +2,25 @@ import copy
 import warnings
 import itertools
 
-from bw2data import geomapping
+import numpy as np
+from bw2data import geomapping, projects
+from bw2data.errors import MissingIntermediateData
 from bw2data.ia_data_store import ImpactAssessmentDataStore
+from bw_processing import INDICES_DTYPE, clean_datapackage_name, create_datapackage
 
-from .meta import intersections
-from .utils import create_certain_datapackage
-from .validate import intersection_validator
+from .errors import MissingIntersection
+from .meta import batch_metadata, geocollections, intersections
+from .utils import bulk_geomapping, create_certain_datapackage, dp
+from .validate import array_data, intersection_validator
+
+# Same memory layout as ``INDICES_DTYPE``, but with the ``row`` and ``col``
+# fields swapped, so a view with this dtype transposes without copying
+SWAPPED_INDICES_DTYPE = np.dtype(
+    {"names": ["row", "col"], "formats": [np.int64, np.int64], "offsets": [8, 0]}
+)
+# Metadata which depends on the order of the two geocollections, and so can't
+# be copied to the reversed intersection
+DIRECTIONAL_METADATA = {"sha256", "reversed"}
 
 
 class Intersection(ImpactAssessmentDataStore):
@@ -24,20 +37,120 @@ class Intersection(ImpactAssessmentDataStore):
         geomapping.add({x[0] for x in data})
         geomapping.add({x[1] for x in data})
 
+    @property
+    def is_reversed(self):
+        """Reversed intersections are views on the data of the forward intersection."""
+        return self.registered and bool(self.metadata.get("reversed"))
+
+    @property
+    def opposite(self):
+        """Intersection of the same geocollections in the opposite order"""
+        return Intersection((self.name[1], self.name[0]))
+
+    def _clear_reversed(self):
+        if self.is_reversed:
+            del self.metadata["reversed"]
+            self._metadata.flush()
+
+    def _refresh_reversed(self):
+        """Update the metadata of the reversed view after this intersection was written"""
+        if self.opposite.is_reversed:
+            self.create_reversed_intersection()
+
     def create_reversed_intersection(self):
-        """Create (B, A) intersection from (A, B)."""
-        new_name = (self.name[1], self.name[0])
-        new_data = [(line[1], line[0], line[2]) for line in self.load()]
+        """Create (B, A) intersection from (A, B).
 
+        The reversed intersection doesn't store any data. It is registered with ``reversed=True`` and the metadata of (A, B) which doesn't depend on the direction, and ``.datapackage()`` and ``.load()`` swap the row and column indices of the (A, B) data. Writing new data to the reversed intersection turns it into a normal intersection; deregistering (A, B) also deregisters the reversed intersection."""
+        new_obj = self.opposite
+        if self.is_reversed:
+            return new_obj
+
+        metadata = {
+            key: copy.deepcopy(value)
+            for key, value in self.metadata.items()
+            if key not in DIRECTIONAL_METADATA
+        }
+        metadata["reversed"] = True
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            new_obj = Intersection(new_name)
-            new_obj.register(**copy.deepcopy(self.metadata))
-            new_obj.write(new_data)
+            if new_obj.registered:
+                new_obj.deregister()
+            new_obj.register(**metadata)
 
         return new_obj
 
+    def deregister(self):
+        """Remove this intersection, and its reversed view if there is one, from the metadata store. Does not delete any files."""
+        if not self.is_reversed and self.opposite.is_reversed:
+            self.opposite.deregister()
+        super(Intersection, self).deregister()
+
+    def _check_forward(self):
+        if not self.opposite.registered or self.opposite.is_reversed:
+            raise MissingIntersection(
+                "Reversed intersection {} needs missing intersection {}".format(
+                    self.name, self.opposite.name
+                )
+            )
+
+    def load(self):
+        """Load the intermediate data, swapping the geocollections of the (A, B) data for reversed intersections."""
+        if not self.is_reversed:
+            return super(Intersection, self).load()
+        self._check_forward()
+        try:
+            data = self.opposite.load()
+        except MissingIntermediateData:
+            raise MissingIntermediateData(
+                "Intersection {} was written from arrays, so there is no "
+                "intermediate data to load; use `.datapackage()` "
+                "instead".format(self.opposite.name)
+            )
+        return [(line[1], line[0]) + tuple(line[2:]) for line in data]
+
+    def datapackage(self):
+        """Load the processed datapackage, resolving reversed intersections."""
+        if not self.is_reversed:
+            return dp(str(self.filepath_processed()))
+
+        self._check_forward()
+        forward = self.opposite.datapackage()
+        package = create_datapackage(
+            name=clean_datapackage_name(str(self.name)),
+            sum_intra_duplicates=True,
+            sum_inter_duplicates=False,
+        )
+        for resource in forward.resources:
+            if resource["kind"] != "indices":
+                continue
+            indices = forward.get_resource(resource["name"])[0]
+            package.add_persistent_vector(
+                matrix=self.matrix,
+                name=clean_datapackage_name(str(self.name) + " matrix data"),
+                indices_array=indices.view(SWAPPED_INDICES_DTYPE),
+                data_array=forward.get_resource(resource["group"] + ".data")[0],
+            )
+        return package
+
+    def write_arrays(self, first_ids, second_ids, areas, **extra_metadata):
+        """Write intersection data from arrays instead of a list of tuples.
+
+        ``first_ids`` and ``second_ids`` are feature ids in the first and second geocollection of ``self.name``; ``areas`` are the intersected areas. Validation and ``geomapping`` resolution are vectorized, and the processed datapackage is written directly, so no intermediate data is stored and ``self.load()`` is not available."""
+        areas = array_data(areas, first_ids, second_ids)
+        indices = np.empty(len(areas), dtype=INDICES_DTYPE)
+        indices["row"] = bulk_geomapping(first_ids, self.name[0])
+        indices["col"] = bulk_geomapping(second_ids, self.name[1])
+        self.register()
+        self._clear_reversed()
+        # Intermediate data from an earlier ``write`` would be stale
+        intermediate = projects.dir / "intermediate" / (self.filename + ".pickle")
+        if intermediate.is_file():
+            intermediate.unlink()
+        create_certain_datapackage(indices, areas, self, **extra_metadata)
+        self._refresh_reversed()
+
     def process(self, **extra_metadata):
+        self._clear_reversed()
         data = self.load()
         create_certain_datapackage(
             [(geomapping[line[0]], geomapping[line[1]]) for line in data],
@@ -45,6 +158,7 @@ class Intersection(ImpactAssessmentDataStore):
             self,
             **extra_metadata
         )
+        self._refresh_reversed()
 
 
 def calculate_needed_intersections(functional_unit, lcia_method, xtable=None, engine='geopandas'):
@@ -58,14 +172,16 @@ def calculate_needed_intersections(functional_unit, lcia_method, xtable=None, en
     ia_geocollections = RB.get_ia_geocollections()
 
     if xtable is None:
-        for (x, y) in itertools.product(inv_geocollections, ia_geocollections):
-            if (x, y) not in intersections:
-                calculate_intersection(x, y, engine=engine)
+        needed = itertools.product(inv_geocollections, ia_geocollections)
     else:
         xt_geocollections = [extension_tables[xtable]['geocollection']]
-        for (x, y) in itertools.product(inv_geocollections, xt_geocollections):
-            if (x, y) not in intersections:
-                calculate_intersection(x, y, engine=engine)
-        for (x, y) in itertools.product(xt_geocollections, ia_geocollections):
+        needed = itertools.chain(
+            itertools.product(inv_geocollections, xt_geocollections),
+            itertools.product(xt_geocollections, ia_geocollections),
+        )
+
+    # Write ``intersections.json`` once instead of after every registration
+    with batch_metadata(intersections, geocollections):
+        for (x, y) in needed:
             if (x, y) not in intersections:
                 calculate_intersection(x, y, engine=engine)
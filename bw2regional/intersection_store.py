@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+from bw_processing import INDICES_DTYPE
+
+from .directories import shared_data_dir
+from .export import reversed_geomapping
+from .intersection import Intersection
+from .locking import file_lock
+from .meta import geocollections, topocollections
+from .utils import bulk_geomapping, create_certain_datapackage
+
+STORE_ENVIRONMENT_VARIABLE = "BW2REGIONAL_INTERSECTION_STORE"
+
+
+class IntersectionStore(object):
+    """Content-addressed intersection data shared by all projects.
+
+    Intersections only depend on the spatial data of their two geocollections, so entries are keyed by the ``sha256`` of each file plus the ``field``, ``layer`` and ``band`` used. Processed ``Intersection`` datapackages contain project-specific ``geomapping`` ids, so the store instead keeps feature ids once and integer row/column codes and areas as ``.npy`` arrays. These arrays are memory-mapped when an intersection is retrieved, and only the ``geomapping`` lookup is done per project.
+
+    The default location is the ``intersections`` subdirectory of ``shared_data_dir``; set the ``BW2REGIONAL_INTERSECTION_STORE`` environment variable to use another directory, e.g. on a shared drive.
+
+    Entries are written to a temporary directory and renamed into place while holding a per-entry lock file, so concurrent writers can't corrupt the store."""
+
+    def __init__(self, dirpath=None):
+        self._dirpath = dirpath
+
+    @property
+    def dirpath(self):
+        dirpath = Path(
+            self._dirpath
+            or os.environ.get(STORE_ENVIRONMENT_VARIABLE)
+            or shared_data_dir("intersections")
+        )
+        dirpath.mkdir(parents=True, exist_ok=True)
+        return dirpath
+
+    def describe(self, name):
+        """Get the content description of geocollection ``name``, or ``None`` if it can't be shared"""
+        if name not in geocollections or name in topocollections:
+            return None
+        metadata = geocollections[name]
+        if not metadata.get("sha256"):
+            return None
+        return {key: metadata.get(key) for key in ("sha256", "field", "layer", "band")}
+
+    def key(self, first, second):
+        """Get store key for intersection ``(first, second)``, or ``None`` if not possible"""
+        descriptions = [self.describe(first), self.describe(second)]
+        if not all(descriptions):
+            return None
+        return hashlib.sha256(
+            json.dumps(descriptions, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _find(self, first, second):
+        """Return entry directory and whether it is stored in the opposite direction"""
+        for swapped, pair in ((False, (first, second)), (True, (second, first))):
+            key = self.key(*pair)
+            if key and (self.dirpath / key / "metadata.json").is_file():
+                return self.dirpath / key, swapped
+        return None, False
+
+    def __contains__(self, name):
+        return self._find(*name)[0] is not None
+
+    def add(self, first, second):
+        """Add the existing ``Intersection`` ``(first, second)`` to the store.
+
+        Returns ``False`` if the intersection can't be stored or is already present."""
+        key = self.key(first, second)
+        if key is None or (first, second) in self:
+            return False
+
+        package = Intersection((first, second)).datapackage()
+        indices, data = [], []
+        for resource in package.resources:
+            if resource["kind"] == "indices":
+                indices.append(package.get_resource(resource["name"])[0])
+                data.append(package.get_resource(resource["group"] + ".data")[0])
+        indices = np.hstack(indices) if indices else np.zeros(0, dtype=INDICES_DTYPE)
+        data = np.hstack(data) if data else np.zeros(0)
+
+        def encode(ids):
+            unique, codes = np.unique(ids, return_inverse=True)
+            labels = [key[1] for key in reversed_geomapping.lookup(unique)]
+            return labels, codes.ravel()
+
+        first_labels, rows = encode(indices["row"])
+        second_labels, cols = encode(indices["col"])
+
+        target = self.dirpath / key
+        tempdir = self.dirpath / "tmp-{}".format(uuid.uuid4().hex)
+        tempdir.mkdir()
+        try:
+            np.save(tempdir / "rows.npy", rows.astype(np.int64))
+            np.save(tempdir / "cols.npy", cols.astype(np.int64))
+            np.save(tempdir / "areas.npy", data.astype(np.float64))
+            with open(tempdir / "labels.json", "w", encoding="utf-8") as f:
+                json.dump({"first": first_labels, "second": second_labels}, f)
+            with open(tempdir / "metadata.json", "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "first": self.describe(first),
+                        "second": self.describe(second),
+                        "names": [first, second],
+                    },
+                    f,
+                    indent=2,
+                )
+            with file_lock(str(target) + ".lock"):
+                if target.is_dir():
+                    return False
+                os.rename(tempdir, target)
+        finally:
+            if tempdir.is_dir():
+                shutil.rmtree(tempdir)
+        return True
+
+    def retrieve(self, first, second):
+        """Create ``Intersection`` ``(first, second)`` and its reversed intersection in the current project from the store.
+
+        Returns the ``Intersection``, or ``None`` if the store has no matching entry."""
+        entry, swapped = self._find(first, second)
+        if entry is None:
+            return None
+
+        with open(entry / "labels.json", encoding="utf-8") as f:
+            labels = json.load(f)
+        rows = np.load(entry / "rows.npy", mmap_mode="r")
+        cols = np.load(entry / "cols.npy", mmap_mode="r")
+        areas = np.load(entry / "areas.npy", mmap_mode="r")
+        if swapped:
+            rows, cols = cols, rows
+            labels = {"first": labels["second"], "second": labels["first"]}
+
+        indices = np.empty(len(areas), dtype=INDICES_DTYPE)
+        for field, codes, name, lbls in (
+            ("row", rows, first, labels["first"]),
+            ("col", cols, second, labels["second"]),
+        ):
+            # Labels are unique, so this returns one ``geomapping`` id per label
+            indices[field] = bulk_geomapping(lbls, name)[codes] if len(codes) else []
+
+        intersection = Intersection((first, second))
+        if intersection.registered:
+            intersection.deregister()
+        intersection.register(store=entry.name)
+        create_certain_datapackage(indices, areas, intersection)
+        intersection.create_reversed_intersection()
+        return intersection
+
+
+intersection_store = IntersectionStore()
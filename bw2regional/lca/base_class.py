@@ -4,13 +4,14 @@ from functools import partial
 import matrix_utils as mu
 import numpy as np
 from bw2calc.lca import LCA
-from bw2data import Database, Method, databases, get_activity, methods
+from bw2data import Database, Method, databases, geomapping, get_activity, methods
 from scipy.sparse import coo_matrix, csr_matrix
 
 from ..errors import MissingIntersection, SiteGenericMethod, UnprocessedDatabase
-from ..export import create_geodataframe
+from ..export import create_geodataframe, reversed_geomapping, write_columnar
 from ..intersection import Intersection
 from ..meta import intersections
+from ..reporting import reporting_operators
 from ..utils import dp
 
 
@@ -32,10 +33,198 @@ def annotate_flow(flow_id, _):
     }
 
 
-class RegionalizationBase(LCA):
+CONTRIBUTION_DTYPE = np.dtype(
+    [
+        ("activity", np.int64),
+        ("flow", np.int64),
+        ("location", np.int64),
+        ("amount", np.float64),
+    ]
+)
+SPATIAL_DICTS = {"ia": "ia_spatial", "inv": "inv_spatial", "xtable": "xtable_spatial"}
+SCALE_GEOCOLLECTIONS = {
+    "ia": "ia_geocollections",
+    "inv": "inventory_geocollections",
+    "xtable": "xtable_geocollections",
+}
+
+
+def _reversed_array(dct, length):
+    """Array of the keys of ``dct`` by matrix index"""
+    reversed_dict = dct.reversed
+    return np.array([reversed_dict[x] for x in range(length)], dtype=np.int64)
+
+
+def _top_k(values, k):
+    """Indices of the ``k`` largest absolute ``values``, sorted by decreasing absolute value"""
+    if len(values) > k:
+        candidates = np.argpartition(-np.abs(values), k - 1)[:k]
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(-np.abs(values[candidates]), kind="stable")]
+
+
+class SpatialResultsMixin:
+    """Geodataframe methods for objects with ``results_*_spatial_scale`` methods, ``dicts``, and ``*_geocollections`` attributes; shared by ``RegionalizationBase`` and ``RegionalResult``."""
+
+    def results_ia_spatial_scale(self):
+        raise NotImplementedError("Must be defined in subclasses")
+
+    def results_inv_spatial_scale(self):
+        raise NotImplementedError("Must be defined in subclasses")
+
+    def location_keys(self, scale="ia"):
+        """Get the ``geomapping`` keys of the columns of the results matrix on the spatial ``scale`` (``"ia"``, ``"inv"``, or ``"xtable"``), as an object array"""
+        if scale not in SPATIAL_DICTS:
+            raise ValueError("Unknown spatial scale {}".format(scale))
+        reversed_dict = getattr(self.dicts, SPATIAL_DICTS[scale]).reversed
+        return reversed_geomapping.lookup(
+            [reversed_dict[x] for x in range(len(reversed_dict))]
+        )
+
+    def __geodataframe(
+        self,
+        matrix,
+        sum_flows,
+        annotate_flows,
+        col_dict,
+        used_geocollections,
+        cutoff,
+        filepath=None,
+        compression="zstd",
+        location_keys=None,
+    ):
+        if sum_flows:
+            matrix = coo_matrix(matrix.sum(axis=0))
+            annotate_flows = None
+        elif annotate_flows:
+            annotate_flows = annotate_flow
+
+        gdf = create_geodataframe(
+            matrix=matrix,
+            used_geocollections=used_geocollections,
+            row_dict=self.dicts.biosphere,
+            col_dict=col_dict,
+            attribute_adder=annotate_flows,
+            cutoff=cutoff,
+            location_keys=location_keys,
+        )
+        if filepath is not None:
+            write_columnar(gdf, filepath, compression)
+        return gdf
+
+    def geodataframe_xtable_spatial_scale(
+        self,
+        sum_flows=True,
+        annotate_flows=None,
+        cutoff=None,
+        filepath=None,
+        compression="zstd",
+    ):
+        if not hasattr(self, "results_xtable_spatial_scale"):
+            raise NotImplementedError
+
+        matrix = self.results_xtable_spatial_scale()
+        return self.__geodataframe(
+            matrix=matrix,
+            sum_flows=sum_flows,
+            annotate_flows=annotate_flows,
+            col_dict=self.dicts.xtable_spatial,
+            location_keys=self.location_keys("xtable"),
+            used_geocollections=self.xtable_geocollections,
+            cutoff=cutoff,
+            filepath=filepath,
+            compression=compression,
+        )
+
+    def geodataframe_ia_spatial_scale(
+        self,
+        sum_flows=True,
+        annotate_flows=None,
+        cutoff=None,
+        filepath=None,
+        compression="zstd",
+    ):
+        matrix = self.results_ia_spatial_scale()
+        return self.__geodataframe(
+            matrix=matrix,
+            sum_flows=sum_flows,
+            annotate_flows=annotate_flows,
+            col_dict=self.dicts.ia_spatial,
+            location_keys=self.location_keys("ia"),
+            used_geocollections=self.ia_geocollections,
+            cutoff=cutoff,
+            filepath=filepath,
+            compression=compression,
+        )
+
+    def geodataframe_inv_spatial_scale(
+        self,
+        sum_flows=True,
+        annotate_flows=None,
+        cutoff=None,
+        filepath=None,
+        compression="zstd",
+    ):
+        matrix = self.results_inv_spatial_scale()
+        return self.__geodataframe(
+            matrix=matrix,
+            sum_flows=sum_flows,
+            annotate_flows=annotate_flows,
+            col_dict=self.dicts.inv_spatial,
+            location_keys=self.location_keys("inv"),
+            used_geocollections=self.inventory_geocollections,
+            cutoff=cutoff,
+            filepath=filepath,
+            compression=compression,
+        )
+
+    def results_reporting_scale(self, reporting, scale="ia"):
+        """Project the results on the spatial ``scale`` (``"ia"``, ``"inv"``, or ``"xtable"``) onto the spatial units of the geocollection ``reporting``, using the cached area-weighted operators of ``reporting_operators``. Needs intersections between the geocollections of ``scale`` and ``reporting``.
+
+        Returns the results matrix, with biosphere flows as rows and reporting spatial units as columns, and a dictionary from reporting ``geomapping`` id to column index."""
+        if scale not in SCALE_GEOCOLLECTIONS:
+            raise ValueError("Unknown spatial scale {}".format(scale))
+        method = getattr(self, "results_{}_spatial_scale".format(scale), None)
+        if method is None:
+            raise ValueError("Unknown spatial scale {}".format(scale))
+
+        operator, col_dict = reporting_operators.matrix(
+            getattr(self.dicts, SPATIAL_DICTS[scale]),
+            getattr(self, SCALE_GEOCOLLECTIONS[scale]),
+            reporting,
+        )
+        return csr_matrix(method()) * operator, col_dict
+
+    def geodataframe_reporting_scale(
+        self,
+        reporting,
+        scale="ia",
+        sum_flows=True,
+        annotate_flows=None,
+        cutoff=None,
+        filepath=None,
+        compression="zstd",
+    ):
+        matrix, col_dict = self.results_reporting_scale(reporting, scale)
+        return self.__geodataframe(
+            matrix=matrix,
+            sum_flows=sum_flows,
+            annotate_flows=annotate_flows,
+            col_dict=col_dict,
+            used_geocollections=[reporting],
+            cutoff=cutoff,
+            filepath=filepath,
+            compression=compression,
+        )
+
+
+class RegionalizationBase(SpatialResultsMixin, LCA):
     def __init__(self, demand, *args, **kwargs):
         self.databases = get_dependent_databases(demand)
         self.extra_data_objs = kwargs.pop("extra_data_objs", [])
+        self.transfer_operators = {}
+        self._csr_inventory = None
         super(RegionalizationBase, self).__init__(demand, *args, **kwargs)
 
     def get_inventory_geocollections(self):
@@ -108,7 +297,7 @@ class RegionalizationBase(LCA):
         """
         self.geo_transform_mm = mu.MappedMatrix(
             packages=[
-                dp(Intersection(name).filepath_processed())
+                Intersection(name).datapackage()
                 for name in self.needed_intersections()
             ] + self.extra_data_objs,
             matrix="intersection_matrix",
@@ -185,68 +374,234 @@ class RegionalizationBase(LCA):
             matrix = summer * matrix
         return matrix
 
-    def results_ia_spatial_scale(self):
-        raise NotImplementedError("Must be defined in subclasses")
+    def spatial_scale_factors(self, scale):
+        """Get the matrices ``(A, P)`` for which the results on the spatial ``scale`` are ``A.T.multiply(self.inventory * P)``.
 
-    def results_inv_spatial_scale(self):
+        ``A`` has spatial units as rows and biosphere flows as columns, and ``P`` has activities as rows and spatial units as columns."""
         raise NotImplementedError("Must be defined in subclasses")
 
-    def __geodataframe(
-        self, matrix, sum_flows, annotate_flows, col_dict, used_geocollections, cutoff
-    ):
-        if sum_flows:
-            matrix = coo_matrix(matrix.sum(axis=0))
-            annotate_flows = None
-        elif annotate_flows:
-            annotate_flows = annotate_flow
+    def transfer_operator(self, scale="ia"):
+        """Get the matrices ``(A, P)`` from ``spatial_scale_factors``, the reverse index of ``P``, a CSR matrix with spatial units as rows and activities as columns, and the array of activity ids by row of ``P``.
+
+        The nonzero columns of each row of the reverse index are the activities with a nonzero transfer weight to that spatial unit, and its values are the transfer weights. All four are cached in ``self.transfer_operators``, which is cleared when the LCIA matrices are loaded (``load_lcia_data``) or iterated (``after_matrix_iteration``)."""
+        if scale not in self.transfer_operators:
+            A, P = self.spatial_scale_factors(scale)
+            A, P = A.tocsr(), P.tocsr()
+            index = P.T.tocsr()
+            index.eliminate_zeros()
+            activity_ids = _reversed_array(self.dicts.activity, P.shape[0])
+            self.transfer_operators[scale] = (A, P, index, activity_ids)
+        return self.transfer_operators[scale]
+
+    def _inventory_csr(self):
+        """``self.inventory`` as a CSR matrix, converted once for each new inventory"""
+        if self._csr_inventory is None or self._csr_inventory[0] is not self.inventory:
+            self._csr_inventory = (self.inventory, csr_matrix(self.inventory))
+        return self._csr_inventory[1]
+
+    def _spatial_unit_index(self, location, scale):
+        spatial_dict = getattr(self.dicts, SPATIAL_DICTS[scale])
+        try:
+            return spatial_dict[geomapping[location]]
+        except KeyError:
+            raise ValueError(
+                "Location {} not in {} spatial dict".format(location, scale)
+            )
 
-        return create_geodataframe(
-            matrix=matrix,
-            used_geocollections=used_geocollections,
-            row_dict=self.dicts.biosphere,
-            col_dict=col_dict,
-            attribute_adder=annotate_flows,
-            cutoff=cutoff,
+    def spatial_unit_activities(self, location, scale="ia"):
+        """Get the ids of the activities with a nonzero transfer weight to the spatial unit ``location`` (a ``geomapping`` key) on the spatial ``scale``.
+
+        Only uses the reverse index of ``transfer_operator``, so no results are calculated."""
+        _, _, index, activity_ids = self.transfer_operator(scale)
+        row = self._spatial_unit_index(location, scale)
+        return activity_ids[index.indices[index.indptr[row] : index.indptr[row + 1]]]
+
+    def spatial_unit_contributions(self, location, scale="ia"):
+        """Get the contributions of each activity to the LCA score in the spatial unit ``location`` (a ``geomapping`` key) on the spatial ``scale``.
+
+        Only the inventory columns of the activities in the reverse index of ``transfer_operator``, and the inventory rows of the flows characterized in ``location``, are used.
+
+        Returns a list of ``(score, activity id)`` tuples, sorted by decreasing absolute score."""
+        if not hasattr(self, "characterized_inventory"):
+            raise ValueError("Must do lcia calculation first")
+        A, _, index, activity_ids = self.transfer_operator(scale)
+        row = self._spatial_unit_index(location, scale)
+        start, stop = index.indptr[row], index.indptr[row + 1]
+        activities, weights = index.indices[start:stop], index.data[start:stop]
+        cfs = A[row]
+        inventory = self._inventory_csr()[cfs.indices][:, activities]
+        scores = (inventory.T * cfs.data) * weights
+
+        order = np.argsort(-np.abs(scores), kind="stable")
+        return list(
+            zip(scores[order].tolist(), activity_ids[activities[order]].tolist())
         )
 
-    def geodataframe_xtable_spatial_scale(
-        self, sum_flows=True, annotate_flows=None, cutoff=None
+    def top_spatial_contributions(
+        self, scale="ia", k=10, cutoff=None, activities=False, block_size=10000
     ):
-        if not hasattr(self, "results_xtable_spatial_scale"):
-            raise NotImplementedError
-
-        matrix = self.results_xtable_spatial_scale()
-        return self.__geodataframe(
-            matrix=matrix,
-            sum_flows=sum_flows,
-            annotate_flows=annotate_flows,
-            col_dict=self.dicts.xtable_spatial,
-            used_geocollections=self.xtable_geocollections,
-            cutoff=cutoff,
+        """Get the ``k`` spatial units with the largest absolute contributions to the LCA score on the spatial ``scale`` (``"ia"``, ``"inv"``, or ``"xtable"``), or the ``k`` largest pairs of activity and spatial unit if ``activities`` is true.
+
+        The flows by spatial units results matrix is not created. Contributions are calculated for blocks of ``block_size`` activities from ``spatial_scale_factors``, and immediately summed per spatial unit, or reduced to the ``k`` largest pairs with partial selection.
+
+        Contributions whose absolute value is below ``cutoff`` times the absolute LCA score are skipped. Upper bounds from the absolute values of ``A``, ``P``, and the inventory are calculated first, so that activities, and whole blocks, whose pairs can't reach this threshold or the current ``k``-th largest pair are skipped before their contributions are calculated. Likewise, only spatial units whose total can reach the threshold are summed.
+
+        Returns a list of ``(score, location)`` or ``(score, activity id, location)`` tuples, sorted by decreasing absolute score. ``location`` is the ``geomapping`` key."""
+        if not hasattr(self, "characterized_inventory"):
+            raise ValueError("Must do lcia calculation first")
+        A, P, _, activity_ids = self.transfer_operator(scale)
+        spatial_dict = SPATIAL_DICTS[scale]
+        inventory = self.inventory.tocsc()
+        threshold = abs(self.score) * cutoff if cutoff else 0
+
+        # Largest absolute transfer weight of each activity
+        weights = np.ravel(abs(P).max(axis=1).toarray())
+        if activities:
+            # No pair of an activity is larger than its largest weight times
+            # its absolute inventory times the largest absolute CFs
+            cfs = np.ravel(abs(A).max(axis=0).toarray())
+            bounds = weights * (abs(inventory).T * cfs)
+        else:
+            # No spatial unit total is larger than its absolute CFs times the
+            # absolute inventory, weighted by the largest activity weights
+            bounds = abs(A) * (abs(inventory) * weights)
+            selected = np.flatnonzero(bounds >= threshold if threshold else bounds)
+            A, P = A[selected], P[:, selected]
+            totals = np.zeros(len(selected))
+
+        values = np.zeros(0)
+        rows = cols = np.zeros(0, dtype=np.int64)
+        for start in range(0, inventory.shape[1], block_size):
+            stop = min(start + block_size, inventory.shape[1])
+            if not activities:
+                if len(selected):
+                    pairs = P[start:stop].multiply((A * inventory[:, start:stop]).T)
+                    totals += np.ravel(pairs.sum(axis=0))
+                continue
+            floor = threshold
+            if len(values) == k:
+                floor = max(floor, np.abs(values).min())
+            (active,) = np.nonzero(
+                bounds[start:stop] >= floor if floor else bounds[start:stop]
+            )
+            if not len(active):
+                continue
+            active += start
+            pairs = P[active].multiply((A * inventory[:, active]).T).tocoo()
+            mask = np.abs(pairs.data) >= threshold
+            values = np.hstack([values, pairs.data[mask]])
+            rows = np.hstack([rows, active[pairs.row[mask]]])
+            cols = np.hstack([cols, pairs.col[mask]])
+            best = _top_k(values, k)
+            values, rows, cols = values[best], rows[best], cols[best]
+
+        if not activities:
+            (found,) = np.nonzero(np.abs(totals) >= threshold if threshold else totals)
+            cols, values = selected[found], totals[found]
+        best = _top_k(values, k)
+        if not len(best):
+            return []
+
+        reversed_spatial = getattr(self.dicts, spatial_dict).reversed
+        locations = reversed_geomapping.lookup(
+            [reversed_spatial[x] for x in cols[best].tolist()]
         )
+        if not activities:
+            return list(zip(values[best].tolist(), locations))
+        return [
+            (value, activity, location)
+            for value, activity, location in zip(
+                values[best].tolist(), activity_ids[rows[best]].tolist(), locations
+            )
+        ]
 
-    def geodataframe_ia_spatial_scale(
-        self, sum_flows=True, annotate_flows=None, cutoff=None
-    ):
-        matrix = self.results_ia_spatial_scale()
-        return self.__geodataframe(
-            matrix=matrix,
-            sum_flows=sum_flows,
-            annotate_flows=annotate_flows,
-            col_dict=self.dicts.ia_spatial,
-            used_geocollections=self.ia_geocollections,
-            cutoff=cutoff,
+    def spatial_contributions(self, scale="ia", cutoff=None, block_size=1000):
+        """Yield the contributions of each activity, biosphere flow, and spatial unit on the spatial ``scale`` (``"ia"``, ``"inv"``, or ``"xtable"``) to the LCA score.
+
+        The contribution of activity ``a`` and flow ``f`` in spatial unit ``l`` is ``inventory[f, a] * P[a, l] * A[l, f]``, with ``A`` and ``P`` from ``spatial_scale_factors``. Contributions are calculated for blocks of ``block_size`` activities, so memory use is bounded by the number of inventory entries and spatial units of each block. Zero contributions, and contributions whose absolute value is below ``cutoff`` times the absolute LCA score, are left out. Inventory entries are skipped before being expanded over spatial units if their upper bound, from the largest absolute value of their row of ``P`` and column of ``A``, is zero or below this threshold.
+
+        Yields structured arrays with ``CONTRIBUTION_DTYPE``: activity ids, flow ids, ``geomapping`` location ids, and amounts."""
+        if not hasattr(self, "characterized_inventory"):
+            raise ValueError("Must do lcia calculation first")
+        A, P, _, activity_ids = self.transfer_operator(scale)
+        inventory = self.inventory.tocsc()
+        threshold = abs(self.score) * cutoff if cutoff else 0
+
+        flow_ids = _reversed_array(self.dicts.biosphere, A.shape[1])
+        location_ids = _reversed_array(
+            getattr(self.dicts, SPATIAL_DICTS[scale]), A.shape[0]
         )
+        row_lengths = np.diff(P.indptr)
+        # Largest absolute transfer weight of each activity, and CF of each flow
+        weights = np.ravel(abs(P).max(axis=1).toarray())
+        cfs = np.ravel(abs(A).max(axis=0).toarray())
+
+        for start in range(0, inventory.shape[1], block_size):
+            block = inventory[:, start : start + block_size].tocoo()
+            activities = block.col + start
+            # Skip inventory entries whose contributions are all zero or below
+            # the threshold before expanding them
+            bounds = np.abs(block.data) * weights[activities] * cfs[block.row]
+            keep = bounds >= threshold if threshold else bounds > 0
+            activities, entries = activities[keep], block.data[keep]
+            # Expand each inventory entry over the spatial units of its activity
+            counts = row_lengths[activities]
+            total = counts.sum()
+            if not total:
+                continue
+            starts = P.indptr[activities] - np.cumsum(counts) + counts
+            offsets = np.repeat(starts, counts) + np.arange(total)
+            locations = P.indices[offsets]
+            flows = np.repeat(block.row[keep], counts)
+            amounts = (
+                np.repeat(entries, counts)
+                * P.data[offsets]
+                * np.ravel(A[locations, flows])
+            )
 
-    def geodataframe_inv_spatial_scale(
-        self, sum_flows=True, annotate_flows=None, cutoff=None
+            mask = amounts != 0
+            if threshold:
+                mask &= np.abs(amounts) >= threshold
+            if not mask.any():
+                continue
+            result = np.empty(mask.sum(), dtype=CONTRIBUTION_DTYPE)
+            result["activity"] = activity_ids[np.repeat(activities, counts)[mask]]
+            result["flow"] = flow_ids[flows[mask]]
+            result["location"] = location_ids[locations[mask]]
+            result["amount"] = amounts[mask]
+            yield result
+
+    def write_spatial_contributions(
+        self, filepath, scale="ia", cutoff=None, block_size=1000, compression="zstd"
     ):
-        matrix = self.results_inv_spatial_scale()
-        return self.__geodataframe(
-            matrix=matrix,
-            sum_flows=sum_flows,
-            annotate_flows=annotate_flows,
-            col_dict=self.dicts.inv_spatial,
-            used_geocollections=self.inventory_geocollections,
-            cutoff=cutoff,
+        """Write ``spatial_contributions`` to a Parquet file at ``filepath``, with one row group per block of activities.
+
+        Returns the filepath."""
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("`pyarrow` is required for this function")
+
+        schema = pyarrow.schema(
+            [
+                (name, pyarrow.from_numpy_dtype(CONTRIBUTION_DTYPE[name]))
+                for name in CONTRIBUTION_DTYPE.names
+            ]
         )
+        with pyarrow.parquet.ParquetWriter(
+            filepath, schema, compression=compression
+        ) as writer:
+            for block in self.spatial_contributions(scale, cutoff, block_size):
+                writer.write_table(
+                    pyarrow.Table.from_arrays(
+                        [block[name] for name in schema.names], schema=schema
+                    )
+                )
+        return filepath
+
+    def regional_result(self):
+        """Get a ``RegionalResult`` with the spatial results of this calculation, which can be saved and mapped later without this LCA object."""
+        from ..results import RegionalResult
+
+        return RegionalResult.from_lca(self)
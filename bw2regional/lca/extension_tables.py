@@ -140,7 +140,7 @@ If you know these intersections are not needed, you can create empty intersectio
         """Get distribution matrix, **D**, which provides the area of inventory spatial units in each extension table spatial unit. Rows are inventory spatial units and columns are extension table spatial units."""
         self.distribution_mm = mu.MappedMatrix(
             packages=[
-                dp(Intersection(name).filepath_processed())
+                Intersection(name).datapackage()
                 for name in self.inv_xtable_intersections
             ] + self.extra_data_objs,
             matrix="intersection_matrix",
@@ -194,7 +194,7 @@ If you know these intersections are not needed, you can create empty intersectio
     def create_geo_transform_matrix(self):
         self.geo_transform_mm = mu.MappedMatrix(
             packages=[
-                dp(Intersection(name).filepath_processed())
+                Intersection(name).datapackage()
                 for name in self.xtable_ia_intersections
             ] + self.extra_data_objs,
             matrix="intersection_matrix",
@@ -207,6 +207,7 @@ If you know these intersections are not needed, you can create empty intersectio
         self.geo_transform_matrix = self.geo_transform_mm.matrix
 
     def after_matrix_iteration(self):
+        self.transfer_operators = {}
         self.distribution_normalization_matrix = (
             self.build_distribution_normalization_matrix()
         )
@@ -243,6 +244,7 @@ If you know these intersections are not needed, you can create empty intersectio
             )
 
     def load_lcia_data(self):
+        self.transfer_operators = {}
         self.create_inventory_mapping_matrix()
         self.apply_inv_mappinig_limitations()
 
@@ -314,3 +316,29 @@ If you know these intersections are not needed, you can create empty intersectio
             * self.distribution_matrix
             * self.xtable_matrix
         )
+
+    def spatial_scale_factors(self, scale):
+        distribution = (
+            self.distribution_normalization_matrix
+            * self.distribution_matrix
+            * self.xtable_matrix
+        )
+        geo_transform = (
+            self.geo_transform_normalization_matrix * self.geo_transform_matrix
+        )
+        if scale == "ia":
+            return (
+                self.reg_cf_matrix,
+                self.inv_mapping_matrix * distribution * geo_transform,
+            )
+        elif scale == "inv":
+            return (
+                distribution * geo_transform * self.reg_cf_matrix,
+                self.inv_mapping_matrix,
+            )
+        elif scale == "xtable":
+            return (
+                geo_transform * self.reg_cf_matrix,
+                self.inv_mapping_matrix * distribution,
+            )
+        raise ValueError("Unknown spatial scale {}".format(scale))
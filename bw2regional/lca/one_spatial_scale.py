@@ -38,9 +38,13 @@ class OneSpatialScaleLCA(RegionalizationBase):
             )
 
     def load_lcia_data(self):
+        self.transfer_operators = {}
         self.create_inventory_mapping_matrix()
         self.create_regionalized_characterization_matrix(self.inv_mapping_mm.col_mapper)
 
+    def after_matrix_iteration(self):
+        self.transfer_operators = {}
+
     def lcia_calculation(self):
         """Do regionalized LCA calculation.
 
@@ -58,3 +62,8 @@ class OneSpatialScaleLCA(RegionalizationBase):
         if not hasattr(self, "characterized_inventory"):
             raise ValueError("Must do lcia calculation first")
         return self.reg_cf_matrix.T.multiply(self.inventory * self.inv_mapping_matrix)
+
+    def spatial_scale_factors(self, scale):
+        if scale == "inv":
+            return self.reg_cf_matrix, self.inv_mapping_matrix
+        raise ValueError("Unknown spatial scale {}".format(scale))
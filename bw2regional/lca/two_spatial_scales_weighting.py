@@ -43,6 +43,7 @@ class TwoSpatialScalesWithGenericLoadingLCA(RegionalizationBase):
         self.ia_geocollections = self.get_ia_geocollections()
 
     def load_lcia_data(self):
+        self.transfer_operators = {}
         self.create_inventory_mapping_matrix()
         self.create_regionalized_characterization_matrix()
         self.create_geo_transform_matrix()
@@ -50,6 +51,7 @@ class TwoSpatialScalesWithGenericLoadingLCA(RegionalizationBase):
         self.normalization_matrix = self.build_normalization_matrix()
 
     def after_matrix_iteration(self):
+        self.transfer_operators = {}
         self.normalization_matrix = self.build_normalization_matrix()
 
     def build_normalization_matrix(self):
@@ -100,3 +102,20 @@ class TwoSpatialScalesWithGenericLoadingLCA(RegionalizationBase):
             * self.loading_matrix
             * self.reg_cf_matrix
         ).T.multiply(self.inventory * self.inv_mapping_matrix)
+
+    def spatial_scale_factors(self, scale):
+        if scale == "ia":
+            return self.reg_cf_matrix, (
+                self.inv_mapping_matrix
+                * self.normalization_matrix
+                * self.geo_transform_matrix
+                * self.loading_matrix
+            )
+        elif scale == "inv":
+            return (
+                self.normalization_matrix
+                * self.geo_transform_matrix
+                * self.loading_matrix
+                * self.reg_cf_matrix
+            ), self.inv_mapping_matrix
+        raise ValueError("Unknown spatial scale {}".format(scale))
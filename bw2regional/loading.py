@@ -1,11 +1,13 @@
 import os
 
-from bw2data import geomapping
+import numpy as np
+from bw2data import geomapping, projects
 from bw2data.data_store import ProcessedDataStore
+from bw_processing import INDICES_DTYPE
 
 from .meta import loadings
-from .utils import create_certain_datapackage
-from .validate import loading_validator
+from .utils import bulk_geomapping, create_certain_datapackage, dp
+from .validate import array_data, loading_validator
 
 
 class Loading(ProcessedDataStore):
@@ -28,6 +30,38 @@ class Loading(ProcessedDataStore):
             **extra_metadata
         )
 
+    def datapackage(self):
+        """Load the processed datapackage, memory-mapping its arrays if it was written with the ``directory`` layout."""
+        return dp(str(self.filepath_processed()))
+
+    def write_arrays(self, ids, values, geocollection=None, **extra_metadata):
+        """Write loading data from an array of feature ids and an array of values.
+
+        Locations are ``(geocollection, id)``, or just ``id`` if ``geocollection`` is ``None``. Validation and ``geomapping`` resolution are vectorized, and the processed datapackage is written directly, so no intermediate data is stored, and ``self.load()`` and ``self.process()`` are not available. Values can't have uncertainty."""
+        values = array_data(values, ids)
+        indices = np.zeros(len(values), dtype=INDICES_DTYPE)
+        indices["row"] = bulk_geomapping(ids, geocollection)
+        self.register()
+        # Intermediate data from an earlier ``write`` would be stale
+        intermediate = projects.dir / "intermediate" / (self.filename + ".pickle")
+        if intermediate.is_file():
+            intermediate.unlink()
+        create_certain_datapackage(indices, values, self, **extra_metadata)
+
+    def import_from_map(self, geocollection, label=1, mask=None, filepath=None):
+        """Import loading values for the spatial units of the IA ``geocollection``.
+
+        ``label`` is the field name for vector geocollections, and the band number for raster geocollections. Values are read as an array, and missing, ``NaN``, ``mask``, and raster nodata values are skipped.
+
+        ``filepath`` is an optional file with the loading values, if they are not in the geocollection file itself. For raster geocollections, it must be on the same grid, so that each cell gets the loading of the IA cell at the same position. Raster cells get the same ``Cell(x, y)`` feature ids as in raster CFs and Pandarus intersections; see ``raster_cell_labels``."""
+        from .utils import feature_labels, read_geocollection_values
+
+        ids, columns = read_geocollection_values(geocollection, [label], mask, filepath)
+        valid, values = columns[label]
+        self.write_arrays(
+            feature_labels(geocollection, ids[valid]), values[valid], geocollection
+        )
+
     @property
     def filename(self):
         return super(Loading, self).filename + ".loading"
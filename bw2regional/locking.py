@@ -0,0 +1,30 @@
+import os
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(filepath, timeout=600, poll_interval=0.1, stale_after=3600):
+    """Exclusive lock using a lock file created with ``O_EXCL``, which works across processes and platforms.
+
+    Lock files older than ``stale_after`` seconds are assumed to be left over from a crashed process and are removed."""
+    start = time.time()
+    while True:
+        try:
+            fd = os.open(filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(filepath) > stale_after:
+                    os.remove(filepath)
+                    continue
+            except OSError:
+                continue
+            if time.time() - start > timeout:
+                raise TimeoutError("Can't acquire lock {}".format(filepath))
+            time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(filepath)
@@ -1,23 +1,72 @@
+from contextlib import ExitStack, contextmanager
+from copy import deepcopy
 from pathlib import Path
 
 from bw2data.serialization import CompoundJSONDict, SerializedDict
 
-from .hashing import sha256
-
-
-class Loadings(SerializedDict):
+from .hashing import sha256, sha256_many
+from .locking import file_lock
+
+
+class TransactionalDict(object):
+    """Mixin for ``SerializedDict`` classes which can batch writes, and which don't overwrite changes from other processes.
+
+    Each flush takes a lock file, rereads the file on disk, and only applies the keys which were added, changed, or deleted in this process since the last flush. The file itself is written atomically by ``SerializedDict.serialize``."""
+
+    _batch_depth = 0
+
+    def load(self):
+        super(TransactionalDict, self).load()
+        self._synced = deepcopy(self.data)
+
+    def flush(self, signal=True):
+        if self._batch_depth:
+            return
+        synced = getattr(self, "_synced", {})
+        with file_lock(str(self.filepath) + ".lock", stale_after=60):
+            try:
+                merged = self.deserialize()
+            except (IOError, ValueError):
+                merged = {}
+            for key in synced:
+                if key not in self.data:
+                    merged.pop(key, None)
+            for key, value in self.data.items():
+                # Keep our own objects so references to changed values stay valid
+                if key not in synced or synced[key] != value:
+                    merged[key] = value
+            self.data.clear()
+            self.data.update(merged)
+            self.serialize(signal=signal)
+        self._synced = deepcopy(self.data)
+
+    @contextmanager
+    def batch(self):
+        """Context manager which defers writing until the block finishes, and then writes all changes once.
+
+        Changes are written even if the block raises an exception, as they would have been without ``batch``. Can be nested."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush()
+
+
+class Loadings(TransactionalDict, SerializedDict):
     """Metadata on regionalized LCIA weightings."""
 
     filename = "loadings.json"
 
 
-class Intersections(CompoundJSONDict):
+class Intersections(TransactionalDict, CompoundJSONDict):
     """Areal intersections between the elements of two geo- or topocollections"""
 
     filename = "intersections.json"
 
 
-class Geocollections(SerializedDict):
+class Geocollections(TransactionalDict, SerializedDict):
     """Metadata for spatial data sets."""
 
     filename = "geocollections.json"
@@ -33,6 +82,18 @@ class Geocollections(SerializedDict):
             value["kind"] = get_spatial_dataset_kind(value["filepath"])
         super(Geocollections, self).__setitem__(key, value)
 
+    def update(self, other=(), **kwargs):
+        """Register many collections, hashing their files in parallel first"""
+        other = dict(other, **kwargs)
+        sha256_many(
+            value["filepath"]
+            for value in other.values()
+            if Path(value.get("filepath") or "").is_file()
+        )
+        with self.batch():
+            for key, value in other.items():
+                self[key] = value
+
 
 class Topocollections(Geocollections):
     """Mappings from geocollections to a set of topographical face ids."""
@@ -52,7 +113,7 @@ class Topocollections(Geocollections):
         super(Topocollections, self).__setitem__(key, value)
 
 
-class ExtensionTables(SerializedDict):
+class ExtensionTables(TransactionalDict, SerializedDict):
     """Metadata for extension tables that give loadings on a third spatial scale."""
 
     filename = "extension-tables.json"
@@ -63,3 +124,18 @@ geocollections = Geocollections()
 intersections = Intersections()
 loadings = Loadings()
 topocollections = Topocollections()
+
+
+@contextmanager
+def batch_metadata(*stores):
+    """Batch writes to several metadata stores, by default all of them. See ``TransactionalDict.batch``."""
+    with ExitStack() as stack:
+        for store in stores or (
+            extension_tables,
+            geocollections,
+            intersections,
+            loadings,
+            topocollections,
+        ):
+            stack.enter_context(store.batch())
+        yield
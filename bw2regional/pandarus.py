@@ -1,9 +1,14 @@
+import bz2
+import itertools
+import json
 import os
+import re
 
 import numpy as np
 import pandas as pd
 from bw2data import JsonWrapper, geomapping
 from bw_processing import INDICES_DTYPE
+from scipy import sparse
 
 from . import (
     ExtensionTable,
@@ -13,12 +18,23 @@ from . import (
     intersections,
     topocollections,
 )
-from .utils import create_certain_datapackage
+from .utils import (
+    bulk_geomapping,
+    create_certain_datapackage,
+    normalize_cell_labels,
+)
 
 
 def relabel(data, first, second):
-    """Add geocollection names to geo identifiers"""
-    return [((first, a), (second, b), c) for a, b, c in data]
+    """Add geocollection names to geo identifiers.
+
+    Raster cell ids are normalized with ``normalize_cell_labels``."""
+    first_ids = normalize_cell_labels([row[0] for row in data], first)
+    second_ids = normalize_cell_labels([row[1] for row in data], second)
+    return [
+        ((first, a), (second, b), row[2])
+        for a, b, row in zip(first_ids, second_ids, data)
+    ]
 
 
 def load_file(filepath):
@@ -32,6 +48,108 @@ def load_file(filepath):
     return obj["metadata"], obj["data"]
 
 
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _JSONStream(object):
+    """Minimal incremental JSON reader for the Pandarus output format.
+
+    Only a small text buffer is held in memory; values are decoded one at a time with ``json.JSONDecoder.raw_decode``."""
+
+    def __init__(self, fileobj, buffer_size):
+        self.fileobj = fileobj
+        self.buffer_size = buffer_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Drop the consumed part of the buffer and read another chunk. Returns ``False`` at end of file."""
+        chunk = self.fileobj.read(self.buffer_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            elif not self.fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(
+                "Invalid Pandarus file: expected '{}', found '{}'".format(char, found)
+            )
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A value which ends exactly at the end of the buffer could be truncated
+            if end == len(self.buffer) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return obj
+
+    def array(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            if char not in (",", "]"):
+                raise ValueError("Invalid Pandarus file: unterminated array")
+            self.pos += 1
+            if char == "]":
+                return
+
+
+def _open_text(filepath):
+    with open(filepath, "rb") as f:
+        compressed = f.read(3) == b"BZh"
+    if compressed:
+        return bz2.open(filepath, "rt", encoding="utf-8")
+    return open(filepath, encoding="utf-8")
+
+
+def iter_file(filepath, buffer_size=2**20):
+    """Incrementally parse Pandarus JSON output file.
+
+    Yields ``(key, value)`` for each top-level key. For ``data``, ``value`` is an iterator over the result rows, which is exhausted automatically before the next key is read. Memory use is bounded by ``buffer_size`` and a single row, whatever the size of the file."""
+    with _open_text(filepath) as f:
+        stream = _JSONStream(f, buffer_size)
+        stream.expect("{")
+        while stream.peek() not in ("}", ""):
+            key = stream.value()
+            stream.expect(":")
+            if key == "data":
+                rows = stream.array()
+                yield key, rows
+                for _ in rows:
+                    pass
+            else:
+                yield key, stream.value()
+            if stream.peek() == ",":
+                stream.pos += 1
+        stream.expect("}")
+
+
 def get_possible_collections(kwargs):
     """Return all geo- and topocollections for a file hash.
 
@@ -110,6 +228,195 @@ def import_from_pandarus(fp):
     return first, second
 
 
+def read_metadata(filepath):
+    """Read the metadata of a Pandarus JSON output file without loading its data.
+
+    Result rows before the metadata are parsed and discarded one at a time, so memory use is bounded."""
+    items = iter_file(filepath)
+    try:
+        for key, value in items:
+            if key == "metadata":
+                return value
+    finally:
+        items.close()
+
+
+def _stream_codes(fp, chunk_size):
+    """Read the result rows of Pandarus file ``fp``, replacing feature ids by integer codes in chunks of ``chunk_size`` rows.
+
+    Returns the two ``{feature id: code}`` dictionaries, and arrays of first codes, second codes, and areas."""
+    labels = ({}, {})
+    row_codes, col_codes, areas = [], [], []
+
+    def encode(column, lookup):
+        return np.fromiter(
+            (lookup.setdefault(x, len(lookup)) for x in column), dtype=np.int64
+        )
+
+    for key, value in iter_file(fp):
+        if key != "data":
+            continue
+        while True:
+            chunk = list(itertools.islice(value, chunk_size))
+            if not chunk:
+                break
+            first_ids, second_ids, chunk_areas = zip(*chunk)
+            row_codes.append(encode(first_ids, labels[0]))
+            col_codes.append(encode(second_ids, labels[1]))
+            areas.append(np.array(chunk_areas, dtype=np.float64))
+
+    concat = lambda arrays, dtype: np.hstack(arrays) if arrays else np.zeros(0, dtype)
+    return (
+        labels,
+        concat(row_codes, np.int64),
+        concat(col_codes, np.int64),
+        concat(areas, np.float64),
+    )
+
+
+def stream_import_from_pandarus(fp, chunk_size=1000000):
+    """Load output file from Pandarus job without holding its contents in memory.
+
+    Behaves like ``import_from_pandarus``, but parses the file incrementally with ``iter_file``. The metadata, geocollections, and existing intersections are checked first, with ``read_metadata``. Feature ids are then replaced by integer codes while reading, in chunks of ``chunk_size`` rows, and converted to ``geomapping`` ids in bulk at the end. The processed ``Intersection`` arrays for both directions are written directly; no intermediate data is stored.
+
+    Topographical intersections are streamed in the same way, and squashed to the linked geocollection(s) with sparse matrix products.
+
+    """
+    assert os.path.isfile(fp)
+
+    metadata = read_metadata(fp)
+    assert metadata, "Invalid metadata in file"
+    assert "first" in metadata and "second" in metadata, "Invalid metadata in file"
+
+    first_collections = get_possible_collections(metadata["first"])
+    second_collections = get_possible_collections(metadata["second"])
+
+    assert not first_collections.intersection(
+        second_collections
+    ), "Overlapping geocollections"
+
+    if "topocollection" in {x[1] for x in second_collections}.union(
+        {x[1] for x in first_collections}
+    ):
+        return stream_topographical_intersection(
+            fp, first_collections, second_collections, chunk_size
+        )
+
+    assert len(first_collections) == 1, "Must intersect with exactly one geocollection"
+    assert len(second_collections) == 1, "Must intersect with exactly one geocollection"
+    first = first_collections.pop()[0]
+    second = second_collections.pop()[0]
+
+    assert (
+        first,
+        second,
+    ) not in intersections, "Intersection between {} and {} already exists".format(
+        first, second
+    )
+
+    labels, row_codes, col_codes, data_array = _stream_codes(fp, chunk_size)
+    first_ids = bulk_geomapping(normalize_cell_labels(labels[0], first), first)
+    second_ids = bulk_geomapping(normalize_cell_labels(labels[1], second), second)
+
+    indices_array = np.empty(len(data_array), dtype=INDICES_DTYPE)
+    indices_array["row"] = first_ids[row_codes]
+    del row_codes
+    indices_array["col"] = second_ids[col_codes]
+    del col_codes
+
+    intersection = Intersection((first, second))
+    intersection.register(filepath=fp)
+    create_certain_datapackage(indices_array, data_array, intersection)
+    intersection.create_reversed_intersection()
+
+    return first, second
+
+
+def stream_topographical_intersection(
+    fp, first_collections, second_collections, chunk_size=1000000
+):
+    """Streaming version of ``handle_topographical_intersection``.
+
+    The result rows are read as integer codes with ``_stream_codes``, and summed into a sparse matrix of topographical faces by features. For each topography, a sparse matrix of regions by faces is built from the ``Topography`` data, and their product gives the intersected areas of regions and features."""
+    first_labels = {x[1] for x in first_collections}
+    second_labels = {x[1] for x in second_collections}
+    if first_labels == {"topocollection"}:
+        assert (
+            len(second_collections) == 1
+        ), "Must intersect with exactly one geocollection"
+        assert second_labels == {
+            "geocollection"
+        }, "Must intersect topography with geocollections"
+        reverse = False
+    elif second_labels == {"topocollection"}:
+        assert (
+            len(first_collections) == 1
+        ), "Must intersect with exactly one geocollection"
+        assert first_labels == {
+            "geocollection"
+        }, "Must intersect topography with geocollections"
+        first_collections, second_collections = second_collections, first_collections
+        reverse = True
+    else:
+        raise ValueError(
+            "Intersections between mixed topocollections and "
+            "geocollections are not supported"
+        )
+
+    topographies = [name for name, kind in first_collections]
+    topo_geocollections = [
+        topocollections[name]["geocollection"] for name in topographies
+    ]
+    other_geocollection = list(second_collections)[0][0]
+
+    for name in topo_geocollections:
+        assert (
+            other_geocollection,
+            name,
+        ) not in intersections, "Intersection between {} and {} already exists".format(
+            other_geocollection, name
+        )
+
+    labels, row_codes, col_codes, areas = _stream_codes(fp, chunk_size)
+    if reverse:
+        labels, row_codes, col_codes = labels[::-1], col_codes, row_codes
+    face_codes, feature_labels = labels
+    feature_ids = bulk_geomapping(
+        normalize_cell_labels(feature_labels, other_geocollection), other_geocollection
+    )
+    faces = sparse.coo_matrix(
+        (areas, (row_codes, col_codes)),
+        shape=(len(face_codes), len(feature_labels)),
+    ).tocsr()
+    del row_codes, col_codes, areas
+
+    for topography, name in zip(topographies, topo_geocollections):
+        print("Merging topographical faces for geocollection {}".format(name))
+        regions, rows, cols = [], [], []
+        for key, face_ids in Topography(topography).load().items():
+            codes = [face_codes[x] for x in face_ids if x in face_codes]
+            rows.extend([len(regions)] * len(codes))
+            cols.extend(codes)
+            regions.append(geomapping[key])
+        membership = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(regions), len(face_codes))
+        )
+        merged = (membership * faces).tocoo()
+        assert merged.nnz, "Empty intersection"
+
+        indices_array = np.empty(merged.nnz, dtype=INDICES_DTYPE)
+        indices_array["row"] = np.array(regions, dtype=np.int64)[merged.row]
+        indices_array["col"] = feature_ids[merged.col]
+
+        print("Creating intersection ({}, {})".format(name, other_geocollection))
+        intersection = Intersection((name, other_geocollection))
+        intersection.register(filepath=fp)
+        create_certain_datapackage(indices_array, merged.data, intersection)
+        intersection.create_reversed_intersection()
+
+    return [(n, other_geocollection) for n in topo_geocollections]
+
+
 def handle_topographical_intersection(
     metadata, data, first_collections, second_collections, filepath
 ):
@@ -140,9 +447,10 @@ def handle_topographical_intersection(
             "geocollection"
         }, "Must intersect topography with geocollections"
         lbl = list(second_collections)[0][0]
-        geomapping.add({(lbl, y) for x, y, z in data})
+        features = normalize_cell_labels([y for x, y, z in data], lbl)
+        geomapping.add({(lbl, y) for y in features})
         data = pd.DataFrame(
-            [(x, geomapping[(lbl, y)], z) for x, y, z in data],
+            [(x, geomapping[(lbl, y)], z) for (x, _, z), y in zip(data, features)],
             columns=["topo_id", "feature_mapped_id", "area"],
         )
     elif second_labels == {"topocollection"}:
@@ -153,9 +461,10 @@ def handle_topographical_intersection(
             "geocollection"
         }, "Must intersect topography with geocollections"
         lbl = list(first_collections)[0][0]
-        geomapping.add({(lbl, x) for x, y, z in data})
+        features = normalize_cell_labels([x for x, y, z in data], lbl)
+        geomapping.add({(lbl, x) for x in features})
         data = pd.DataFrame(
-            [(y, geomapping[(lbl, x)], z) for x, y, z in data],
+            [(y, geomapping[(lbl, x)], z) for (_, y, z), x in zip(data, features)],
             columns=["topo_id", "feature_mapped_id", "area"],
         )
         metadata["first"], metadata["second"] = metadata["second"], metadata["first"]
@@ -227,15 +536,7 @@ def handle_topographical_intersection(
         intersection.register(filepath=filepath)
 
         create_certain_datapackage(indices_arrays, data_arrays, intersection)
-
-        flipped_indices = np.zeros_like(indices_arrays, dtype=INDICES_DTYPE)
-        flipped_indices["row"] = indices_arrays["col"]
-        flipped_indices["col"] = indices_arrays["row"]
-
-        other_intersection = Intersection((other_geocollection, name))
-        other_intersection.register(filepath=filepath)
-
-        create_certain_datapackage(flipped_indices, data_arrays, other_intersection)
+        intersection.create_reversed_intersection()
 
     return [(n, other_geocollection) for n in topo_geocollections]
 
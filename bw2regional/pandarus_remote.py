@@ -1,13 +1,24 @@
+import asyncio
+import hashlib
+import json
 import os
+import re
+import shutil
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import requests
 import wrapt
 from bw2data import config, projects
+from requests.adapters import HTTPAdapter
 
 from . import geocollections, intersections, topocollections
+from .directories import shared_data_dir
 from .errors import WindowsPathCharacterLimit
+from .locking import file_lock
+from .meta import batch_metadata
 from .pandarus import import_from_pandarus, import_xt_from_rasterstats
 from .utils import hash_collection
 
@@ -30,15 +41,138 @@ class AlreadyExists(Exception):
     pass
 
 
+class MultipartUpload(object):
+    """Streaming ``multipart/form-data`` body which hashes the file while sending it.
+
+    The ``sha256`` form field is sent after the file, and contains the hash of the bytes which were actually sent. As the hash has a fixed length, the body length is known in advance and no chunked transfer encoding is needed."""
+
+    def __init__(self, filepath, fields, blocksize=2**20):
+        self.filepath = filepath
+        self.blocksize = blocksize
+        self.boundary = uuid.uuid4().hex
+        self.hasher = hashlib.sha256()
+        self.head = b"".join(
+            self._field(key, value) for key, value in fields.items()
+        ) + (
+            '--{}\r\nContent-Disposition: form-data; name="file"; filename="{}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n".format(
+                self.boundary, os.path.basename(filepath)
+            ).encode("utf-8")
+        )
+        self.tail_length = len(self._tail("0" * 64))
+        self.size = os.path.getsize(filepath)
+
+    @property
+    def content_type(self):
+        return "multipart/form-data; boundary=" + self.boundary
+
+    def _field(self, name, value):
+        return '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(
+            self.boundary, name, value
+        ).encode("utf-8")
+
+    def _tail(self, digest):
+        closing = "--{}--\r\n".format(self.boundary).encode("utf-8")
+        return b"\r\n" + self._field("sha256", digest) + closing
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+    def __len__(self):
+        return len(self.head) + self.size + self.tail_length
+
+    def __iter__(self):
+        self.hasher = hashlib.sha256()
+        yield self.head
+        with open(self.filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(self.blocksize), b""):
+                self.hasher.update(chunk)
+                yield chunk
+        yield self._tail(self.hexdigest())
+
+
+class DownloadCache(object):
+    """Content-addressed cache of files downloaded from ``PandarusRemote`` servers, shared by all projects.
+
+    Completed files are stored as ``objects/<sha256>/<filename>``, and indexed by the request (server URL and form data) which produced them, so the same result is never downloaded twice. Incomplete downloads are kept in ``partial`` and resumed with HTTP range requests.
+
+    Downloads of the same request are serialized with a per-request lock file, so concurrent processes don't write to the same incomplete file.
+
+    The default location is the ``downloads`` subdirectory of ``shared_data_dir``; set the ``BW2REGIONAL_DOWNLOAD_CACHE`` environment variable to use another directory."""
+
+    def __init__(self, dirpath=None):
+        self._dirpath = dirpath
+
+    @property
+    def dirpath(self):
+        dirpath = Path(
+            self._dirpath
+            or os.environ.get("BW2REGIONAL_DOWNLOAD_CACHE")
+            or shared_data_dir("downloads")
+        )
+        dirpath.mkdir(parents=True, exist_ok=True)
+        return dirpath
+
+    def _subdir(self, name):
+        dirpath = self.dirpath / name
+        dirpath.mkdir(exist_ok=True)
+        return dirpath
+
+    @staticmethod
+    def request_key(url, data):
+        return hashlib.sha256(
+            json.dumps([url, data], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        """Return filepath of completed download for request ``key``, or ``None``"""
+        try:
+            with open(self._subdir("requests") / (key + ".json"), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        filepath = self._subdir("objects") / entry["sha256"] / entry["filename"]
+        return filepath if filepath.is_file() else None
+
+    def lock(self, key):
+        """Lock for downloading request ``key``; see ``locking.file_lock``"""
+        return file_lock(str(self._subdir("partial") / (key + ".lock")))
+
+    def partial(self, key):
+        """Return filepaths for the incomplete data and metadata of request ``key``"""
+        dirpath = self._subdir("partial")
+        return dirpath / (key + ".part"), dirpath / (key + ".json")
+
+    def add(self, key, filepath, sha256, filename):
+        """Move completed download ``filepath`` into the cache. Returns its new filepath."""
+        target = self._subdir("objects") / sha256
+        target.mkdir(exist_ok=True)
+        target = target / filename
+        os.replace(filepath, target)
+        index = self._subdir("requests") / (key + ".json")
+        tmp = index.with_suffix(".{}.tmp".format(uuid.uuid4().hex))
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"sha256": sha256, "filename": filename}, f)
+        os.replace(tmp, index)
+        return target
+
+    def clear(self):
+        shutil.rmtree(self.dirpath)
+
+
+download_cache = DownloadCache()
+
+
 class PendingJob(object):
     """A calculation job enqueued on a remote server"""
 
-    def __init__(self, url):
+    def __init__(self, url, session=None):
         self.url = url
+        self.session = session or requests
 
     @property
     def status(self):
-        response = requests.get(self.url)
+        response = self.session.get(self.url)
         if response.status_code != 404:
             return response.text
         else:
@@ -69,37 +203,67 @@ def run_job(job=None):
 
 @wrapt.decorator
 def check_alive(wrapped, instance, args, kwargs):
-    if not instance.alive:
-        raise RemoteError("Can't reach {}".format(instance.url))
-    return wrapped(*args, **kwargs)
+    """Raise ``RemoteError`` if the server can't be reached.
+
+    Failed connections are caught from the actual requests, instead of checking with an extra request beforehand."""
+    try:
+        return wrapped(*args, **kwargs)
+    except requests.ConnectionError as e:
+        raise RemoteError("Can't reach {}".format(instance.url)) from e
 
 
 class PandarusRemote(object):
     """Interaction with `pandarus_remote <https://github.com/cmutel/pandarus_remote>`__ web service.
 
-    Default URL is `https://pandarus.brightway.dev`."""
+    Default URL is `https://pandarus.brightway.dev`.
+
+    All requests go through one pooled ``requests.Session``, so connections are reused. The server catalog is cached for ``catalog_ttl`` seconds. ``upload_collections``, ``calculate_intersections`` and ``fetch_intersections`` use up to ``max_workers`` parallel connections.
 
-    def __init__(self, url=None):
+    Uploads are streamed and hashed while sending. Downloads are verified against the ``ETag`` SHA256 hash if the server provides one, resumed after interruptions, and kept in the ``DownloadCache`` ``cache``."""
+
+    def __init__(
+        self,
+        url=None,
+        catalog_ttl=60,
+        max_workers=4,
+        timeout=None,
+        cache=download_cache,
+    ):
         self.url = url or "https://pandarus.brightway.dev"
         if self.url[-1] == "/":
             self.url = self.url[:-1]
+        self.catalog_ttl = catalog_ttl
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self._session = None
+        self._catalog = None
+        self._catalog_time = 0
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=self.max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def _request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, self.url + path, **kwargs)
 
     @property
     def alive(self):
-        return requests.get(self.url).status_code == 200
+        try:
+            return self._request("GET", "").status_code == 200
+        except requests.ConnectionError:
+            return False
 
-    def _download_file(self, resp):
-        assert "Content-Disposition" in resp.headers
+    def _project_filepath(self, filename):
         download_dirpath = projects.request_directory("regional")
-
-        filepath = os.path.abspath(
-            os.path.join(
-                download_dirpath,
-                resp.headers["Content-Disposition"].replace(
-                    "attachment; filename=", ""
-                ),
-            )
-        )
+        filepath = os.path.abspath(os.path.join(download_dirpath, filename))
 
         if config._windows and len(str(filepath)) > 250:
             # Windows has an absolute limit of 255 characters in a filepath
@@ -117,23 +281,99 @@ class PandarusRemote(object):
                     uuid.uuid4().hex + filepath.split(".")[-1],
                 )
             )
+        return filepath
+
+    def _download(self, path, data, key):
+        """Download result file from ``path`` into the cache, resuming an incomplete earlier download if possible"""
+        part, part_metadata = self.cache.partial(key)
+        hasher, headers = hashlib.sha256(), {}
+        if part.is_file() and part_metadata.is_file():
+            with open(part_metadata, encoding="utf-8") as f:
+                etag = json.load(f).get("etag")
+            if etag:
+                headers = {
+                    "Range": "bytes={}-".format(part.stat().st_size),
+                    "If-Range": etag,
+                }
+
+        resp = self._request("POST", path, data=data, headers=headers, stream=True)
+        if resp.status_code == 404:
+            resp.close()
+            raise NotYetCalculated(
+                "Not yet calculated; Run `.calculate_intersection` first."
+            )
+        if resp.status_code == 206:
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(2**20), b""):
+                    hasher.update(chunk)
+            mode = "ab"
+        else:
+            self.handle_errors(resp)
+            mode = "wb"
 
-        chunk = 128 * 1024
-        with open(filepath, "wb") as f:
-            while True:
-                segment = resp.raw.read(chunk)
-                if not segment:
-                    break
-                f.write(segment)
+        assert "Content-Disposition" in resp.headers
+        filename = resp.headers["Content-Disposition"].replace(
+            "attachment; filename=", ""
+        )
+        etag = resp.headers.get("ETag")
+        with open(part_metadata, "w", encoding="utf-8") as f:
+            json.dump({"etag": etag, "filename": filename}, f)
+
+        with resp, open(part, mode) as f:
+            try:
+                for segment in resp.iter_content(2**20):
+                    hasher.update(segment)
+                    f.write(segment)
+            except requests.RequestException as e:
+                raise RemoteError(
+                    "Download from {} interrupted; call again to resume".format(
+                        self.url + path
+                    )
+                ) from e
+
+        digest = hasher.hexdigest()
+        expected = (etag or "").strip('"')
+        if re.fullmatch("[0-9a-f]{64}", expected) and expected != digest:
+            part.unlink()
+            part_metadata.unlink()
+            raise RemoteError("Downloaded file doesn't match hash from server")
+        part_metadata.unlink()
+        return self.cache.add(key, part, digest, filename)
+
+    def _fetch(self, path, data):
+        """Get result file from ``path``, downloading it only if not in the cache.
+
+        Returns filepath of a copy in the project directory. Raises ``NotYetCalculated`` if not available."""
+        key = self.cache.request_key(self.url + path, data)
+        cached = self.cache.get(key)
+        if cached is None:
+            with self.cache.lock(key):
+                # Another process could have finished the download in the meantime
+                cached = self.cache.get(key) or self._download(path, data, key)
+        filepath = self._project_filepath(cached.name)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        try:
+            os.link(cached, filepath)
+        except OSError:
+            shutil.copyfile(cached, filepath)
         return filepath
 
     @check_alive
-    def catalog(self):
-        return requests.get(self.url + "/catalog").json()
+    def catalog(self, refresh=False):
+        """Get the server catalog. Reuses the last response for ``catalog_ttl`` seconds unless ``refresh``."""
+        if (
+            refresh
+            or self._catalog is None
+            or time.time() - self._catalog_time > self.catalog_ttl
+        ):
+            self._catalog = self._request("GET", "/catalog").json()
+            self._catalog_time = time.time()
+        return self._catalog
 
     @check_alive
     def status(self, url):
-        return requests.get(self.url + url).text
+        return self._request("GET", url).text
 
     @check_alive
     def upload(self, collection):
@@ -155,20 +395,28 @@ class PandarusRemote(object):
             print(f"Geocollection {collection} is already uploaded")
             return
 
-        url = self.url + "/upload"
-        data = {
-            "layer": metadata.get("layer") or "",
-            "field": metadata.get("field") or "",
-            "band": metadata.get("band") or "",
-            "sha256": collection_hash,
-            "name": os.path.basename(metadata["filepath"]),
-        }
-        files = {"file": open(metadata["filepath"], "rb")}
-        resp = requests.post(url, data=data, files=files)
-        if resp.status_code == 200:
-            return resp.json()
-        else:
+        body = MultipartUpload(
+            metadata["filepath"],
+            {
+                "layer": metadata.get("layer") or "",
+                "field": metadata.get("field") or "",
+                "band": metadata.get("band") or "",
+                "name": os.path.basename(metadata["filepath"]),
+            },
+        )
+        resp = self._request(
+            "POST", "/upload", data=body, headers={"Content-Type": body.content_type}
+        )
+        if resp.status_code != 200:
             raise RemoteError("{}: {}".format(resp.status_code, resp.text))
+        # Catalog now lacks this file
+        self._catalog = None
+        if body.hexdigest() != collection_hash:
+            raise ValueError(
+                "File for collection {} changed since it was registered; "
+                "register it again".format(collection)
+            )
+        return resp.json()
 
     @check_alive
     def intersection(self, collection_one, collection_two):
@@ -184,18 +432,7 @@ class PandarusRemote(object):
         first = self.hash_and_upload(collection_one, catalog)
         second = self.hash_and_upload(collection_two, catalog)
 
-        resp = requests.post(
-            self.url + "/intersection",
-            data={"first": first, "second": second},
-            stream=True,
-        )
-        if resp.status_code == 404:
-            raise NotYetCalculated(
-                "Not yet calculated; Run `.calculate_intersection` first."
-            )
-        self.handle_errors(resp)
-
-        filepath = self._download_file(resp)
+        filepath = self._fetch("/intersection", {"first": first, "second": second})
         return import_from_pandarus(filepath)
 
     @check_alive
@@ -210,18 +447,9 @@ class PandarusRemote(object):
         first = self.hash_and_upload(collection_one, catalog)
         second = self.hash_and_upload(collection_two, catalog)
 
-        resp = requests.post(
-            self.url + "/intersection-file",
-            data={"first": first, "second": second},
-            stream=True,
+        filepath = self._fetch(
+            "/intersection-file", {"first": first, "second": second}
         )
-        if resp.status_code == 404:
-            raise NotYetCalculated(
-                "Not yet calculated; Run `.calculate_intersection` first."
-            )
-        self.handle_errors(resp)
-
-        filepath = self._download_file(resp)
 
         geocollections[new_name] = {
             "filepath": filepath,
@@ -250,14 +478,7 @@ class PandarusRemote(object):
         first = self.hash_and_upload(vector, catalog)
         second = self.hash_and_upload(raster, catalog)
 
-        resp = requests.post(
-            self.url + "/rasterstats",
-            data={"vector": first, "raster": second},
-            stream=True,
-        )
-        self.handle_errors(resp)
-
-        filepath = self._download_file(resp)
+        filepath = self._fetch("/rasterstats", {"vector": first, "raster": second})
         return import_xt_from_rasterstats(filepath, name, vector)
 
     @check_alive
@@ -266,9 +487,8 @@ class PandarusRemote(object):
         first = self.hash_and_upload(vector, catalog)
         second = self.hash_and_upload(raster, catalog)
 
-        resp = requests.post(
-            self.url + "/calculate-rasterstats",
-            data={"vector": first, "raster": second},
+        resp = self._request(
+            "POST", "/calculate-rasterstats", data={"vector": first, "raster": second}
         )
         try:
             self.handle_errors(resp)
@@ -277,7 +497,8 @@ class PandarusRemote(object):
             return
 
         print("Calculation job submitted.")
-        return PendingJob(self.url + resp.text)
+        self._catalog = None
+        return PendingJob(self.url + resp.text, self.session)
 
     @check_alive
     def calculate_intersection(self, collection_one, collection_two):
@@ -285,17 +506,55 @@ class PandarusRemote(object):
         first = self.hash_and_upload(collection_one, catalog)
         second = self.hash_and_upload(collection_two, catalog)
 
-        resp = requests.post(
-            self.url + "/calculate-intersection",
-            data={"first": first, "second": second},
+        resp = self._request(
+            "POST", "/calculate-intersection", data={"first": first, "second": second}
         )
         try:
             self.handle_errors(resp)
-        except:
+        except AlreadyExists:
             print(f"Intersection for {collection_one} and {collection_two} already calculated")
+            return
 
         print("Calculation job submitted.")
-        return PendingJob(self.url + resp.text)
+        self._catalog = None
+        return PendingJob(self.url + resp.text, self.session)
+
+    def _map(self, func, iterable):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, iterable))
+
+    @check_alive
+    def upload_collections(self, collections):
+        """Hash and upload several collections in parallel. Returns their hashes."""
+        catalog = self.catalog()
+        return self._map(lambda name: self.hash_and_upload(name, catalog), collections)
+
+    @check_alive
+    def calculate_intersections(self, pairs):
+        """Submit calculation jobs for several intersections in parallel.
+
+        Returns a list of ``PendingJob`` instances, or ``None`` for intersections already calculated."""
+        pairs = [tuple(pair) for pair in pairs]
+        self.upload_collections({name for pair in pairs for name in pair})
+        return self._map(lambda pair: self.calculate_intersection(*pair), pairs)
+
+    @check_alive
+    def fetch_intersections(self, pairs):
+        """Download and import several calculated intersections.
+
+        Downloads run in parallel; imports are done one after the other, with one write of the metadata stores at the end."""
+        pairs = [tuple(pair) for pair in pairs if tuple(pair) not in intersections]
+        names = sorted({name for pair in pairs for name in pair})
+        hashes = dict(zip(names, self.upload_collections(names)))
+
+        filepaths = self._map(
+            lambda pair: self._fetch(
+                "/intersection", {"first": hashes[pair[0]], "second": hashes[pair[1]]}
+            ),
+            pairs,
+        )
+        with batch_metadata(intersections, geocollections):
+            return [import_from_pandarus(filepath) for filepath in filepaths]
 
     def hash_and_upload(self, collection, catalog=None):
         hashes = {obj[1] for obj in (catalog or self.catalog())["files"]}
@@ -317,4 +576,181 @@ class PandarusRemote(object):
             )
 
 
+class AsyncPendingJob(object):
+    """Awaitable calculation job enqueued on a remote server.
+
+    Polls the job status with exponential backoff, starting at ``interval`` seconds and growing by ``backoff`` up to ``max_interval``. Awaiting the job returns its final status."""
+
+    FINAL = {"failed", "finished", "forgotten"}
+
+    def __init__(self, url, session=None, interval=0.5, max_interval=30, backoff=2):
+        self.job = PendingJob(url, session)
+        self.url = url
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+    async def status(self):
+        return await asyncio.to_thread(lambda: self.job.status)
+
+    async def wait(self, timeout=None):
+        """Wait until the job ends, and return its status.
+
+        Raises ``asyncio.TimeoutError`` after ``timeout`` seconds."""
+
+        async def _poll():
+            interval = self.interval
+            while True:
+                status = await self.status()
+                if status in self.FINAL:
+                    return status
+                await asyncio.sleep(interval)
+                interval = min(interval * self.backoff, self.max_interval)
+
+        return await asyncio.wait_for(_poll(), timeout)
+
+    def __await__(self):
+        return self.wait().__await__()
+
+
+async def run_jobs(*jobs, timeout=None):
+    """Wait for several ``AsyncPendingJob`` instances concurrently.
+
+    ``None`` entries (jobs which were already calculated) are skipped. Raises ``ValueError`` if any job didn't finish successfully."""
+    statuses = await asyncio.gather(
+        *[job.wait(timeout) for job in jobs if job is not None]
+    )
+    failed = [status for status in statuses if status != "finished"]
+    if failed:
+        raise ValueError(
+            "Calculation job(s) finished with status(es) {}".format(failed)
+        )
+
+
+class AsyncPandarusRemote(object):
+    """asyncio interface to a ``PandarusRemote`` web service.
+
+    Network requests run in worker threads using the connection pool of the wrapped ``PandarusRemote``, so many intersections can be prepared at once. Imports into the current project are done one at a time, as the metadata stores are not thread-safe.
+
+    Pass either a ``PandarusRemote`` instance or a URL; further keyword arguments are passed to ``AsyncPendingJob``."""
+
+    def __init__(self, remote=None, **job_kwargs):
+        if not isinstance(remote, PandarusRemote):
+            remote = PandarusRemote(remote)
+        self.remote = remote
+        self.job_kwargs = job_kwargs
+        self._import_lock = None
+
+    @property
+    def url(self):
+        return self.remote.url
+
+    async def _import(self, func, *args):
+        if self._import_lock is None:
+            self._import_lock = asyncio.Lock()
+        async with self._import_lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def catalog(self, refresh=False):
+        return await asyncio.to_thread(self.remote.catalog, refresh)
+
+    async def hash_and_upload(self, collection):
+        catalog = await self.catalog()
+        return await asyncio.to_thread(self.remote.hash_and_upload, collection, catalog)
+
+    async def _submit(self, path, data):
+        resp = await asyncio.to_thread(
+            check_alive(self.remote._request), "POST", path, data=data
+        )
+        try:
+            self.remote.handle_errors(resp)
+        except AlreadyExists:
+            return None
+        self.remote._catalog = None
+        return AsyncPendingJob(
+            self.url + resp.text, self.remote.session, **self.job_kwargs
+        )
+
+    async def _fetch(self, path, data):
+        return await asyncio.to_thread(check_alive(self.remote._fetch), path, data)
+
+    async def calculate_intersection(self, collection_one, collection_two):
+        """Submit intersection job. Returns ``AsyncPendingJob``, or ``None`` if already calculated."""
+        first, second = await asyncio.gather(
+            self.hash_and_upload(collection_one), self.hash_and_upload(collection_two)
+        )
+        return await self._submit(
+            "/calculate-intersection", {"first": first, "second": second}
+        )
+
+    async def _fetch_or_calculate(self, path, collection_one, collection_two):
+        first, second = await asyncio.gather(
+            self.hash_and_upload(collection_one), self.hash_and_upload(collection_two)
+        )
+        data = {"first": first, "second": second}
+        try:
+            return await self._fetch(path, data)
+        except NotYetCalculated:
+            await run_jobs(await self._submit("/calculate-intersection", data))
+            return await self._fetch(path, data)
+
+    async def intersection(self, collection_one, collection_two):
+        """Import intersection, calculating it on the server first if needed"""
+        if (collection_one, collection_two) in intersections:
+            return
+        filepath = await self._fetch_or_calculate(
+            "/intersection", collection_one, collection_two
+        )
+
+        def _import():
+            # Could have been imported while this download was running
+            if (collection_one, collection_two) not in intersections:
+                return import_from_pandarus(filepath)
+
+        return await self._import(_import)
+
+    async def intersections(self, pairs):
+        """Import several intersections concurrently"""
+        pairs = list(dict.fromkeys(tuple(pair) for pair in pairs))
+        return await asyncio.gather(*[self.intersection(*pair) for pair in pairs])
+
+    async def intersection_as_new_geocollection(
+        self, collection_one, collection_two, new_name
+    ):
+        """Download the intersection spatial data as geocollection ``new_name``, and import its intersections with both input collections"""
+        if new_name in geocollections:
+            return
+        filepath = await self._fetch_or_calculate(
+            "/intersection-file", collection_one, collection_two
+        )
+
+        def register():
+            geocollections[new_name] = {
+                "filepath": filepath,
+                "field": "id",
+                "url": self.url + "/intersection-file",
+                "is intersection": True,
+                "first": collection_one,
+                "second": collection_two,
+            }
+
+        await self._import(register)
+        await self.intersections(
+            [(new_name, collection_one), (new_name, collection_two)]
+        )
+
+    async def rasterstats_as_xt(self, vector, raster, name):
+        """Import raster statistics as ``ExtensionTable``, calculating them on the server first if needed"""
+        first, second = await asyncio.gather(
+            self.hash_and_upload(vector), self.hash_and_upload(raster)
+        )
+        data = {"vector": first, "raster": second}
+        try:
+            filepath = await self._fetch("/rasterstats", data)
+        except NotYetCalculated:
+            await run_jobs(await self._submit("/calculate-rasterstats", data))
+            filepath = await self._fetch("/rasterstats", data)
+        return await self._import(import_xt_from_rasterstats, filepath, name, vector)
+
+
 remote = PandarusRemote()
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from bw2calc.dictionary_manager import ReversibleRemappableDictionary
+from bw2data import projects
+from scipy.sparse import csr_matrix
+
+from .errors import MissingIntersection
+from .export import reversed_geomapping
+from .intersection import Intersection
+from .meta import intersections
+from .utils import directory_path
+
+
+class ReportingOperators:
+    """Cache of area-weighted operators which project results from the spatial units of one geocollection onto the spatial units of a reporting geocollection.
+
+    The operator for ``(source, reporting)`` is calculated from the ``Intersection`` of the two geocollections: each source spatial unit is split over the reporting spatial units it intersects, in proportion to the intersected areas, like the normalized geographic transform matrix of the LCA classes. Operators are kept in memory, and saved as ``.npz`` files in the ``regional/reporting`` directory of the project, so they are reused across runs. Cached operators are recalculated when the processed intersection datapackage changes."""
+
+    def __init__(self):
+        self._cache = {}
+
+    @property
+    def dirpath(self):
+        dirpath = projects.request_directory("regional") / "reporting"
+        dirpath.mkdir(parents=True, exist_ok=True)
+        return dirpath
+
+    def clear(self):
+        """Clear the in-memory cache; operators saved in the project are kept"""
+        self._cache = {}
+
+    def _filepath(self, source, reporting):
+        digest = hashlib.md5(json.dumps([source, reporting]).encode("utf-8"))
+        return self.dirpath / (digest.hexdigest() + ".npz")
+
+    def fingerprint(self, source, reporting):
+        """Modification times and sizes of the processed intersection datapackage"""
+        obj = Intersection((source, reporting))
+        if obj.is_reversed:
+            obj = Intersection((reporting, source))
+        fp = obj.filepath_processed()
+        return [
+            [os.stat(x).st_mtime_ns, os.stat(x).st_size]
+            for x in (fp, directory_path(fp) / "datapackage.json")
+            if os.path.isfile(x)
+        ]
+
+    def operator(self, source, reporting):
+        """Get the operator from ``source`` to ``reporting`` as arrays of source ``geomapping`` ids, reporting ``geomapping`` ids, and weights.
+
+        Raises ``MissingIntersection`` if the intersection of the two geocollections isn't available."""
+        if (source, reporting) not in intersections:
+            raise MissingIntersection(
+                "Intersection {} needed but not found".format((source, reporting))
+            )
+        key = (projects.current, source, reporting)
+        fingerprint = json.dumps(self.fingerprint(source, reporting))
+        if key in self._cache and self._cache[key][0] == fingerprint:
+            return self._cache[key][1]
+
+        fp = self._filepath(source, reporting)
+        if fp.is_file():
+            with np.load(fp) as archive:
+                if str(archive["fingerprint"]) == fingerprint:
+                    arrays = (archive["rows"], archive["cols"], archive["weights"])
+                    self._cache[key] = (fingerprint, arrays)
+                    return arrays
+
+        arrays = self._calculate(source, reporting)
+        np.savez(
+            fp,
+            fingerprint=np.array(fingerprint),
+            rows=arrays[0],
+            cols=arrays[1],
+            weights=arrays[2],
+        )
+        self._cache[key] = (fingerprint, arrays)
+        return arrays
+
+    def _calculate(self, source, reporting):
+        package = Intersection((source, reporting)).datapackage()
+        indices, areas = [], []
+        for resource in package.resources:
+            if resource["kind"] != "indices":
+                continue
+            indices.append(package.get_resource(resource["name"])[0])
+            areas.append(package.get_resource(resource["group"] + ".data")[0])
+        indices, areas = np.hstack(indices), np.hstack(areas).astype(np.float64)
+
+        unique, inverse = np.unique(indices["row"], return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=areas, minlength=len(unique))
+        mask = totals[inverse] > 0
+        weights = areas[mask] / totals[inverse][mask]
+        return (
+            np.asarray(indices["row"][mask], dtype=np.int64),
+            np.asarray(indices["col"][mask], dtype=np.int64),
+            weights,
+        )
+
+    def matrix(self, col_dict, source_geocollections, reporting):
+        """Build the operator for results matrices whose columns are given by ``col_dict`` (``geomapping`` id to column index), with spatial units from ``source_geocollections``.
+
+        Spatial units already in the ``reporting`` geocollection are passed through unchanged. Spatial units of other geocollections which don't intersect any reporting spatial unit are left out.
+
+        Returns a sparse matrix with results columns as rows and reporting spatial units as columns, and a dictionary from reporting ``geomapping`` id to column index."""
+        ids = np.array(sorted(col_dict), dtype=np.int64)
+        columns = np.array([col_dict[x] for x in ids.tolist()], dtype=np.int64)
+
+        rows, cols, weights = [], [], []
+        for gc in sorted(source_geocollections):
+            if gc == reporting:
+                # Negative ids are placeholders for locations not in ``geomapping``
+                mask = ids >= 0
+                keys = reversed_geomapping.lookup(ids[mask].tolist())
+                mask[mask] = [isinstance(key, tuple) and key[0] == gc for key in keys]
+                rows.append(ids[mask])
+                cols.append(ids[mask])
+                weights.append(np.ones(mask.sum()))
+                continue
+            source_ids, reporting_ids, values = self.operator(gc, reporting)
+            mask = np.isin(source_ids, ids)
+            rows.append(source_ids[mask])
+            cols.append(reporting_ids[mask])
+            weights.append(values[mask])
+
+        rows, cols = np.hstack(rows or [[]]), np.hstack(cols or [[]])
+        weights = np.hstack(weights or [[]])
+        reporting_ids, reporting_index = np.unique(cols, return_inverse=True)
+        operator = csr_matrix(
+            (
+                weights,
+                (
+                    columns[np.searchsorted(ids, rows.astype(np.int64))],
+                    reporting_index.ravel(),
+                ),
+            ),
+            shape=(len(col_dict), len(reporting_ids)),
+        )
+        return operator, ReversibleRemappableDictionary(
+            {int(x): index for index, x in enumerate(reporting_ids)}
+        )
+
+
+reporting_operators = ReportingOperators()
@@ -0,0 +1,222 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from bw2calc.dictionary_manager import ReversibleRemappableDictionary
+from bw2data import geomapping, get_id
+from bw2data.backends import ActivityDataset
+from bw2data.errors import UnknownObject
+from scipy.sparse import coo_matrix
+
+from .lca.base_class import SpatialResultsMixin
+from .meta import geocollections
+
+SCALES = {
+    "inv": ("results_inv_spatial_scale", "inv_spatial", "inventory_geocollections"),
+    "ia": ("results_ia_spatial_scale", "ia_spatial", "ia_geocollections"),
+    "xtable": (
+        "results_xtable_spatial_scale",
+        "xtable_spatial",
+        "xtable_geocollections",
+    ),
+}
+
+
+class ResultDicts:
+    """Container for the ``biosphere`` and spatial dictionaries of a ``RegionalResult``, like ``LCA.dicts``"""
+
+    def __init__(self, **dicts):
+        for key, value in dicts.items():
+            setattr(self, key, ReversibleRemappableDictionary(value))
+
+
+def _as_key(obj):
+    """JSON turns ``geomapping`` tuple keys into lists"""
+    return tuple(_as_key(x) for x in obj) if isinstance(obj, list) else obj
+
+
+def _flow_id(key):
+    try:
+        return get_id(key)
+    except UnknownObject:
+        return None
+
+
+def _with_placeholders(ids):
+    """Dictionary from ids to matrix indices, where missing ids (``None``) are replaced by negative placeholders ``-(index + 1)``"""
+    return {(-index - 1 if x is None else x): index for index, x in enumerate(ids)}
+
+
+class RegionalResult(SpatialResultsMixin):
+    """Spatial results of a regionalized LCA calculation, which can be saved, loaded, and mapped without the LCA object.
+
+    Stores the sparse results matrices of each spatial scale (biosphere flows by spatial units), the biosphere flow keys and spatial unit keys of their rows and columns, and the names and metadata of the geocollections of each scale. Has the same ``results_*_spatial_scale`` and ``geodataframe_*_spatial_scale`` methods as ``RegionalizationBase``, and can be passed to ``export.as_ia_raster`` instead of an LCA object.
+
+    Create with ``RegionalResult.from_lca(lca)`` or ``lca.regional_result()``."""
+
+    def __init__(
+        self, score, flows, matrices, locations, scale_geocollections, metadata=None
+    ):
+        """``flows`` are the ``(database, code)`` keys of the biosphere flows of the matrix rows. ``matrices``, ``locations``, and ``scale_geocollections`` are dictionaries with scales (``inv``, ``ia``, ``xtable``) as keys, and the sparse results matrix, the ``geomapping`` keys of the matrix columns, and the geocollection names as values. ``metadata`` has geocollection metadata by geocollection name.
+
+        Flows and locations are looked up in the current project, but not added to it. Those which aren't found get negative placeholder ids ``-(index + 1)`` in ``dicts``; results at these locations can still be mapped, as geometries are found from the location keys."""
+        self.score = score
+        self.flows = [_as_key(flow) for flow in flows]
+        self.matrices = {key: coo_matrix(value) for key, value in matrices.items()}
+        self.locations = {key: list(value) for key, value in locations.items()}
+        self.scale_geocollections = {
+            key: sorted(value) for key, value in scale_geocollections.items()
+        }
+        self.metadata = metadata or {}
+
+        self.dicts = ResultDicts(
+            biosphere=_with_placeholders([_flow_id(flow) for flow in self.flows]),
+            **{
+                SCALES[scale][1]: _with_placeholders(
+                    [geomapping[key] if key in geomapping else None for key in keys]
+                )
+                for scale, keys in self.locations.items()
+            }
+        )
+        for scale, (_, _, attribute) in SCALES.items():
+            setattr(self, attribute, set(self.scale_geocollections.get(scale, [])))
+
+    @classmethod
+    def from_lca(cls, lca):
+        """Create from a regionalized ``lca`` after ``lcia()``"""
+        matrices, locations, scale_geocollections = {}, {}, {}
+        for scale, (method, dict_name, attribute) in SCALES.items():
+            if not hasattr(lca, method) or not hasattr(lca.dicts, dict_name):
+                continue
+            try:
+                matrix = getattr(lca, method)()
+            except NotImplementedError:
+                continue
+            matrices[scale] = matrix
+            locations[scale] = list(lca.location_keys(scale))
+            scale_geocollections[scale] = getattr(lca, attribute)
+
+        biosphere = lca.dicts.biosphere.reversed
+        ids = [biosphere[index] for index in range(len(biosphere))]
+        keys = {
+            obj.id: (obj.database, obj.code)
+            for obj in ActivityDataset.select(
+                ActivityDataset.id, ActivityDataset.database, ActivityDataset.code
+            ).where(ActivityDataset.id.in_(ids))
+        }
+        flows = [keys[x] for x in ids]
+        used = {gc for value in scale_geocollections.values() for gc in value}
+        metadata = {gc: dict(geocollections[gc]) for gc in used if gc in geocollections}
+        return cls(
+            lca.score, flows, matrices, locations, scale_geocollections, metadata
+        )
+
+    def _matrix(self, scale):
+        if scale not in self.matrices:
+            raise NotImplementedError("No results for this spatial scale")
+        return self.matrices[scale].tocsr()
+
+    def results_inv_spatial_scale(self):
+        return self._matrix("inv")
+
+    def results_ia_spatial_scale(self):
+        return self._matrix("ia")
+
+    def results_xtable_spatial_scale(self):
+        return self._matrix("xtable")
+
+    def location_keys(self, scale="ia"):
+        if scale not in self.locations:
+            raise NotImplementedError("No results for this spatial scale")
+        keys = np.empty(len(self.locations[scale]), dtype=object)
+        for index, key in enumerate(self.locations[scale]):
+            keys[index] = key
+        return keys
+
+    def register_geocollections(self):
+        """Register the geocollections of these results in the current project, if not already present, so that their geometries can be found"""
+        for name, metadata in self.metadata.items():
+            if name not in geocollections:
+                geocollections[name] = metadata
+
+    def _arrays(self):
+        arrays = {}
+        for scale, matrix in self.matrices.items():
+            arrays[scale + "-row"] = matrix.row
+            arrays[scale + "-col"] = matrix.col
+            arrays[scale + "-data"] = matrix.data
+        return arrays
+
+    def _description(self):
+        return {
+            "score": float(self.score),
+            "flows": self.flows,
+            "shapes": {key: list(value.shape) for key, value in self.matrices.items()},
+            "locations": self.locations,
+            "geocollections": self.scale_geocollections,
+            "metadata": self.metadata,
+        }
+
+    def save(self, filepath):
+        """Save to ``filepath``.
+
+        If ``filepath`` ends with ``.npz``, writes a single compressed NumPy archive. Otherwise, ``filepath`` is a directory with one ``.npy`` file per array, which are memory-mapped when loaded.
+
+        Returns the filepath."""
+        description = json.dumps(self._description(), default=str)
+        if str(filepath).endswith(".npz"):
+            np.savez_compressed(
+                filepath, description=np.array(description), **self._arrays()
+            )
+            return filepath
+
+        dirpath = Path(filepath)
+        dirpath.mkdir(parents=True, exist_ok=True)
+        for name, array in self._arrays().items():
+            np.save(dirpath / (name + ".npy"), array)
+        with open(dirpath / "result.json", "w") as f:
+            f.write(description)
+        return filepath
+
+    @classmethod
+    def load(cls, filepath, mmap=True):
+        """Load results saved with ``save``. Arrays in directories are memory-mapped unless ``mmap`` is false."""
+        if os.path.isdir(filepath):
+            with open(Path(filepath) / "result.json") as f:
+                description = json.load(f)
+            arrays = {
+                name: np.load(
+                    Path(filepath) / (name + ".npy"), mmap_mode="r" if mmap else None
+                )
+                for scale in description["shapes"]
+                for name in (scale + "-data", scale + "-row", scale + "-col")
+            }
+        else:
+            # Arrays are copied out so the archive isn't kept open
+            with np.load(filepath) as archive:
+                description = json.loads(str(archive["description"]))
+                arrays = {name: archive[name] for name in archive.files}
+
+        matrices = {
+            scale: coo_matrix(
+                (
+                    arrays[scale + "-data"],
+                    (arrays[scale + "-row"], arrays[scale + "-col"]),
+                ),
+                shape=tuple(shape),
+            )
+            for scale, shape in description["shapes"].items()
+        }
+        locations = {
+            scale: [_as_key(key) for key in keys]
+            for scale, keys in description["locations"].items()
+        }
+        return cls(
+            description["score"],
+            description["flows"],
+            matrices,
+            locations,
+            description["geocollections"],
+            description["metadata"],
+        )
@@ -0,0 +1,548 @@
+import argparse
+import bz2
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from .hashing import sha256
+from .utils import get_spatial_dataset_kind, raster_cell_labels
+
+
+def _public(metadata):
+    return {k: v for k, v in metadata.items() if k != "filepath"}
+
+
+def _read_vector(metadata, column):
+    import geopandas as gp
+
+    df = gp.read_file(metadata["filepath"], layer=metadata.get("layer") or None)
+    return df[[metadata["field"], "geometry"]].rename(
+        columns={metadata["field"]: column}
+    )
+
+
+def _read_raster(metadata, column, extent=None):
+    """Read the cells with data of a raster file as square polygons.
+
+    Cells get the same ``Cell(x, y)`` ids as in Pandarus intersections; see ``raster_cell_labels``. If the GeoDataFrame ``extent`` is given, only cells overlapping its bounds are read, and they are reprojected to its CRS."""
+    import geopandas as gp
+    import numpy as np
+    import rasterio
+    from rasterio.transform import rowcol, xy
+    from rasterio.windows import Window
+    from shapely import box
+
+    with rasterio.open(metadata["filepath"]) as src:
+        shape, transform, crs = (src.height, src.width), src.transform, src.crs
+        rows, cols = (0, src.height), (0, src.width)
+        if extent is not None and extent.crs and crs:
+            bounds = extent.to_crs(crs).total_bounds
+            corners = rowcol(transform, bounds[::2], bounds[1::2])
+            rows, cols = [
+                (max(0, int(min(x))), min(limit, int(max(x)) + 1))
+                for x, limit in zip(corners, shape)
+            ]
+        if rows[1] > rows[0] and cols[1] > cols[0]:
+            window = Window(cols[0], rows[0], cols[1] - cols[0], rows[1] - rows[0])
+            band = src.read(int(metadata.get("band") or 1), window=window, masked=True)
+            row, col = np.nonzero(~np.ma.getmaskarray(band))
+            row, col = row + rows[0], col + cols[0]
+        else:
+            row, col = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    xs, ys = [np.asarray(x) for x in xy(transform, row, col, offset="ul")]
+    xe, ye = [np.asarray(x) for x in xy(transform, row, col, offset="lr")]
+    df = gp.GeoDataFrame(
+        {column: raster_cell_labels(row * shape[1] + col, shape, transform)},
+        geometry=box(
+            np.minimum(xs, xe),
+            np.minimum(ys, ye),
+            np.maximum(xs, xe),
+            np.maximum(ys, ye),
+        ),
+        crs=crs,
+    )
+    if extent is not None and extent.crs and crs:
+        df = df.to_crs(extent.crs)
+    return df
+
+
+def intersect_job(first, second, data_fp, vector_fp):
+    """Intersect the files ``first`` and ``second``, described by their catalog metadata.
+
+    One of the files can be a raster. Its cells with data, within the bounds of the vector file, are intersected as square polygons, with ``Cell(x, y)`` ids like in Pandarus intersections.
+
+    Writes the intersection areas in the Pandarus JSON format to ``data_fp``, and the intersected spatial units (with field ``id``) as GeoJSON to ``vector_fp``."""
+    import geopandas as gp
+
+    files = ((first, "first"), (second, "second"))
+    frames = [
+        _read_vector(metadata, column)
+        if get_spatial_dataset_kind(metadata["filepath"]) == "vector"
+        else None
+        for metadata, column in files
+    ]
+    for index, frame in enumerate(frames):
+        if frame is None:
+            frames[index] = _read_raster(*files[index], extent=frames[1 - index])
+
+    df = gp.overlay(*frames, keep_geom_type=False)
+    areas = df.to_crs("esri:54009").area  # World Mollweide in square meters
+    df["id"] = range(len(df))
+    # Touching boundaries give lines or points, which can't be intersected again
+    polygons = df.geom_type.isin(["Polygon", "MultiPolygon"])
+    df[polygons].to_file(vector_fp, driver="GeoJSON")
+    with bz2.open(data_fp, "wt", encoding="utf-8") as f:
+        json.dump(
+            {
+                "metadata": {"first": _public(first), "second": _public(second)},
+                "data": list(
+                    zip(df["first"].tolist(), df["second"].tolist(), areas.tolist())
+                ),
+            },
+            f,
+        )
+
+
+def rasterstats_job(vector, raster, data_fp):
+    """Calculate zonal statistics of ``raster`` for each spatial unit of ``vector``, and write them in the Pandarus JSON format to ``data_fp``"""
+    import rasterstats
+
+    stats = rasterstats.zonal_stats(
+        vector["filepath"],
+        raster["filepath"],
+        layer=vector.get("layer") or 0,
+        band=int(raster.get("band") or 1),
+        stats=["count", "min", "max", "mean"],
+        geojson_out=True,
+    )
+    data = [
+        (
+            row["properties"][vector["field"]],
+            {k: row["properties"][k] for k in ("count", "min", "max", "mean")},
+        )
+        for row in stats
+    ]
+    with bz2.open(data_fp, "wt", encoding="utf-8") as f:
+        json.dump(
+            {
+                "metadata": {"vector": _public(vector), "raster": _public(raster)},
+                "data": data,
+            },
+            f,
+        )
+
+
+class ResultStore(object):
+    """Uploaded files, calculated results and their catalog, stored in ``dirpath``"""
+
+    def __init__(self, dirpath):
+        self.dirpath = Path(dirpath)
+        for name in ("files", "results", "tmp"):
+            (self.dirpath / name).mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        try:
+            with open(self.dirpath / "catalog.json", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {"files": {}, "intersections": {}, "rasterstats": {}}
+
+    def flush(self):
+        tmp = self.dirpath / "tmp" / uuid.uuid4().hex
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.dirpath / "catalog.json")
+
+    def catalog(self):
+        with self.lock:
+            return {
+                "files": [
+                    [value["filename"], key, value["kind"]]
+                    for key, value in self.data["files"].items()
+                ],
+                "intersections": [key.split("|") for key in self.data["intersections"]],
+                "rasterstats": [key.split("|") for key in self.data["rasterstats"]],
+            }
+
+    def file(self, hashed):
+        """Return metadata of uploaded file ``hashed``, including its absolute ``filepath``"""
+        with self.lock:
+            metadata = dict(self.data["files"][hashed])
+        metadata["filepath"] = str(self.dirpath / metadata.pop("path"))
+        return metadata
+
+    def add_file(self, filepath, hashed, filename, **metadata):
+        """Move ``filepath`` into the store as uploaded file ``hashed``"""
+        target = self.dirpath / "files" / hashed
+        target.mkdir(exist_ok=True)
+        target = target / os.path.basename(filename)
+        os.replace(filepath, target)
+        metadata = {k: v for k, v in metadata.items() if v}
+        metadata.update(
+            {
+                "sha256": hashed,
+                "filename": target.name,
+                "kind": get_spatial_dataset_kind(str(target)),
+                "path": str(target.relative_to(self.dirpath)),
+            }
+        )
+        with self.lock:
+            self.data["files"][hashed] = metadata
+            self.flush()
+        return metadata
+
+    def result_dir(self, kind, key):
+        dirpath = self.dirpath / "results" / kind / key.replace("|", "-")
+        dirpath.mkdir(parents=True, exist_ok=True)
+        return dirpath
+
+    def add_result(self, kind, key, **filepaths):
+        """Register finished result files; each is stored with its SHA256 hash"""
+        entry = {
+            label: {
+                "path": str(Path(fp).relative_to(self.dirpath)),
+                "sha256": sha256(fp, use_cache=False),
+            }
+            for label, fp in filepaths.items()
+        }
+        with self.lock:
+            self.data[kind][key] = entry
+            self.flush()
+
+    def result(self, kind, key, label):
+        """Return ``(filepath, sha256)`` of a result file, or ``None`` if not calculated"""
+        with self.lock:
+            entry = self.data[kind].get(key, {}).get(label)
+        if entry is None:
+            return None
+        return self.dirpath / entry["path"], entry["sha256"]
+
+
+class PandarusServer(object):
+    """Self-hostable server implementing the `pandarus_remote <https://github.com/cmutel/pandarus_remote>`__ protocol used by ``PandarusRemote``.
+
+    Intersections are calculated with ``geopandas``, between two vector files or a vector and a raster file, and raster statistics with ``rasterstats``, in a pool of worker processes. Uploaded files and results are stored by the SHA256 hash of their inputs, so everyone using the same server shares one result cache.
+
+    Run with ``python -m bw2regional.server <directory> [--host HOST] [--port PORT] [--processes N]``.
+
+    ``processes`` is the size of the worker pool for calculation jobs. Use ``start`` and ``shutdown`` (or a ``with`` block) to run the server in a background thread, or ``serve_forever`` to block."""
+
+    def __init__(self, dirpath, host="127.0.0.1", port=5000, processes=None):
+        self.store = ResultStore(dirpath)
+        self.pool = ProcessPoolExecutor(max_workers=processes)
+        self.jobs, self.pending = {}, {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), PandarusRequestHandler)
+        self.httpd.app = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, kind, key, func, *args, **filepaths):
+        """Submit calculation job, or return the running job for the same result. Returns the job id."""
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            job_id = uuid.uuid4().hex
+            future = self.pool.submit(func, *args, *map(str, filepaths.values()))
+            self.jobs[job_id] = future
+            self.pending[key] = job_id
+
+        def done(future):
+            if future.exception() is None:
+                self.store.add_result(kind, key, **filepaths)
+            with self.lock:
+                self.pending.pop(key, None)
+
+        future.add_done_callback(done)
+        return job_id
+
+    def status(self, job_id):
+        future = self.jobs.get(job_id)
+        if future is None:
+            return None
+        elif future.done():
+            return "failed" if future.exception() else "finished"
+        return "started" if future.running() else "queued"
+
+
+class PandarusRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def app(self):
+        return self.server.app
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, body=b"", status=200, content_type="text/plain"):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        if status >= 400:
+            # Request body may not have been read
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_result(self, result):
+        """Send result file, with ``ETag`` hash and support for ``Range`` requests"""
+        if result is None:
+            return self.respond("Not yet calculated", 404)
+        filepath, hashed = result
+        size = filepath.stat().st_size
+        etag = '"{}"'.format(hashed)
+        start, status = 0, 200
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            start = min(int(match.group(1)), size)
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Disposition", "attachment; filename=" + filepath.name)
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(size - start))
+        if status == 206:
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, size - 1, size)
+            )
+        self.end_headers()
+        with open(filepath, "rb") as f:
+            f.seek(start)
+            shutil.copyfileobj(f, self.wfile, 2**20)
+
+    def form(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8")
+        return {key: values[0] for key, values in parse_qs(body).items()}
+
+    def do_GET(self):
+        if self.path == "/":
+            self.respond("pandarus_remote-compatible server")
+        elif self.path == "/catalog":
+            self.respond(
+                json.dumps(self.app.store.catalog()), content_type="application/json"
+            )
+        elif self.path.startswith("/status/"):
+            status = self.app.status(self.path[8:])
+            if status is None:
+                self.respond("Unknown job", 404)
+            else:
+                self.respond(status)
+        else:
+            self.respond("Not found", 404)
+
+    def do_POST(self):
+        handlers = {
+            "/upload": self.upload,
+            "/calculate-intersection": self.calculate_intersection,
+            "/intersection": lambda: self.intersection("data"),
+            "/intersection-file": lambda: self.intersection("vector"),
+            "/calculate-rasterstats": self.calculate_rasterstats,
+            "/rasterstats": self.rasterstats,
+        }
+        if self.path not in handlers:
+            return self.respond("Not found", 404)
+        try:
+            handlers[self.path]()
+        except KeyError as e:
+            self.respond("Unknown or missing {}".format(e), 404)
+        except ValueError as e:
+            self.respond(str(e), 400)
+
+    def upload(self):
+        """Receive multipart upload.
+
+        The body is spooled to disk and parsed with ``mmap``, so large files aren't held in memory. The uploaded file is hashed and must match the ``sha256`` field."""
+        match = re.search(r"boundary=([^;]+)", self.headers.get("Content-Type", ""))
+        if not match:
+            raise ValueError("Expected multipart/form-data")
+        boundary = b"--" + match.group(1).strip('"').encode("utf-8")
+        length = int(self.headers["Content-Length"])
+        tmpdir = self.app.store.dirpath / "tmp"
+
+        fields, filepath, hasher = {}, None, hashlib.sha256()
+        with tempfile.TemporaryFile(dir=tmpdir) as body:
+            remaining = length
+            while remaining:
+                chunk = self.rfile.read(min(2**20, remaining))
+                if not chunk:
+                    raise ValueError("Incomplete upload")
+                body.write(chunk)
+                remaining -= len(chunk)
+            body.flush()
+            with mmap.mmap(body.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                position = data.find(boundary)
+                while position != -1:
+                    start = position + len(boundary)
+                    if data[start : start + 2] == b"--":
+                        break
+                    header_end = data.find(b"\r\n\r\n", start)
+                    end = data.find(b"\r\n" + boundary, header_end)
+                    if header_end == -1 or end == -1:
+                        raise ValueError("Malformed multipart body")
+                    headers = data[start:header_end].decode("utf-8")
+                    name = re.search(r'name="([^"]*)"', headers).group(1)
+                    if name == "file":
+                        filepath = tmpdir / uuid.uuid4().hex
+                        with open(filepath, "wb") as f:
+                            for offset in range(header_end + 4, end, 2**20):
+                                chunk = data[offset : min(offset + 2**20, end)]
+                                hasher.update(chunk)
+                                f.write(chunk)
+                    else:
+                        fields[name] = data[header_end + 4 : end].decode("utf-8")
+                    position = end + 2
+
+        if filepath is None:
+            raise ValueError("No file uploaded")
+        if fields.get("sha256") != hasher.hexdigest():
+            filepath.unlink()
+            raise ValueError("Uploaded file doesn't match its sha256 hash")
+        metadata = self.app.store.add_file(
+            filepath,
+            fields["sha256"],
+            fields.get("name") or "upload",
+            field=fields.get("field"),
+            layer=fields.get("layer"),
+            # Geocollections store band numbers as integers
+            band=int(fields["band"]) if fields.get("band") else None,
+        )
+        self.respond(json.dumps(metadata), content_type="application/json")
+
+    def _submit(self, kind, key, func, *args, **filepaths):
+        if self.app.store.result(kind, key, list(filepaths)[0]):
+            return self.respond("Already calculated", 409)
+        job_id = self.app.submit(kind, key, func, *args, **filepaths)
+        self.respond("/status/" + job_id)
+
+    def _metadata(self, hashed):
+        metadata = self.app.store.file(hashed)
+        return {
+            k: v
+            for k, v in metadata.items()
+            if k in ("filepath", "sha256", "field", "layer", "band", "filename")
+        }
+
+    def calculate_intersection(self):
+        form = self.form()
+        first, second = self._metadata(form["first"]), self._metadata(form["second"])
+        kinds = [
+            self.app.store.data["files"][metadata["sha256"]]["kind"]
+            for metadata in (first, second)
+        ]
+        if "vector" not in kinds:
+            raise ValueError("Intersections need at least one vector file")
+        for metadata, kind in zip((first, second), kinds):
+            if kind == "vector" and not metadata.get("field"):
+                raise ValueError("Vector file needs a field")
+        key = "{}|{}".format(form["first"], form["second"])
+        dirpath = self.app.store.result_dir("intersections", key)
+        self._submit(
+            "intersections",
+            key,
+            intersect_job,
+            first,
+            second,
+            data=dirpath / "{}.json.bz2".format(key.replace("|", "-")),
+            vector=dirpath / "{}.geojson".format(key.replace("|", "-")),
+        )
+
+    def intersection(self, label):
+        form = self.form()
+        key = "{}|{}".format(form["first"], form["second"])
+        result = self.app.store.result("intersections", key, label)
+        if (
+            result
+            and label == "vector"
+            and result[1] not in self.app.store.data["files"]
+        ):
+            # Intersected spatial units can be used like an uploaded file
+            with self.app.store.lock:
+                self.app.store.data["files"][result[1]] = {
+                    "sha256": result[1],
+                    "filename": result[0].name,
+                    "field": "id",
+                    "kind": "vector",
+                    "path": str(result[0].relative_to(self.app.store.dirpath)),
+                }
+                self.app.store.flush()
+        self.send_result(result)
+
+    def calculate_rasterstats(self):
+        form = self.form()
+        vector, raster = self._metadata(form["vector"]), self._metadata(form["raster"])
+        key = "{}|{}".format(form["vector"], form["raster"])
+        dirpath = self.app.store.result_dir("rasterstats", key)
+        self._submit(
+            "rasterstats",
+            key,
+            rasterstats_job,
+            vector,
+            raster,
+            data=dirpath / "{}.json.bz2".format(key.replace("|", "-")),
+        )
+
+    def rasterstats(self):
+        form = self.form()
+        key = "{}|{}".format(form["vector"], form["raster"])
+        self.send_result(self.app.store.result("rasterstats", key, "data"))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="pandarus_remote-compatible server")
+    parser.add_argument("dirpath", help="Directory for uploaded files and results")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument(
+        "--processes", type=int, default=None, help="Size of worker process pool"
+    )
+    args = parser.parse_args(args)
+    server = PandarusServer(args.dirpath, args.host, args.port, args.processes)
+    print("Serving on {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 import os
+import re
 import shutil
+import zipfile
+from itertools import repeat
+from pathlib import Path
 
 import fiona
 import geopandas as gp
 import numpy as np
+import pandas as pd
 import rasterio
-from bw2data import Method, methods, projects
+from bw2data import Method, config, geomapping, get_id, methods, projects
 from bw_processing import (
     INDICES_DTYPE,
     clean_datapackage_name,
     create_datapackage,
     load_datapackage,
 )
+from bw_processing.utils import resolve_dict_iterator
+from fs.osfs import OSFS
 from fs.zipfs import ZipFS
 from scipy import sparse
 
@@ -32,6 +39,150 @@ def filter_fiona_metadata(dct):
     return {k: v for k, v in dct.items() if k in valid_keys}
 
 
+CELL_LABEL = "Cell({:.8e}, {:.8e})"
+CELL_PATTERN = re.compile(r"^Cell\(\s*([^,\s]+)\s*,\s*([^)\s]+)\s*\)$")
+
+
+def raster_cell_ids(band_or_shape):
+    """Get the flat indices of the cells of a raster.
+
+    Cells are numbered ``row * width + col``. ``band_or_shape`` is a two-dimensional array, or its shape.
+
+    Returns an integer array with the same shape."""
+    shape = getattr(band_or_shape, "shape", band_or_shape)
+    return np.arange(int(np.prod(shape)), dtype=np.int64).reshape(shape)
+
+
+def _apply_affine(transform, xs, ys):
+    """Apply an affine ``transform`` to arrays of coordinates"""
+    return (
+        transform.a * xs + transform.b * ys + transform.c,
+        transform.d * xs + transform.e * ys + transform.f,
+    )
+
+
+def raster_cell_labels(cells, shape, transform):
+    """Get the feature ids of raster cells, given their flat indices (see ``raster_cell_ids``).
+
+    Raster cells are identified like in Pandarus intersections, by the coordinates of their center: ``Cell(x, y)``. ``shape`` and ``transform`` are the raster shape and affine transform.
+
+    Returns a list of strings."""
+    rows, cols = np.divmod(np.asarray(cells, dtype=np.int64), shape[1])
+    xs, ys = _apply_affine(transform, cols + 0.5, rows + 0.5)
+    return [CELL_LABEL.format(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+
+
+def raster_cell_indices(labels, shape, transform):
+    """Get the flat indices of raster cells from their ``Cell(x, y)`` feature ids.
+
+    Any point inside the cell identifies it, so labels written by Pandarus, whose coordinates are rounded, give the same cells as ``raster_cell_labels``.
+
+    Returns an integer array; labels which can't be parsed, or are outside the raster, get ``-1``."""
+    coords = np.full((len(labels), 2), np.nan)
+    for index, label in enumerate(labels):
+        match = CELL_PATTERN.match(label) if isinstance(label, str) else None
+        if match:
+            try:
+                coords[index] = [float(match.group(1)), float(match.group(2))]
+            except ValueError:
+                pass
+    valid = ~np.isnan(coords).any(axis=1)
+    cols, rows = _apply_affine(~transform, coords[:, 0], coords[:, 1])
+    cols = np.floor(np.where(valid, cols, -1)).astype(np.int64)
+    rows = np.floor(np.where(valid, rows, -1)).astype(np.int64)
+    valid &= (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    return np.where(valid, rows * shape[1] + cols, -1)
+
+
+def feature_labels(geocollection, ids):
+    """Get the feature ids used in ``geomapping`` for ``ids`` returned by ``read_geocollection_values``.
+
+    Flat cell indices of raster geocollections are converted with ``raster_cell_labels``; vector feature ids are returned unchanged."""
+    metadata = geocollections[geocollection]
+    if metadata.get("kind") != "raster":
+        return ids
+    shape, transform, _ = raster_grid(metadata["filepath"])
+    return raster_cell_labels(ids, shape, transform)
+
+
+def normalize_cell_labels(labels, geocollection):
+    """Replace the ``Cell(x, y)`` feature ids of a raster ``geocollection``, as written by Pandarus, by the labels of ``raster_cell_labels``.
+
+    Pandarus rounds the cell center coordinates, so its labels can differ from ours for the same cell. Labels of vector geocollections, of rasters without a ``filepath``, and labels which aren't cells of the raster, are returned unchanged.
+
+    Returns a list."""
+    labels = list(labels)
+    metadata = geocollections.get(geocollection, {})
+    if metadata.get("kind") != "raster" or not metadata.get("filepath"):
+        return labels
+    shape, transform, _ = raster_grid(metadata["filepath"])
+    cells = raster_cell_indices(labels, shape, transform)
+    valid = np.flatnonzero(cells >= 0)
+    for index, label in zip(
+        valid.tolist(), raster_cell_labels(cells[valid], shape, transform)
+    ):
+        labels[index] = label
+    return labels
+
+
+def valid_values(values, nan_value=None):
+    """Boolean mask of ``values`` which are not ``NaN`` or ``nan_value``"""
+    mask = ~np.isnan(values)
+    if nan_value is not None:
+        mask &= values != nan_value
+    return mask
+
+
+def raster_grid(filepath):
+    """Get the shape, transform, and CRS of the raster at ``filepath``"""
+    with rasterio.open(filepath) as src:
+        return (src.height, src.width), src.transform, src.crs
+
+
+def read_geocollection_values(geocollection, labels, nan_value=None, filepath=None):
+    """Read columns or raster bands of ``geocollection`` as arrays.
+
+    ``labels`` are field names for vector geocollections, and band numbers for raster geocollections. Values which are missing, ``NaN``, equal to ``nan_value``, or the raster nodata value, are masked.
+
+    Values can be read from ``filepath`` instead of the geocollection file. This must be a vector dataset with the geocollection ``field``, or a raster on the same grid as the geocollection raster.
+
+    Returns ``(ids, {label: (mask, values)})``, where ``ids`` are the feature ids, or flat cell indices (see ``raster_cell_ids``) for rasters, and ``mask`` and ``values`` are arrays aligned with ``ids``. Use ``feature_labels`` to get the ``geomapping`` feature ids."""
+    metadata = geocollections[geocollection]
+    if metadata.get("kind") == "raster":
+        if filepath is not None and raster_grid(filepath) != raster_grid(
+            metadata["filepath"]
+        ):
+            raise ValueError(
+                "Raster {} is not aligned with geocollection {}".format(
+                    filepath, geocollection
+                )
+            )
+        columns = {}
+        with rasterio.open(filepath or metadata["filepath"]) as src:
+            ids = raster_cell_ids((src.height, src.width)).ravel()
+            for band in labels:
+                values = src.read(int(band)).ravel().astype(np.float64)
+                mask = valid_values(values, nan_value)
+                if src.nodata is not None:
+                    mask &= values != src.nodata
+                columns[band] = (mask, values)
+        return ids, columns
+
+    if "field" not in metadata:
+        raise ValueError("Geocollection must specify ``field`` field name")
+    df = gp.read_file(
+        filepath or metadata["filepath"],
+        layer=None if filepath else metadata.get("layer"),
+        columns=[metadata["field"]] + list(labels),
+        ignore_geometry=True,
+    )
+    columns = {}
+    for label in labels:
+        values = pd.to_numeric(df[label], errors="coerce").to_numpy(np.float64)
+        columns[label] = (valid_values(values, nan_value), values)
+    return df[metadata["field"]].to_numpy(), columns
+
+
 def import_regionalized_cfs(
     geocollection,
     method_tuple,
@@ -40,18 +191,22 @@ def import_regionalized_cfs(
     global_cfs=None,
     nan_value=None,
 ):
-    """Import data from a vector geospatial dataset into a ``Method``.
+    """Import data from a vector or raster geospatial dataset into a ``Method``.
 
     A ``Method`` can have both site-generic and regionalized characterization factors.
 
-    The ``mapping`` defines which field (vector) maps to which biosphere flows. Some geocollections may only define regionalized chracterization factors for a single biosphere flow, but it is much more common to have each field or band map to multiple biosphere flows. Therefore, mapping should be defined as:
+    The ``mapping`` defines which field (vector) or band (raster) maps to which biosphere flows. Some geocollections may only define regionalized chracterization factors for a single biosphere flow, but it is much more common to have each field or band map to multiple biosphere flows. Therefore, mapping should be defined as:
 
     .. code-block:: python
 
         {
-            field name (str): [list of biosphere flows (tuples)]
+            field name (str) or band number (int): [list of biosphere flows (tuples)]
         }
 
+    Raster cells are identified by the coordinates of their center, like in Pandarus intersections; see ``raster_cell_labels``. Only features with at least one valid value are added to ``geomapping``.
+
+    Fields and bands are read as arrays, and the processed datapackage is built from these arrays instead of from the intermediate data, which is still written so that ``Method.load()``, ``copy()`` and ``process()`` see all the characterization factors.
+
     Args:
         * *geocollection*: A ``geocollection`` name.
         * *method_tuple*: A method tuple.
@@ -61,38 +216,60 @@ def import_regionalized_cfs(
         * *nan_value*: Sentinel value for missing values if ``NaN`` is not used directly.
 
     """
-    assert (
-        geocollection in geocollections
-        and geocollections[geocollection].get("kind") == "vector"
-        and "field" in geocollections[geocollection]
-    )
-    gdf = gp.read_file(geocollections[geocollection]["filepath"])
-    id_label = geocollections[geocollection]["field"]
+    assert geocollection in geocollections and geocollections[geocollection].get(
+        "kind"
+    ) in ("vector", "raster")
+    ids, columns = read_geocollection_values(geocollection, mapping, nan_value)
+    combined = np.zeros(len(ids), dtype=bool)
+    for mask, _ in columns.values():
+        combined |= mask
+    labels = np.zeros(len(ids), dtype=object)
+    labels[combined] = np.asarray(feature_labels(geocollection, ids[combined])).tolist()
+    locations = np.zeros(len(ids), dtype=np.int64)
+    locations[combined] = bulk_geomapping(labels[combined], geocollection)
 
     method = Method(method_tuple)
-    method.metadata["geocollections"] = [geocollection]
-    methods.flush()
-
-    data = []
+    global_cfs = list(global_cfs or [])
+    intermediate = list(global_cfs)
+    rows, cols, data = [], [], []
+    for label, biosphere_flows in mapping.items():
+        mask, values = columns[label]
+        values = values[mask] * scaling_factor
+        keys = [(geocollection, x) for x in labels[mask].tolist()]
+        for flow in biosphere_flows:
+            flow_id = get_id(flow)
+            rows.append(np.full(len(values), flow_id))
+            cols.append(locations[mask])
+            data.append(values)
+            intermediate.extend(zip(repeat(flow_id), values.tolist(), keys))
+    method.write(intermediate, process=False)
+
+    data = np.hstack(data) if data else np.zeros(0)
+    indices = np.empty(len(data), dtype=INDICES_DTYPE)
+    indices["row"] = np.hstack(rows) if rows else []
+    indices["col"] = np.hstack(cols) if cols else []
+
+    extra_metadata = {}
     if global_cfs:
-        data.extend(global_cfs)
-
-    for index, feature in gdf.iterrows():
-        for field_label, biosphere_flows in mapping.items():
-            value = feature[field_label]
-            if value is None or value == nan_value or np.isnan(value):
-                continue
-            else:
-                for flow in biosphere_flows:
-                    data.append(
-                        (
-                            flow,
-                            float(value) * scaling_factor,
-                            (geocollection, feature[id_label]),
-                        )
-                    )
-
-    method.write(data)
+        amounts, global_indices, distributions, _, _, _ = resolve_dict_iterator(
+            (method.process_row(row) for row in global_cfs), len(global_cfs)
+        )
+        if (distributions["uncertainty_type"] > 1).any():
+            regional = np.zeros(len(data), dtype=distributions.dtype)
+            regional["loc"] = data
+            for field in ("scale", "shape", "minimum", "maximum"):
+                regional[field] = np.nan
+            extra_metadata["distributions_array"] = np.hstack((distributions, regional))
+        indices = np.hstack((global_indices, indices))
+        data = np.hstack((amounts.astype(np.float64), data))
+
+    create_certain_datapackage(
+        indices,
+        data,
+        method,
+        global_index=geomapping[config.global_location],
+        **extra_metadata
+    )
 
 
 def get_pandarus_map(geocollection):
@@ -255,12 +432,87 @@ def filter_columns(matrix, col_indices, exclude=True):
     ).tocsr()
 
 
+def bulk_geomapping(ids, geocollection=None):
+    """Resolve an array of feature ids to ``geomapping`` integers.
+
+    Keys are ``(geocollection, id)``, or just ``id`` if ``geocollection`` is ``None``. Missing keys are added to ``geomapping`` in a single operation, and only unique ids are looked up.
+
+    Returns an integer array of the same length as ``ids``."""
+    if not len(ids):
+        return np.zeros(0, dtype=np.int64)
+    unique, inverse = np.unique(np.asarray(ids), return_inverse=True)
+    # ``tolist`` gives native Python objects, which is what ``geomapping`` stores
+    if geocollection is None:
+        keys = unique.tolist()
+    else:
+        keys = [(geocollection, x) for x in unique.tolist()]
+    geomapping.add(keys)
+    lookup = np.array([geomapping[key] for key in keys], dtype=np.int64)
+    return lookup[inverse.ravel()]
+
+
+LAYOUT_PREFERENCE = "bw2regional datapackage layout"
+LAYOUTS = ("zip", "directory")
+
+
+def datapackage_layout():
+    """Get the layout used for processed ``Intersection``, ``Loading``, and ``ExtensionTable`` datapackages, and regionalized ``Method`` datapackages, in the current project.
+
+    Returns ``"zip"`` (the default) or ``"directory"``. Directory datapackages are uncompressed, and their arrays are memory-mapped when loaded, so parallel workers share the same pages instead of each decompressing a private copy."""
+    return config.p.get(LAYOUT_PREFERENCE, "zip")
+
+
+def set_datapackage_layout(layout):
+    """Set the layout of processed regional datapackages for the current project.
+
+    Only affects data written afterwards; use ``unpack_datapackage`` to convert existing zip datapackages."""
+    if layout not in LAYOUTS:
+        raise ValueError(
+            "Unknown layout {}; must be one of {}".format(layout, ", ".join(LAYOUTS))
+        )
+    config.p[LAYOUT_PREFERENCE] = layout
+    config.p.flush()
+
+
+def directory_path(fp):
+    """Directory used instead of the zip archive ``fp`` in the ``directory`` layout"""
+    return Path(fp).with_suffix("")
+
+
+def unpack_datapackage(fp):
+    """Extract the zip datapackage at ``fp`` to an uncompressed, memory-mappable directory.
+
+    The zip archive is left in place, but ``dp`` prefers the directory unless the archive is newer. Returns the directory path."""
+    dirpath = directory_path(fp)
+    if dirpath.is_dir():
+        shutil.rmtree(dirpath)
+    with zipfile.ZipFile(fp) as archive:
+        archive.extractall(dirpath)
+    return dirpath
+
+
 def create_certain_datapackage(indices, data, data_store, **extra_metadata):
-    data_array = np.array(data)
-    indices_array = np.array(indices, dtype=INDICES_DTYPE)
+    data_array = np.asarray(data)
+    indices_array = np.asarray(indices, dtype=INDICES_DTYPE)
+
+    fp = data_store.filepath_processed()
+    dirpath = directory_path(fp)
+    if dirpath.is_dir():
+        shutil.rmtree(dirpath)
+    layout = datapackage_layout()
+    # ``bw2data`` always loads ``Method`` datapackages from the zip archive, so the
+    # directory is unpacked next to it
+    unpack = layout == "directory" and isinstance(data_store, Method)
+    if layout == "directory" and not unpack:
+        if fp.is_file():
+            fp.unlink()
+        dirpath.mkdir(parents=True)
+        fs = OSFS(str(dirpath))
+    else:
+        fs = ZipFS(str(fp), write=True)
 
     dp = create_datapackage(
-        fs=ZipFS(str(data_store.filepath_processed()), write=True),
+        fs=fs,
         name=clean_datapackage_name(str(data_store.name)),
         sum_intra_duplicates=True,
         sum_inter_duplicates=False,
@@ -273,7 +525,25 @@ def create_certain_datapackage(indices, data, data_store, **extra_metadata):
         **extra_metadata
     )
     dp.finalize_serialization()
+    if unpack:
+        unpack_datapackage(fp)
 
 
 def dp(fp):
-    return load_datapackage(ZipFS(fp))
+    """Load the datapackage at ``fp``, memory-mapping its arrays if it was written with the ``directory`` layout."""
+    dirpath = directory_path(fp)
+    metadata_fp = dirpath / "datapackage.json"
+    if metadata_fp.is_file() and (
+        not os.path.isfile(fp) or metadata_fp.stat().st_mtime >= os.stat(fp).st_mtime
+    ):
+        package = load_datapackage(OSFS(str(dirpath)), proxy=True)
+        package.data = [
+            (
+                np.load(dirpath / resource["path"], mmap_mode="r")
+                if resource["path"].endswith(".npy")
+                else obj
+            )
+            for resource, obj in zip(package.resources, package.data)
+        ]
+        return package
+    return load_datapackage(ZipFS(str(fp)))
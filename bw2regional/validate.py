@@ -1,3 +1,4 @@
+import numpy as np
 from bw2data.validate import maybe_uncertainty, valid_tuple
 from voluptuous import Any, Invalid, Schema
 
@@ -37,6 +38,30 @@ def xtable_data(obj):
     return obj
 
 
+def array_data(values, *id_arrays):
+    """Vectorized validation for the array-based ``write_arrays`` methods.
+
+    ``values`` must be a one-dimensional array of numbers without ``NaN``, and each array in ``id_arrays`` must have the same length.
+
+    Returns ``values`` as a float array."""
+    values = np.asarray(values)
+    if values.ndim != 1:
+        raise Invalid("Value array must be one-dimensional")
+    if values.dtype == bool or not np.issubdtype(values.dtype, np.number):
+        raise Invalid("Value array has non-numeric dtype {}".format(values.dtype))
+    values = values.astype(np.float64, copy=False)
+    if np.isnan(values).any():
+        raise Invalid("Value array contains NaN values")
+    for array in id_arrays:
+        if len(array) != len(values):
+            raise Invalid(
+                "Id array has length {}, but value array has length {}".format(
+                    len(array), len(values)
+                )
+            )
+    return values
+
+
 loading_validator = Schema([uncertainty_list])
 intersection_validator = Schema([float_as_last])
 xtable_validator = Schema([xtable_data])
@@ -12,37 +12,42 @@ class ExtensionTable(Loading):
     def filename(self):
         return super(ExtensionTable, self).filename.replace(".loading", ".xtable")
 
+    def write_arrays(self, ids, values, geocollection=None, **extra_metadata):
+        """Like ``Loading.write_arrays``, but ``geocollection`` defaults to the geocollection of this extension table."""
+        if geocollection is None:
+            geocollection = extension_tables.get(self.name, {}).get("geocollection")
+        if geocollection is None:
+            raise ValueError("No geocollection for this extension table")
+        super(ExtensionTable, self).write_arrays(
+            ids, values, geocollection, **extra_metadata
+        )
+
     def write_to_map(self, *args, **kwargs):
         raise NotImplementedError
 
     def import_from_map(self, mask=None):
-        from .utils import get_pandarus_map
+        """Import values from the ``xt_field`` field (vector) or ``band`` band (raster, default is ``1``) of this extension table's geocollection.
 
-        geocollection = extension_tables[self.name].get("geocollection")
-        xt_field = extension_tables[self.name].get("xt_field")
+        Values are read as an array, and missing, ``NaN``, ``mask``, and raster nodata values are skipped. Raster cells are identified like in Pandarus intersections; see ``raster_cell_labels``."""
+        from .utils import feature_labels, read_geocollection_values
 
+        geocollection = extension_tables[self.name].get("geocollection")
         if not geocollection:
             raise ValueError("No geocollection for this extension table")
-        if geocollections[geocollection].get('kind') == 'raster':
-            raise ValueError("This function is only for vectors.")
-
-        map_obj = get_pandarus_map(geocollection)
-        data = []
-
-        if xt_field is None:
-            raise ValueError("No `xt_field` field name specified")
-
-        id_field = geocollections[geocollection].get("field")
-        if not id_field:
-            raise ValueError(
-                "Geocollection must specify ``field`` field name for unique feature ids"
-            )
-
-        for feature in map_obj:
-            label = feature["properties"][id_field]
-            value = float(feature["properties"][xt_field])
-            if mask is not None and value == mask:
-                continue
-            data.append((value, (geocollection, label)))
 
-        self.write(data)
+        if geocollections[geocollection].get("kind") == "raster":
+            label = extension_tables[self.name].get("band") or 1
+        else:
+            label = extension_tables[self.name].get("xt_field")
+            if label is None:
+                raise ValueError("No `xt_field` field name specified")
+            if not geocollections[geocollection].get("field"):
+                raise ValueError(
+                    "Geocollection must specify ``field`` field name for unique feature ids"
+                )
+
+        ids, columns = read_geocollection_values(geocollection, [label], mask)
+        valid, values = columns[label]
+        self.write_arrays(
+            feature_labels(geocollection, ids[valid]), values[valid], geocollection
+        )
@@ -0,0 +1,146 @@
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio import features, windows
+from rasterio.transform import Affine
+
+from .density import get_column_array
+
+
+def _zone_window(bounds, transform, width, height):
+    """Get raster window covering ``bounds``, or ``None`` if outside the raster"""
+    inverse = ~transform
+    cols, rows = zip(*[inverse @ (x, y) for x in bounds[::2] for y in bounds[1::2]])
+    col_start, col_stop = max(math.floor(min(cols)), 0), min(
+        math.ceil(max(cols)), width
+    )
+    row_start, row_stop = max(math.floor(min(rows)), 0), min(
+        math.ceil(max(rows)), height
+    )
+    if col_stop <= col_start or row_stop <= row_start:
+        return None
+    return windows.Window(
+        col_start, row_start, col_stop - col_start, row_stop - row_start
+    )
+
+
+def zonal_means_chunk(
+    raster_fp,
+    geometries,
+    band=1,
+    nodata=None,
+    mask_negative=True,
+    weighted=True,
+    supersample=1,
+):
+    """Calculate raster means for a list of shapely ``geometries``, reading only the raster window around each geometry.
+
+    See ``zonal_means`` for the other arguments. Returns a float array, with ``NaN`` for zones without valid raster cells."""
+    with rasterio.open(raster_fp) as src:
+        nodata = src.nodata if nodata is None else nodata
+        geographic = src.crs is not None and src.crs.is_geographic
+        results = np.full(len(geometries), np.nan)
+
+        for index, geom in enumerate(geometries):
+            if geom is None or geom.is_empty:
+                continue
+            window = _zone_window(geom.bounds, src.transform, src.width, src.height)
+            if window is None:
+                continue
+            transform = windows.transform(window, src.transform)
+            data = src.read(band, window=window).astype(np.float64)
+
+            shape = (window.height * supersample, window.width * supersample)
+            coverage = features.geometry_mask(
+                [geom],
+                out_shape=shape,
+                transform=transform @ Affine.scale(1 / supersample),
+                invert=True,
+            )
+            coverage = coverage.reshape(
+                window.height, supersample, window.width, supersample
+            ).mean(axis=(1, 3))
+
+            valid = coverage > 0
+            if nodata is not None:
+                valid &= data != nodata
+            valid &= ~np.isnan(data)
+            if mask_negative:
+                valid &= data >= 0
+
+            weights = np.where(valid, coverage, 0)
+            if weighted and geographic:
+                weights *= get_column_array(
+                    transform, window.height, abs(transform.a)
+                ).reshape((-1, 1))
+            total = weights.sum()
+            if total > 0:
+                results[index] = (np.where(valid, data, 0) * weights).sum() / total
+    return results
+
+
+def zonal_means(
+    vector_fp,
+    field,
+    raster_fp,
+    band=1,
+    layer=None,
+    nodata=None,
+    mask_negative=True,
+    weighted=True,
+    supersample=1,
+    processes=None,
+):
+    """Calculate the mean raster value for each spatial unit in a vector dataset.
+
+    Zones are sorted spatially and split into chunks, which are processed in parallel in ``processes`` worker processes (default is the number of CPUs; use ``1`` to calculate in this process). For each zone only the raster window covering its bounds is read, and the zone is rasterized into a mask for that window.
+
+    * ``nodata``: Raster value to ignore, in addition to ``NaN``. Default is the raster nodata value.
+    * ``mask_negative``: Ignore negative raster values.
+    * ``weighted``: Weight cells by their area if the raster is in geographic coordinates, as cells get smaller towards the poles.
+    * ``supersample``: Subdivide each cell into ``supersample`` x ``supersample`` parts when rasterizing zones, and weight each cell by the fraction of its parts in the zone. The default of ``1`` includes cells whose center is in the zone, like ``rasterstats``.
+
+    Returns feature ids and mean values as arrays. Zones without valid raster cells are left out."""
+    import geopandas as gp
+
+    df = gp.read_file(vector_fp, layer=layer)
+    with rasterio.open(raster_fp) as src:
+        if df.crs and src.crs and df.crs != src.crs:
+            df = df.to_crs(src.crs)
+
+    # Neighbouring zones are processed together to reuse cached raster blocks
+    centroids = df.geometry.representative_point()
+    order = np.lexsort((centroids.x.values, centroids.y.values))
+    ids = df[field].values[order]
+    geometries = list(df.geometry.values[order])
+
+    processes = processes or multiprocessing.cpu_count()
+    kwargs = dict(
+        band=band,
+        nodata=nodata,
+        mask_negative=mask_negative,
+        weighted=weighted,
+        supersample=supersample,
+    )
+    if processes == 1 or len(geometries) < 2:
+        means = zonal_means_chunk(raster_fp, geometries, **kwargs)
+    else:
+        chunks = np.array_split(np.arange(len(geometries)), processes * 4)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(
+                    zonal_means_chunk,
+                    raster_fp,
+                    [geometries[i] for i in chunk],
+                    **kwargs
+                )
+                for chunk in chunks
+                if len(chunk)
+            ]
+            means = np.hstack([future.result() for future in futures])
+
+    found = ~np.isnan(means)
+    return ids[found], means[found]
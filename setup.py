@@ -8,6 +8,7 @@ requirements = [
     "constructive_geometries",
     "fiona",
     "geopandas",
+    "platformdirs",
     "rasterio",
     "rasterstats",
     "requests",
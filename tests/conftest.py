@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from bw2data import geomapping
+
+from bw2regional.directories import DATA_DIR_ENVIRONMENT_VARIABLE
+from bw2regional.lca.base_class import SPATIAL_DICTS
+
+
+@pytest.fixture(autouse=True)
+def shared_data_dir(tmp_path, monkeypatch):
+    """Keep data shared by all projects out of the user data directory"""
+    monkeypatch.setenv(DATA_DIR_ENVIRONMENT_VARIABLE, str(tmp_path / "shared"))
+
+
+def _check_spatial_contributions(lca, scales):
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    for scale in scales:
+        results = getattr(lca, "results_{}_spatial_scale".format(scale))()
+        totals = np.ravel(results.sum(axis=0))
+        spatial = getattr(lca.dicts, SPATIAL_DICTS[scale])
+        expected = {
+            reversed_geomapping[geo_id]: totals[index]
+            for geo_id, index in spatial.items()
+        }
+        assert sum(expected.values()) == pytest.approx(lca.score)
+
+        for block_size in (1, 1000):
+            given = np.hstack(
+                list(lca.spatial_contributions(scale, block_size=block_size))
+            )
+            assert given["amount"].sum() == pytest.approx(lca.score)
+            summed = dict.fromkeys(expected, 0)
+            for row in given:
+                summed[reversed_geomapping[row["location"]]] += row["amount"]
+            assert summed == pytest.approx(expected)
+
+        given = lca.top_spatial_contributions(scale, k=len(expected))
+        assert {location: value for value, location in given} == pytest.approx(
+            {location: value for location, value in expected.items() if value}
+        )
+        given = lca.top_spatial_contributions(
+            scale, k=len(expected) * len(lca.dicts.activity), activities=True
+        )
+        assert sum(x[0] for x in given) == pytest.approx(lca.score)
+
+        for location, value in expected.items():
+            given = lca.spatial_unit_contributions(location, scale)
+            assert sum(x[0] for x in given) == pytest.approx(value)
+            assert sorted(x[1] for x in given) == sorted(
+                lca.spatial_unit_activities(location, scale).tolist()
+            )
+
+
+@pytest.fixture
+def check_spatial_contributions():
+    """Check the spatial contributions of an LCA on each of its spatial ``scales`` against the results on that scale and ``lca.score``"""
+    return _check_spatial_contributions
@@ -1,10 +1,11 @@
 import os
 
 import numpy as np
+import pytest
 import rasterio
 from affine import Affine
 
-from bw2regional.density import divide_by_area
+from bw2regional.density import divide_by_area, get_area, get_column_array
 
 AREAS = (
     np.array(
@@ -211,6 +212,59 @@ def test_divide_by_area(tmpdir):
     assert np.allclose(given, expected[::-1, :])
 
 
+def test_get_column_array():
+    given = get_column_array(Affine(0.5, 0, -90, 0, -0.5, 90), 180, 0.5)
+    assert given.shape == (1, 180, 1)
+    assert np.allclose(given[0, ::-1], AREAS)
+
+
+def test_get_area_across_equator():
+    assert get_area(1, -1, 1) == pytest.approx(2 * get_area(1, 0, 1))
+    assert get_area(-1, 1, 1) == pytest.approx(get_area(1, -1, 1))
+
+
+def test_divide_by_area_blocks(tmpdir):
+    reference = os.path.join(tmpdir, "reference.tiff")
+    divide_by_area(FIXTURE, reference)
+    with rasterio.open(reference) as r:
+        expected = r.read(1)
+
+    for block_rows, threads in ((7, 1), (7, 4), (1, 2)):
+        destination = os.path.join(tmpdir, "{}-{}.tiff".format(block_rows, threads))
+        divide_by_area(FIXTURE, destination, block_rows=block_rows, threads=threads)
+        with rasterio.open(destination) as r:
+            assert np.allclose(r.read(1), expected)
+
+
+def test_divide_by_area_nodata_and_integers(tmpdir):
+    source = os.path.join(tmpdir, "source.tiff")
+    with rasterio.open(
+        source,
+        "w",
+        driver="GTiff",
+        width=2,
+        height=4,
+        count=1,
+        dtype="int32",
+        crs="EPSG:4326",
+        transform=Affine(1, 0, 0, 0, -1, 2),
+        nodata=-1,
+    ) as sink:
+        sink.write(np.array([[1, -1], [1, 1], [-1, 1], [1, 1]], dtype=np.int32), 1)
+
+    destination = os.path.join(tmpdir, "output.tiff")
+    divide_by_area(source, destination, block_rows=3)
+    with rasterio.open(destination) as r:
+        assert r.dtypes[0] == "float64"
+        given = r.read(1)
+
+    areas = get_column_array(Affine(1, 0, 0, 0, -1, 2), 4, 1)[0]
+    assert given[0, 1] == given[2, 0] == -1
+    assert np.allclose(given[[0, 1, 3], 0], 1 / areas[[0, 1, 3], 0])
+    # Cells north and south of the equator have the same area
+    assert given[1, 0] == pytest.approx(given[2, 1])
+
+
 def write_test_raster():
     meta = {
         "affine": Affine(0.5, 0, -90, 0, -0.5, 90),
@@ -0,0 +1,296 @@
+import importlib.util
+import os
+
+import geopandas as gp
+import numpy as np
+import pytest
+import rasterio
+from bw2calc.dictionary_manager import ReversibleRemappableDictionary
+from bw2data import Database, geomapping, get_id
+from bw2data.tests import bw2test
+from scipy.sparse import coo_matrix, csr_matrix
+
+from bw2regional import geocollections
+from bw2regional.export import (
+    add_attributes,
+    add_results,
+    add_two_geojson_results,
+    as_ia_raster,
+    create_geodataframe,
+    geometry_index,
+    write_columnar,
+)
+from bw2regional.lca.base_class import SpatialResultsMixin
+from bw2regional.utils import raster_cell_labels
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+
+def setup_results():
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    geomapping.add([("countries", "Benin"), ("countries", "Togo")])
+    col_dict = ReversibleRemappableDictionary(
+        {
+            geomapping[("countries", "Benin")]: 0,
+            geomapping[("countries", "Togo")]: 1,
+            geomapping["GLO"]: 2,
+        }
+    )
+    row_dict = ReversibleRemappableDictionary({100: 0, 101: 1})
+    matrix = coo_matrix(np.array([[1.0, 0.1, 5], [2, 0, 0]]))
+    return matrix, row_dict, col_dict
+
+
+@bw2test
+def test_create_geodataframe():
+    matrix, row_dict, col_dict = setup_results()
+    df = create_geodataframe(
+        matrix,
+        ["countries"],
+        row_dict,
+        col_dict,
+        attribute_adder=lambda x, y: {"flow": x * 2},
+    )
+    # Global location isn't plottable
+    assert len(df) == 3
+    assert df["score_abs"].tolist() == [1, 0.1, 2]
+    assert df["score_rel"].sum() == pytest.approx(3.1 / 8.1)
+    assert df["row_index"].tolist() == [100, 100, 101]
+    assert df["flow"].tolist() == [200, 200, 202]
+    assert df["location_key"].tolist() == [
+        str(("countries", name)) for name in ("Benin", "Togo", "Benin")
+    ]
+    assert df.geometry.notna().all()
+    assert df.geometry[0].equals(df.geometry[2])
+
+    df = create_geodataframe(matrix, ["countries"], row_dict, col_dict, cutoff=0.05)
+    assert df["score_abs"].tolist() == [1, 2]
+
+
+@bw2test
+def test_geometry_index_cached():
+    matrix, row_dict, col_dict = setup_results()
+    geometry_index.clear()
+    create_geodataframe(matrix, ["countries"], row_dict, col_dict)
+    first = geometry_index["countries"]
+    create_geodataframe(matrix, ["countries"], row_dict, col_dict)
+    assert geometry_index["countries"] is first
+
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "isotwolettercode",
+    }
+    assert geometry_index["countries"] is not first
+    assert sorted(geometry_index["countries"].index) == ["BJ", "TG"]
+
+
+@bw2test
+def test_create_geodataframe_missing_geometries():
+    matrix, row_dict, col_dict = setup_results()
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "isotwolettercode",
+    }
+    with pytest.warns(UserWarning, match="3 results at 2 locations have no geometry"):
+        df = create_geodataframe(matrix, ["countries"], row_dict, col_dict)
+    assert len(df) == 3
+    assert df.geometry.isna().all()
+
+
+@bw2test
+@pytest.mark.parametrize("extension", [".parquet", ".arrow"])
+def test_write_columnar(tmpdir, extension):
+    pytest.importorskip("pyarrow")
+    matrix, row_dict, col_dict = setup_results()
+    df = create_geodataframe(matrix, ["countries"], row_dict, col_dict)
+    for compression in ("zstd", None):
+        fp = os.path.join(tmpdir, str(compression) + extension)
+        write_columnar(df, fp, compression=compression)
+        if extension == ".parquet":
+            given = gp.read_parquet(fp)
+        else:
+            given = gp.read_feather(fp)
+        assert given["score_abs"].tolist() == df["score_abs"].tolist()
+        assert given.geometry.equals(df.geometry)
+
+    with pytest.raises(ValueError):
+        write_columnar(df, os.path.join(tmpdir, "foo.csv"))
+
+
+@pytest.mark.skipif(
+    importlib.util.find_spec("pyarrow") is not None, reason="pyarrow is installed"
+)
+def test_write_columnar_requires_pyarrow(tmpdir):
+    with pytest.raises(ImportError):
+        write_columnar(gp.GeoDataFrame(), os.path.join(tmpdir, "foo.parquet"))
+
+
+class FakeLCA(SpatialResultsMixin):
+    def __init__(self, matrix, biosphere, ia_spatial):
+        self.matrix = matrix
+        self.dicts = type(
+            "Dicts",
+            (),
+            {
+                "biosphere": ReversibleRemappableDictionary(biosphere),
+                "ia_spatial": ReversibleRemappableDictionary(ia_spatial),
+            },
+        )
+
+    def results_ia_spatial_scale(self):
+        return self.matrix
+
+
+@bw2test
+def test_as_ia_raster(tmpdir):
+    Database("biosphere").write(
+        {
+            ("biosphere", "F"): {"type": "emission"},
+            ("biosphere", "G"): {"type": "emission"},
+        }
+    )
+    F, G = get_id(("biosphere", "F")), get_id(("biosphere", "G"))
+    fp = os.path.join(data_dir, "test_raster_cfs.tif")
+    geocollections["cfs"] = {"filepath": fp}
+    with rasterio.open(fp) as src:
+        transform = src.transform
+    # Cells in the first and last row, a cell labelled by Pandarus (row 6,
+    # column 14), a location in another geocollection, and an invalid label
+    first, last, other = raster_cell_labels([3, 15 * 25 + 24, 30], (16, 25), transform)
+    locations = [
+        ("cfs", first),
+        ("cfs", last),
+        ("cfs", other),
+        ("cfs", "Cell(2.36904500e+00, 8.80577500e+00)"),
+        ("other", 1),
+        ("cfs", "foo"),
+    ]
+    geomapping.add(locations)
+    lca = FakeLCA(
+        csr_matrix(np.array([[1.0, 2, 0, 4, 7, 5], [10, 0, 30, 40, 70, 50]])),
+        {F: 0, G: 1},
+        {geomapping[key]: index for index, key in enumerate(locations)},
+    )
+    for block_rows in (None, 4):
+        summed = os.path.join(tmpdir, "summed-{}.tif".format(block_rows))
+        with pytest.warns(UserWarning, match="Skipping 1 spatial units"):
+            as_ia_raster(lca, "cfs", summed, block_rows=block_rows)
+        with rasterio.open(summed) as src:
+            assert src.count == 1
+            assert src.transform == transform
+            array = src.read(1)
+        assert array[0, 3] == 11
+        assert array[15, 24] == 2
+        assert array[1, 5] == 30
+        assert array[6, 14] == 44
+        assert (array == -9999).sum() == 16 * 25 - 4
+
+    per_flow = os.path.join(tmpdir, "flows.tif")
+    with pytest.warns(UserWarning):
+        as_ia_raster(lca, "cfs", per_flow, flows=[("biosphere", "G"), F])
+    with rasterio.open(per_flow) as src:
+        array = src.read()
+        assert src.descriptions == (str(("biosphere", "G")), str(F))
+    assert array.shape == (2, 16, 25)
+    assert array[:, 0, 3].tolist() == [10, 1]
+    assert array[:, 1, 5].tolist() == [30, 0]
+    assert array[:, 2, 2].tolist() == [-9999, -9999]
+
+
+def write_results(dirpath, name, scores, column="score_abs"):
+    gdf = gp.read_file(os.path.join(data_dir, "test_countries.gpkg"))[
+        ["name", "geometry"]
+    ]
+    gdf[column] = scores
+    fp = os.path.join(dirpath, name + ".geojson")
+    gdf.to_file(fp, driver="GeoJSON")
+    return fp
+
+
+@pytest.mark.parametrize("extension", [".geojson", ".parquet", ".arrow"])
+def test_add_results_streams_chunks(tmpdir, extension):
+    if extension != ".geojson":
+        pytest.importorskip("pyarrow")
+    first = write_results(tmpdir, "a", [1.0, 2])
+    gdf = gp.read_file(first).iloc[:1]
+    gdf["name"] = ["Benin (b)"]
+    gdf["score_abs"] = [10.0]
+    second = os.path.join(tmpdir, "b.geojson")
+    gdf.to_file(second, driver="GeoJSON")
+
+    # Togo is written from the first file, Benin from the second
+    fp = add_results([first, second], os.path.join(tmpdir, "sum" + extension))
+    if extension == ".parquet":
+        given = gp.read_parquet(fp)
+    elif extension == ".arrow":
+        given = gp.read_feather(fp)
+    else:
+        given = gp.read_file(fp)
+    assert given["name"].tolist() == ["Togo", "Benin (b)"]
+    assert given["score_abs"].tolist() == [2, 11]
+    assert given.crs == gdf.crs
+
+    # All features below the cutoff
+    fp = add_results(
+        [first], os.path.join(tmpdir, "empty" + extension), cutoff=float("inf")
+    )
+    assert os.path.isfile(fp)
+
+
+def test_add_results(tmpdir):
+    # Benin, Togo
+    files = [
+        write_results(tmpdir, "a", [1.0, 2]),
+        write_results(tmpdir, "b", [10.0, 0.001], column="other"),
+        write_results(tmpdir, "c", [100.0, 3]),
+    ]
+    for field in ("name", None):
+        fp = add_results(
+            files,
+            os.path.join(tmpdir, "sum-{}".format(field)),
+            column_names=["score_abs", "other", "score_abs"],
+            field=field,
+        )
+        assert fp.endswith(".geojson")
+        given = gp.read_file(fp).set_index("name")
+        assert given["score_abs"].to_dict() == pytest.approx(
+            {"Benin": 111, "Togo": 5.001}
+        )
+        assert given["score_rel"].sum() == pytest.approx(1)
+
+    fp = add_results(
+        files[:2],
+        os.path.join(tmpdir, "cut.geojson"),
+        column_names=["score_abs", "other"],
+        cutoff=0.2,
+    )
+    assert gp.read_file(fp)["name"].tolist() == ["Benin"]
+
+    fp = add_two_geojson_results(
+        files[0], files[2], os.path.join(tmpdir, "two.geojson")
+    )
+    assert sorted(gp.read_file(fp)["score_abs"]) == [5, 101]
+
+    # Duplicated features are written with the properties of the last file
+    gdf = gp.read_file(files[2])
+    gdf["name"] = ["Benin (c)", "Togo (c)"]
+    gdf.to_file(files[2], driver="GeoJSON")
+    fp = add_two_geojson_results(
+        files[0], files[2], os.path.join(tmpdir, "last.geojson")
+    )
+    given = gp.read_file(fp).set_index("name")["score_abs"].to_dict()
+    assert given == {"Benin (c)": 101, "Togo (c)": 5}
+
+    with pytest.raises(ValueError):
+        add_results(files, os.path.join(tmpdir, "x"), column_names=["score_abs"])
+
+
+def test_add_attributes_deprecated():
+    with pytest.warns(DeprecationWarning):
+        given = add_attributes({"a": 1}, lambda x, y: {"b": x + y}, 1, 2)
+    assert given == {"a": 1, "b": 3}
+    with pytest.warns(DeprecationWarning):
+        assert add_attributes({"a": 1}, None, 1, 2) == {"a": 1}
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+from bw2data import Database, Method, get_id
+from bw2data.tests import bw2test
+
+from bw2regional.intersection import Intersection
+from bw2regional.lca import ExtensionTablesLCA as LCA
+from bw2regional.meta import extension_tables
+from bw2regional.xtables import ExtensionTable
+
+
+@bw2test
+def import_data():
+    biosphere_data = {
+        ("biosphere", "F"): {
+            "type": "emission",
+            "exchanges": [],
+        },
+        ("biosphere", "G"): {
+            "type": "emission",
+            "exchanges": [],
+        },
+    }
+    biosphere = Database("biosphere")
+    biosphere.write(biosphere_data)
+
+    inventory_data = {
+        ("inventory", "U"): {
+            "type": "process",
+            "location": ("places", "L"),
+            "exchanges": [
+                {"input": ("biosphere", "F"), "type": "biosphere", "amount": 1},
+                {"input": ("biosphere", "G"), "type": "biosphere", "amount": 1},
+            ],
+        },
+        ("inventory", "V"): {
+            "type": "process",
+            "location": ("places", "M"),
+            "exchanges": [
+                {"input": ("biosphere", "F"), "type": "biosphere", "amount": 1}
+            ],
+        },
+        ("inventory", "X"): {
+            "type": "process",
+            "location": ("places", "N"),
+            "exchanges": [
+                {"input": ("biosphere", "G"), "type": "biosphere", "amount": 1}
+            ],
+        },
+    }
+    inventory = Database("inventory")
+    inventory.write(inventory_data)
+
+    Intersection(("places", "xt")).write(
+        [
+            [("places", "L"), ("xt", "a"), 1],
+            [("places", "M"), ("xt", "a"), 1],
+            [("places", "M"), ("xt", "b"), 2],
+            [("places", "N"), ("xt", "b"), 3],
+            [("places", "N"), ("xt", "c"), 1],
+        ]
+    )
+    Intersection(("xt", "regions")).write(
+        [
+            [("xt", "a"), ("regions", "A"), 2],
+            [("xt", "b"), ("regions", "A"), 1],
+            [("xt", "b"), ("regions", "B"), 3],
+            [("xt", "c"), ("regions", "B"), 1],
+            [("xt", "c"), ("regions", "C"), 2],
+        ]
+    )
+
+    extension_tables["xt"] = {"geocollection": "xt"}
+    ExtensionTable("xt").write(
+        [
+            [1, ("xt", "a")],
+            [2, ("xt", "b")],
+            [4, ("xt", "c")],
+        ]
+    )
+
+    method_data = [
+        [("biosphere", "F"), 1, ("regions", "A")],
+        [("biosphere", "G"), 2, ("regions", "A")],
+        [("biosphere", "F"), 3, ("regions", "B")],
+        [("biosphere", "G"), 4, ("regions", "B")],
+        [("biosphere", "F"), 5, ("regions", "C")],
+        [("biosphere", "G"), 6, ("regions", "C")],
+    ]
+    Method(("a", "method")).write(method_data)
+
+
+def get_lca():
+    import_data()
+    lca = LCA(
+        {("inventory", "U"): 1, ("inventory", "V"): 1, ("inventory", "X"): 1},
+        method=("a", "method"),
+        xtable="xt",
+    )
+    lca.lci()
+    lca.lcia()
+    return lca
+
+
+def test_lca_score():
+    lca = get_lca()
+    # U is all in A; V is split 1:4 over ``a`` (A) and ``b`` (A, B); X is
+    # split 6:4 over ``b`` and ``c`` (B, C)
+    expected = (1 + 2) + (1 / 5 * 1 + 4 / 5 * (1 / 4 * 1 + 3 / 4 * 3))
+    expected += 6 / 10 * (1 / 4 * 2 + 3 / 4 * 4) + 4 / 10 * (1 / 3 * 4 + 2 / 3 * 6)
+    assert lca.score == pytest.approx(expected)
+
+
+def test_spatial_contributions(check_spatial_contributions):
+    lca = get_lca()
+    check_spatial_contributions(lca, ["ia", "inv", "xtable"])
+
+    U, V, X = [get_id(("inventory", x)) for x in "UVX"]
+    assert sorted(lca.spatial_unit_activities(("xt", "a"), "xtable")) == sorted([U, V])
+    assert lca.spatial_unit_activities(("regions", "C")).tolist() == [X]
+    assert np.allclose(
+        sum(x[0] for x in lca.spatial_unit_contributions(("regions", "C"))),
+        4 / 10 * 2 / 3 * 6,
+    )
@@ -0,0 +1,94 @@
+import geopandas as gp
+import pytest
+from bw2data import geomapping
+from bw2data.tests import bw2test
+from shapely.geometry import box
+
+from bw2regional import geocollections, intersections
+from bw2regional.gis_tasks import (
+    calculate_intersection,
+    hash_features,
+    update_intersection,
+)
+from bw2regional.intersection import DIRECTIONAL_METADATA, Intersection
+
+
+def write_boxes(filepath, field, boxes):
+    gp.GeoDataFrame(
+        {field: list(boxes)}, geometry=list(boxes.values()), crs="EPSG:4326"
+    ).to_file(filepath, driver="GPKG")
+
+
+def matrix_entries(name):
+    package = Intersection(name).datapackage()
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    indices = package.get_resource("{}_{}_matrix_data.indices".format(*name))[0]
+    data = package.get_resource("{}_{}_matrix_data.data".format(*name))[0]
+    return {
+        (reversed_geomapping[row], reversed_geomapping[col]): value
+        for (row, col), value in zip(indices.tolist(), data)
+    }
+
+
+def setup_grids(tmpdir):
+    first, second = str(tmpdir / "first.gpkg"), str(tmpdir / "second.gpkg")
+    write_boxes(first, "a", {"w": box(0, 0, 1, 2), "e": box(1, 0, 2, 2)})
+    write_boxes(
+        second, "b", {1: box(0, 0, 2, 1), 2: box(0, 1, 2, 2), 3: box(5, 5, 6, 6)}
+    )
+    geocollections["first"] = {"filepath": first, "field": "a"}
+    geocollections["second"] = {"filepath": second, "field": "b"}
+    calculate_intersection("first", "second", engine="geopandas", use_store=False)
+    return first, second
+
+
+def test_hash_features():
+    df = gp.GeoDataFrame({"id": [1, 2]}, geometry=[box(0, 0, 1, 1), box(0, 0, 1, 1)])
+    hashes = hash_features(df, "id")
+    assert hashes[1] == hashes[2]
+    df.geometry = [box(0, 0, 1, 1), box(0, 0, 2, 1)]
+    assert hash_features(df, "id")[1] != hash_features(df, "id")[2]
+
+
+@bw2test
+def test_update_intersection(tmpdir):
+    first, second = setup_grids(tmpdir)
+    assert len(intersections[("first", "second")]["sha256"]) == 2
+
+    # Redraw "e", drop "w", add "n"; remove feature 3
+    write_boxes(first, "a", {"e": box(1, 0, 3, 2), "n": box(0, 2, 2, 3)})
+    write_boxes(second, "b", {1: box(0, 0, 2, 1), 2: box(0, 1, 2, 2)})
+    assert update_intersection("first", "second") == (3, 1)
+    updated = matrix_entries(("first", "second"))
+    assert ("first", "w") not in {row for row, _ in updated}
+    assert matrix_entries(("second", "first")) == {
+        (col, row): value for (row, col), value in updated.items()
+    }
+    # The reversed view mirrors the updated metadata
+    assert Intersection(("second", "first")).is_reversed
+    forward = intersections[("first", "second")]
+    view = intersections[("second", "first")]
+    assert view["reversed"]
+    for key in set(forward).union(view).difference(DIRECTIONAL_METADATA):
+        if key != "abbreviation":
+            assert view[key] == forward[key]
+
+    calculate_intersection(
+        "first", "second", engine="geopandas", overwrite=True, use_store=False
+    )
+    expected = matrix_entries(("first", "second"))
+    assert updated.keys() == expected.keys()
+    for key, value in expected.items():
+        assert updated[key] == pytest.approx(value)
+
+    # Nothing changed since the last calculation
+    assert update_intersection("second", "first") == (0, 0)
+
+
+@bw2test
+def test_update_intersection_without_hashes():
+    geocollections["countries"] = {}
+    geocollections["provinces"] = {}
+    Intersection(("countries", "provinces")).write_arrays(["Benin"], [1], [1.0])
+    with pytest.raises(ValueError):
+        update_intersection("countries", "provinces")
@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+from bw2data import geomapping, projects
+from bw2data.tests import bw2test
+
+from bw2regional import geocollections, intersections
+from bw2regional.directories import DATA_DIR_ENVIRONMENT_VARIABLE
+from bw2regional.intersection import Intersection
+from bw2regional.intersection_store import (
+    STORE_ENVIRONMENT_VARIABLE,
+    IntersectionStore,
+    file_lock,
+)
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+
+def register_geocollections():
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["provinces"] = {
+        "filepath": os.path.join(data_dir, "test_provinces.gpkg"),
+        "field": "OBJECTID_1",
+    }
+
+
+def matrix_entries(name):
+    package = Intersection(name).datapackage()
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    indices = package.get_resource("{}_{}_matrix_data.indices".format(*name))[0]
+    data = package.get_resource("{}_{}_matrix_data.data".format(*name))[0]
+    return {
+        (reversed_geomapping[row], reversed_geomapping[col]): value
+        for (row, col), value in zip(indices.tolist(), data)
+    }
+
+
+def test_store_location(tmp_path, monkeypatch):
+    monkeypatch.setenv(DATA_DIR_ENVIRONMENT_VARIABLE, str(tmp_path / "shared"))
+    assert IntersectionStore().dirpath == tmp_path / "shared" / "intersections"
+    monkeypatch.setenv(STORE_ENVIRONMENT_VARIABLE, str(tmp_path / "store"))
+    assert IntersectionStore().dirpath == tmp_path / "store"
+    assert IntersectionStore(tmp_path / "other").dirpath == tmp_path / "other"
+
+
+@bw2test
+def test_store_key():
+    register_geocollections()
+    store = IntersectionStore()
+    assert store.key("countries", "provinces")
+    assert store.key("countries", "provinces") != store.key("provinces", "countries")
+    assert store.key("countries", "missing") is None
+
+
+@bw2test
+def test_store_reuse_across_projects(tmpdir):
+    register_geocollections()
+    store = IntersectionStore(str(tmpdir))
+    Intersection(("countries", "provinces")).write_arrays(
+        ["Benin", "Benin", "Togo"], [1755, 1757, 611], [1.0, 2.0, 3.0]
+    )
+    assert store.add("countries", "provinces")
+    assert not store.add("countries", "provinces")
+    assert ("countries", "provinces") in store
+    assert ("provinces", "countries") in store
+    expected = matrix_entries(("countries", "provinces"))
+
+    projects.set_current("another project")
+    assert ("countries", "provinces") not in intersections
+    register_geocollections()
+    geomapping.add([("foo", "bar")])
+
+    assert store.retrieve("countries", "provinces")
+    assert intersections[("countries", "provinces")]["store"]
+    assert Intersection(("provinces", "countries")).is_reversed
+    assert matrix_entries(("countries", "provinces")) == expected
+
+
+@bw2test
+def test_store_retrieve_swapped(tmpdir):
+    register_geocollections()
+    store = IntersectionStore(str(tmpdir))
+    Intersection(("countries", "provinces")).write_arrays(
+        ["Benin", "Togo"], [1755, 611], [1.0, 3.0]
+    )
+    store.add("countries", "provinces")
+
+    projects.set_current("another project")
+    register_geocollections()
+    assert store.retrieve("provinces", "countries")
+    assert matrix_entries(("provinces", "countries")) == {
+        (("provinces", 1755), ("countries", "Benin")): 1.0,
+        (("provinces", 611), ("countries", "Togo")): 3.0,
+    }
+
+
+@bw2test
+def test_store_missing_entry(tmpdir):
+    register_geocollections()
+    assert IntersectionStore(str(tmpdir)).retrieve("countries", "provinces") is None
+
+
+def test_file_lock(tmpdir):
+    fp = os.path.join(tmpdir, "foo.lock")
+    with file_lock(fp):
+        assert os.path.isfile(fp)
+    assert not os.path.isfile(fp)
@@ -1,9 +1,13 @@
+import numpy as np
 import pytest
 from bw2data import geomapping
+from bw2data.errors import MissingIntermediateData
 from bw2data.tests import bw2test
 from voluptuous import Invalid
 
+from bw2regional.errors import MissingIntersection
 from bw2regional.intersection import Intersection
+from bw2regional.meta import intersections
 
 
 @bw2test
@@ -29,3 +33,111 @@ def test_validation():
         inter.validate([[1, 2]])
     with pytest.raises(Invalid):
         inter.validate([[1, 2, {"amount": 3.0}]])
+
+
+@bw2test
+def test_write_arrays():
+    data = [
+        [("foo", "a"), ("bar", 1), 1.0],
+        [("foo", "b"), ("bar", 1), 2.0],
+        [("foo", "b"), ("bar", 2), 3.0],
+    ]
+    inter = Intersection(("foo", "bar"))
+    inter.write(data)
+    expected = inter.datapackage()
+    other = Intersection(("foo", "baz"))
+    other.write_arrays(["a", "b", "b"], np.array([1, 1, 2]), np.array([1.0, 2, 3]))
+    given = other.datapackage()
+
+    assert ("foo", "b") in geomapping
+    assert ("baz", 2) in geomapping
+    assert np.array_equal(
+        given.get_resource("foo_baz_matrix_data.data")[0],
+        expected.get_resource("foo_bar_matrix_data.data")[0],
+    )
+    assert given.get_resource("foo_baz_matrix_data.indices")[0].tolist() == [
+        (geomapping[("foo", x)], geomapping[("baz", y)])
+        for x, y in [("a", 1), ("b", 1), ("b", 2)]
+    ]
+
+
+@bw2test
+def test_write_arrays_validation():
+    inter = Intersection(("foo", "bar"))
+    with pytest.raises(Invalid):
+        inter.write_arrays(["a", "b"], ["c"], [1.0, 2.0])
+    with pytest.raises(Invalid):
+        inter.write_arrays(["a"], ["c"], ["1"])
+    with pytest.raises(Invalid):
+        inter.write_arrays(["a"], ["c"], [np.nan])
+
+
+@bw2test
+def test_reversed_intersection_is_view():
+    inter = Intersection(("foo", "bar"))
+    inter.write_arrays(["a", "b"], [1, 2], [3.0, 4])
+    reversed_inter = inter.create_reversed_intersection()
+
+    assert reversed_inter.name == ("bar", "foo")
+    assert reversed_inter.is_reversed
+    assert not inter.is_reversed
+    assert not reversed_inter.filepath_processed().exists()
+    assert reversed_inter.create_reversed_intersection().name == ("foo", "bar")
+
+    forward = inter.datapackage().get_resource("foo_bar_matrix_data.indices")[0]
+    package = reversed_inter.datapackage()
+    indices = package.get_resource("bar_foo_matrix_data.indices")[0]
+    assert np.array_equal(indices["row"], forward["col"])
+    assert np.array_equal(indices["col"], forward["row"])
+    assert np.allclose(package.get_resource("bar_foo_matrix_data.data")[0], [3, 4])
+
+
+@bw2test
+def test_reversed_intersection_write_clears_view():
+    inter = Intersection(("foo", "bar"))
+    inter.write_arrays(["a"], [1], [3.0])
+    reversed_inter = inter.create_reversed_intersection()
+    reversed_inter.write([[("bar", 2), ("foo", "c"), 5.0]])
+    assert not reversed_inter.is_reversed
+    assert reversed_inter.filepath_processed().exists()
+
+
+@bw2test
+def test_reversed_intersection_load():
+    inter = Intersection(("foo", "bar"))
+    inter.write([[("foo", "a"), ("bar", 1), 3.0]])
+    reversed_inter = inter.create_reversed_intersection()
+    assert reversed_inter.load() == [(("bar", 1), ("foo", "a"), 3.0)]
+
+    inter.write_arrays(["a"], [1], [3.0])
+    with pytest.raises(MissingIntermediateData, match="written from arrays"):
+        Intersection(("bar", "foo")).load()
+
+
+@bw2test
+def test_reversed_intersection_follows_forward():
+    inter = Intersection(("foo", "bar"))
+    inter.register(filepath="old", sha256=["a", "b"])
+    inter.write_arrays(["a"], [1], [3.0])
+    reversed_inter = inter.create_reversed_intersection()
+    assert reversed_inter.metadata["filepath"] == "old"
+    assert "sha256" not in reversed_inter.metadata
+
+    # Rewriting the forward intersection refreshes the view
+    inter.metadata["filepath"] = "new"
+    inter.write_arrays(["a", "b"], [1, 2], [3.0, 4])
+    assert reversed_inter.is_reversed
+    assert reversed_inter.metadata["filepath"] == "new"
+    package = reversed_inter.datapackage()
+    assert np.allclose(package.get_resource("bar_foo_matrix_data.data")[0], [3, 4])
+
+    # Deregistering the forward intersection removes the view
+    inter.deregister()
+    assert not reversed_inter.registered
+
+    # Dangling views raise a clear error
+    inter.write_arrays(["a"], [1], [3.0])
+    inter.create_reversed_intersection()
+    del intersections[("foo", "bar")]
+    with pytest.raises(MissingIntersection):
+        reversed_inter.datapackage()
@@ -1,11 +1,20 @@
 import hashlib
+import os
 
+import numpy as np
 import pytest
+import rasterio
 from bw2data import geomapping
+from bw2data.errors import MissingIntermediateData
 from bw2data.tests import bw2test
 from voluptuous import Invalid
 
+from bw2regional import geocollections
 from bw2regional.loading import Loading
+from bw2regional.pandarus import import_from_pandarus
+from bw2regional.utils import raster_cell_labels, set_datapackage_layout
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
 
 
 @bw2test
@@ -48,3 +57,88 @@ def test_filename():
 def test_allow_zero_loadings():
     lg = Loading("some loadings")
     assert lg.validate([[0.0, "f"]])
+
+
+@bw2test
+def test_write_arrays():
+    lg = Loading("some loadings")
+    lg.write_arrays(["a", "b"], [1, 2.5], geocollection="foo")
+    assert lg.registered
+    package = lg.datapackage()
+    indices = package.get_resource("some_loadings_matrix_data.indices")[0]
+    assert indices.tolist() == [
+        (geomapping[("foo", "a")], 0),
+        (geomapping[("foo", "b")], 0),
+    ]
+    assert np.allclose(
+        package.get_resource("some_loadings_matrix_data.data")[0], [1, 2.5]
+    )
+
+
+@bw2test
+def test_write_arrays_replaces_intermediate_data():
+    lg = Loading("some loadings")
+    lg.register()
+    lg.write([[1, ("foo", "a")]])
+    lg.write_arrays(["b"], [2.5], geocollection="foo")
+    with pytest.raises(MissingIntermediateData):
+        lg.load()
+    with pytest.raises(MissingIntermediateData):
+        lg.process()
+    package = lg.datapackage()
+    indices = package.get_resource("some_loadings_matrix_data.indices")[0]
+    assert indices["row"].tolist() == [geomapping[("foo", "b")]]
+
+
+@bw2test
+def test_directory_layout():
+    set_datapackage_layout("directory")
+    lg = Loading("some loadings")
+    lg.write_arrays(["a", "b"], [1, 2.5], geocollection="foo")
+    assert not lg.filepath_processed().exists()
+    data = lg.datapackage().get_resource("some_loadings_matrix_data.data")[0]
+    assert isinstance(data, np.memmap)
+    assert np.allclose(data, [1, 2.5])
+
+
+@bw2test
+def test_import_from_map_raster(tmpdir):
+    fp = os.path.join(data_dir, "test_raster_cfs.tif")
+    geocollections["cfs"] = {"filepath": fp}
+    with rasterio.open(fp) as src:
+        profile, array = src.profile, src.read(1)
+    array[0, :3] = [5, 0, np.nan]
+    loading_fp = os.path.join(tmpdir, "loading.tif")
+    with rasterio.open(loading_fp, "w", **profile) as sink:
+        sink.write(array, 1)
+
+    lg = Loading("some loadings")
+    lg.import_from_map("cfs", mask=0, filepath=loading_fp)
+    package = lg.datapackage()
+    rows = package.get_resource("some_loadings_matrix_data.indices")[0]["row"]
+    data = package.get_resource("some_loadings_matrix_data.data")[0]
+    assert len(data) == (array.ravel() > 0).sum()
+    first, second = raster_cell_labels([0, 1], array.shape, profile["transform"])
+    assert data[rows.tolist().index(geomapping[("cfs", first)])] == 5
+    assert ("cfs", second) not in geomapping
+
+    with pytest.raises(ValueError):
+        lg.import_from_map(
+            "cfs", filepath=os.path.join(data_dir, "test_raster_loading.tif")
+        )
+
+
+@bw2test
+def test_import_from_map_raster_matches_pandarus():
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["cfs"] = {"filepath": os.path.join(data_dir, "test_raster_cfs.tif")}
+    import_from_pandarus(os.path.join(data_dir, "intersect-countries-cfs.json.bz2"))
+    intersected = {key for key in geomapping if key[0] == "cfs"}
+
+    lg = Loading("some loadings")
+    lg.import_from_map("cfs")
+    rows = lg.datapackage().get_resource("some_loadings_matrix_data.indices")[0]
+    assert {geomapping[key] for key in intersected} & set(rows["row"].tolist())
@@ -1,8 +1,11 @@
+import hashlib
 import os
 
 from bw2data.tests import bw2test
 
-from bw2regional import geocollections, intersections, loadings
+from bw2regional import batch_metadata, geocollections, intersections, loadings
+from bw2regional.directories import shared_data_dir
+from bw2regional.hashing import HashCache, hash_cache, sha256, sha256_many
 
 data_dir = os.path.join(os.path.dirname(__file__), "data")
 
@@ -31,6 +34,53 @@ def test_geocollectioins_raster_test_data():
     geocollections["cfs"] = {"filepath": os.path.join(data_dir, "test_raster_cfs.tif")}
 
 
+@bw2test
+def test_geocollections_update():
+    geocollections.update(
+        {
+            "countries": {
+                "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+                "field": "name",
+            },
+            "cfs": {"filepath": os.path.join(data_dir, "test_raster_cfs.tif")},
+        },
+        empty={},
+    )
+    assert geocollections["cfs"]["kind"] == "raster"
+    assert geocollections["countries"]["sha256"] == sha256(
+        os.path.join(data_dir, "test_countries.gpkg"), use_cache=False
+    )
+    assert "empty" in geocollections
+
+
+@bw2test
+def test_sha256_cache(tmpdir):
+    fp = tmpdir / "data.bin"
+    fp.write_binary(b"a" * 3000000)
+    expected = hashlib.sha256(b"a" * 3000000).hexdigest()
+    assert hash_cache.get(fp) is None
+    assert sha256(fp) == expected
+    assert hash_cache.get(fp) == expected
+    # Persisted for other processes, outside the project directories
+    assert hash_cache.filepath.parent == shared_data_dir()
+    assert HashCache(hash_cache.filepath).get(fp) == expected
+
+    fp.write_binary(b"b")
+    assert hash_cache.get(fp) is None
+    assert sha256(fp) == hashlib.sha256(b"b").hexdigest()
+
+
+@bw2test
+def test_sha256_many(tmpdir):
+    filepaths = []
+    for index in range(4):
+        filepaths.append(tmpdir / "{}.bin".format(index))
+        filepaths[-1].write_binary(bytes([index]) * 1000)
+    assert sha256_many(filepaths) == [
+        hashlib.sha256(bytes([index]) * 1000).hexdigest() for index in range(4)
+    ]
+
+
 @bw2test
 def test_intersectioins_filename():
     assert intersections.filename == "intersections.json"
@@ -86,3 +136,42 @@ def test_loadings_unicode():
 
 
 # TODO: Test data loading
+
+
+@bw2test
+def test_batch_defers_flush():
+    with intersections.batch():
+        intersections[("a", "b")] = {"foo": 1}
+        intersections[("b", "a")] = {"foo": 2}
+        assert intersections.deserialize() == {}
+        with intersections.batch():
+            del intersections[("b", "a")]
+        assert intersections.deserialize() == {}
+    assert intersections.deserialize() == {("a", "b"): {"foo": 1}}
+
+
+@bw2test
+def test_batch_flushes_on_error():
+    try:
+        with batch_metadata():
+            loadings["foo"] = {"bar": 1}
+            raise ValueError
+    except ValueError:
+        pass
+    assert loadings.deserialize() == {"foo": {"bar": 1}}
+
+
+@bw2test
+def test_flush_merges_concurrent_writers():
+    other = type(intersections)()
+    intersections[("a", "b")] = {"foo": 1}
+    intersections[("c", "d")] = {"foo": 1}
+    other[("b", "a")] = {"foo": 2}
+    del other[("c", "d")]
+    intersections[("a", "b")]["foo"] = 3
+    intersections.flush()
+    assert intersections.deserialize() == {
+        ("a", "b"): {"foo": 3},
+        ("b", "a"): {"foo": 2},
+    }
+    assert dict(intersections.data) == intersections.deserialize()
@@ -173,3 +173,32 @@ def test_lca_score():
     lca.lci()
     lca.lcia()
     assert lca.score == 3
+
+
+def test_spatial_contributions(check_spatial_contributions):
+    import_data()
+    inventory = Database("inventory")
+    data = inventory.load()
+    data[("inventory", "V")]["exchanges"] = [
+        {"input": ("biosphere", "F"), "type": "biosphere", "amount": 1}
+    ]
+    data[("inventory", "X")]["exchanges"] = [
+        {"input": ("biosphere", "G"), "type": "biosphere", "amount": 1}
+    ]
+    inventory.write(data)
+    Method(("a", "method")).write(
+        [
+            [("biosphere", "F"), 1, ("places", "L")],
+            [("biosphere", "G"), 2, ("places", "L")],
+            [("biosphere", "F"), 3, ("places", "M")],
+            [("biosphere", "G"), 4, ("places", "N")],
+        ]
+    )
+    lca = LCA(
+        {("inventory", "U"): 1, ("inventory", "V"): 1, ("inventory", "X"): 1},
+        method=("a", "method"),
+    )
+    lca.lci()
+    lca.lcia()
+    assert lca.score == 10
+    check_spatial_contributions(lca, ["inv"])
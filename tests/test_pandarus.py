@@ -1,11 +1,25 @@
 import json
 import os
 
+import numpy as np
+import pytest
+import rasterio
+from bw2data import geomapping
 from bw2data.tests import bw2test
 
-from bw2regional import geocollections, topocollections
-from bw2regional.pandarus import import_from_pandarus, relabel
+from bw2regional import geocollections, intersections, topocollections
+from bw2regional import pandarus
+from bw2regional.intersection import Intersection
+from bw2regional.pandarus import (
+    import_from_pandarus,
+    iter_file,
+    load_file,
+    read_metadata,
+    relabel,
+    stream_import_from_pandarus,
+)
 from bw2regional.topography import Topography
+from bw2regional.utils import raster_cell_labels
 
 data_dir = os.path.join(os.path.dirname(__file__), "data")
 
@@ -16,6 +30,19 @@ def test_relabel():
     assert relabeled == [(("foo", 1), ("bar", 2), 3)]
 
 
+@bw2test
+def test_relabel_raster_cells():
+    geocollections["cfs"] = {"filepath": os.path.join(data_dir, "test_raster_cfs.tif")}
+    data = [("Benin", "Cell(2.36904500e+00, 8.80577500e+00)", 1), ("Benin", "foo", 2)]
+    with rasterio.open(os.path.join(data_dir, "test_raster_cfs.tif")) as src:
+        shape, transform = (src.height, src.width), src.transform
+    label = raster_cell_labels([6 * 25 + 14], shape, transform)[0]
+    assert relabel(data, "countries", "cfs") == [
+        (("countries", "Benin"), ("cfs", label), 1),
+        (("countries", "Benin"), ("cfs", "foo"), 2),
+    ]
+
+
 @bw2test
 def test_import_topo_intersection_without_error():
     def _(fn):
@@ -47,3 +74,121 @@ def test_import_intersection_without_error():
     }
     geocollections["cfs"] = {"filepath": _("test_raster_cfs.tif"), "field": "name"}
     import_from_pandarus(_("intersect-countries-cfs.json.bz2"))
+
+
+def test_iter_file_matches_load_file():
+    fp = os.path.join(data_dir, "intersect-countries-provinces.json.bz2")
+    metadata, data = load_file(fp)
+    given = {}
+    for key, value in iter_file(fp, buffer_size=7):
+        given[key] = list(value) if key == "data" else value
+    assert given["metadata"] == metadata
+    assert given["data"] == data
+
+
+def test_iter_file_data_can_be_skipped():
+    fp = os.path.join(data_dir, "intersect-countries-cfs.json.bz2")
+    assert [key for key, _ in iter_file(fp, buffer_size=64)] == ["data", "metadata"]
+
+
+@bw2test
+def test_stream_import_intersection():
+    def _(fn):
+        return os.path.join(data_dir, fn)
+
+    geocollections["countries"] = {
+        "filepath": _("test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["cfs"] = {"filepath": _("test_raster_cfs.tif"), "field": "name"}
+    assert stream_import_from_pandarus(
+        _("intersect-countries-cfs.json.bz2"), chunk_size=10
+    ) == ("countries", "cfs")
+
+    _, data = load_file(_("intersect-countries-cfs.json.bz2"))
+    expected = {
+        (geomapping[a], geomapping[b]): c
+        for a, b, c in relabel(data, "countries", "cfs")
+    }
+
+    package = Intersection(("countries", "cfs")).datapackage()
+    indices = package.get_resource("countries_cfs_matrix_data.indices")[0]
+    values = package.get_resource("countries_cfs_matrix_data.data")[0]
+    assert len(indices) == len(data)
+    for (row, col), value in zip(indices.tolist(), values):
+        assert np.allclose(expected[(row, col)], value)
+
+    assert Intersection(("cfs", "countries")).is_reversed
+    package = Intersection(("cfs", "countries")).datapackage()
+    indices = package.get_resource("cfs_countries_matrix_data.indices")[0]
+    assert {(col, row) for row, col in indices.tolist()} == set(expected)
+
+
+def intersection_entries(name):
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    package = Intersection(name).datapackage()
+    resource = package.resources[0]["group"]
+    indices = package.get_resource(resource + ".indices")[0]
+    data = package.get_resource(resource + ".data")[0]
+    return {
+        (reversed_geomapping[row], reversed_geomapping[col]): value
+        for (row, col), value in zip(indices.tolist(), data)
+    }
+
+
+def test_read_metadata():
+    fp = os.path.join(data_dir, "intersect-countries-cfs.json.bz2")
+    assert read_metadata(fp) == load_file(fp)[0]
+
+
+@bw2test
+def test_stream_import_checks_metadata_first(monkeypatch):
+    def _(fn):
+        return os.path.join(data_dir, fn)
+
+    geocollections["countries"] = {
+        "filepath": _("test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["cfs"] = {"filepath": _("test_raster_cfs.tif"), "field": "name"}
+    stream_import_from_pandarus(_("intersect-countries-cfs.json.bz2"))
+
+    def fail(*args):
+        raise AssertionError("Data should not be read")
+
+    monkeypatch.setattr(pandarus, "_stream_codes", fail)
+    with pytest.raises(AssertionError, match="already exists"):
+        stream_import_from_pandarus(_("intersect-countries-cfs.json.bz2"))
+
+
+@bw2test
+def test_stream_import_topo_intersection():
+    def _(fn):
+        return os.path.join(data_dir, fn)
+
+    geocollections["countries"] = {
+        "filepath": _("test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["cfs"] = {"filepath": _("test_raster_cfs.tif"), "field": "name"}
+    topocollections["countries"] = {
+        "geocollection": "countries",
+        "filepath": _("test_provinces.gpkg"),
+        "field": "OBJECTID_1",
+    }
+    topo = Topography("countries")
+    topo.write(dict(json.load(open(_("test_topo_mapping.json")))))
+
+    import_from_pandarus(_("intersect-topo-cfs.json.bz2"))
+    expected = intersection_entries(("countries", "cfs"))
+    del intersections[("countries", "cfs")]
+    del intersections[("cfs", "countries")]
+
+    assert stream_import_from_pandarus(
+        _("intersect-topo-cfs.json.bz2"), chunk_size=10
+    ) == [("countries", "cfs")]
+    given = intersection_entries(("countries", "cfs"))
+    assert given.keys() == expected.keys()
+    for key, value in expected.items():
+        assert np.allclose(given[key], value)
+    assert Intersection(("cfs", "countries")).is_reversed
@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from bw2data import projects
+from bw2data.tests import bw2test
+
+from bw2regional import geocollections, intersections
+from bw2regional.pandarus_remote import (
+    AsyncPandarusRemote,
+    AsyncPendingJob,
+    PandarusRemote,
+    RemoteError,
+    run_jobs,
+)
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves a fixed catalog and the countries/provinces intersection file.
+
+    Calculation jobs finish after ``server.polls`` status requests. Downloads support ``Range`` requests, and stop after ``server.truncate`` bytes if set.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, body, status=200, headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests[self.path] += 1
+        if self.path == "/catalog":
+            self.respond(json.dumps(self.server.catalog).encode())
+        elif self.path.startswith("/status/"):
+            if self.server.requests[self.path] >= self.server.polls:
+                self.server.calculated = True
+                self.respond(b"finished")
+            else:
+                self.respond(b"started")
+        else:
+            self.respond(b"")
+
+    def do_POST(self):
+        self.server.requests[self.path] += 1
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/upload":
+            message = BytesParser(policy=policy.default).parsebytes(
+                b"Content-Type: "
+                + self.headers["Content-Type"].encode()
+                + b"\r\n\r\n"
+                + body
+            )
+            self.server.uploads.append(
+                {
+                    part.get_param(
+                        "name", header="content-disposition"
+                    ): part.get_content()
+                    for part in message.iter_parts()
+                }
+            )
+            self.respond(b"{}")
+        elif self.path == "/calculate-intersection":
+            self.respond(b"/status/1")
+        elif self.path == "/intersection" and self.server.calculated:
+            fn = "intersect-countries-provinces.json.bz2"
+            with open(os.path.join(data_dir, fn), "rb") as f:
+                content = f.read()
+            headers = [
+                ("Content-Disposition", "attachment; filename=" + fn),
+                ("ETag", '"{}"'.format(hashlib.sha256(content).hexdigest())),
+            ]
+            status, start = 200, 0
+            if "Range" in self.headers:
+                self.server.requests["ranges"] += 1
+                status, start = 206, int(self.headers["Range"][6:-1])
+                headers.append(
+                    (
+                        "Content-Range",
+                        "bytes {}-{}/{}".format(start, len(content) - 1, len(content)),
+                    )
+                )
+            if self.server.truncate:
+                self.send_response(status)
+                for header in headers:
+                    self.send_header(*header)
+                self.send_header("Content-Length", str(len(content) - start))
+                self.end_headers()
+                self.wfile.write(content[start : start + self.server.truncate])
+                self.server.truncate = None
+                self.close_connection = True
+            else:
+                self.respond(content[start:], status=status, headers=headers)
+        else:
+            self.respond(b"", status=404)
+
+
+@pytest.fixture
+def stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.requests = Counter()
+    server.catalog = {"files": [], "intersections": []}
+    server.calculated, server.polls = True, 3
+    server.truncate, server.uploads = None, []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def register_geocollections(server):
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["provinces"] = {
+        "filepath": os.path.join(data_dir, "test_provinces.gpkg"),
+        "field": "OBJECTID_1",
+    }
+    server.catalog["files"] = [
+        [name, geocollections[name]["sha256"], "vector"]
+        for name in ("countries", "provinces")
+    ]
+
+
+def test_unreachable_remote():
+    remote = PandarusRemote("http://127.0.0.1:9")
+    assert not remote.alive
+    with pytest.raises(RemoteError):
+        remote.catalog()
+
+
+@bw2test
+def test_catalog_cached(stand_in):
+    remote = PandarusRemote("http://127.0.0.1:{}/".format(stand_in.server_port))
+    remote.catalog()
+    remote.catalog()
+    assert stand_in.requests["/catalog"] == 1
+    remote.catalog(refresh=True)
+    assert stand_in.requests["/catalog"] == 2
+
+    remote.catalog_ttl = 0
+    remote.catalog()
+    assert stand_in.requests["/catalog"] == 3
+
+
+@bw2test
+def test_fetch_intersections(stand_in):
+    register_geocollections(stand_in)
+    remote = PandarusRemote("http://127.0.0.1:{}".format(stand_in.server_port))
+    remote.fetch_intersections([("countries", "provinces")])
+
+    assert ("countries", "provinces") in intersections
+    assert ("provinces", "countries") in intersections
+    # No liveness checks, one catalog request, and no uploads
+    assert stand_in.requests == Counter({"/catalog": 1, "/intersection": 1})
+
+    remote.fetch_intersections([("countries", "provinces")])
+    assert stand_in.requests["/intersection"] == 1
+
+
+def test_async_pending_job_backoff(stand_in):
+    url = "http://127.0.0.1:{}/status/{{}}".format(stand_in.server_port)
+    job = AsyncPendingJob(url.format(1), interval=0.01, max_interval=0.02)
+    assert asyncio.run(job.wait()) == "finished"
+    assert stand_in.requests["/status/1"] == 3
+
+    stand_in.polls = 100
+    job = AsyncPendingJob(url.format(2), interval=0.01, max_interval=0.02)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(job.wait(timeout=0.2))
+
+
+def test_run_jobs(stand_in):
+    url = "http://127.0.0.1:{}/status/{{}}".format(stand_in.server_port)
+    jobs = [AsyncPendingJob(url.format(x), interval=0.01) for x in range(10)]
+    asyncio.run(run_jobs(None, *jobs))
+    assert all(stand_in.requests["/status/{}".format(x)] == 3 for x in range(10))
+
+
+@bw2test
+def test_async_intersection_calculated_on_demand(stand_in):
+    register_geocollections(stand_in)
+    stand_in.calculated = False
+    remote = AsyncPandarusRemote(
+        "http://127.0.0.1:{}".format(stand_in.server_port), interval=0.01
+    )
+
+    async def prepare():
+        await remote.intersections(
+            [("countries", "provinces"), ("countries", "provinces")]
+        )
+
+    asyncio.run(prepare())
+    assert ("countries", "provinces") in intersections
+    assert stand_in.requests["/calculate-intersection"] >= 1
+    assert stand_in.requests["/upload"] == 0
+
+
+@bw2test
+def test_streaming_upload(stand_in):
+    register_geocollections(stand_in)
+    stand_in.catalog["files"] = []
+    remote = PandarusRemote("http://127.0.0.1:{}".format(stand_in.server_port))
+    remote.upload("countries")
+    (upload,) = stand_in.uploads
+    with open(geocollections["countries"]["filepath"], "rb") as f:
+        content = f.read()
+    assert upload["file"] == content
+    assert upload["sha256"] == hashlib.sha256(content).hexdigest()
+    assert upload["field"] == "name"
+
+
+@bw2test
+def test_resumed_and_cached_download(stand_in):
+    register_geocollections(stand_in)
+    stand_in.truncate = 100
+    remote = PandarusRemote("http://127.0.0.1:{}".format(stand_in.server_port))
+    with pytest.raises(RemoteError):
+        remote.fetch_intersections([("countries", "provinces")])
+    remote.fetch_intersections([("countries", "provinces")])
+    assert ("countries", "provinces") in intersections
+    assert stand_in.requests["/intersection"] == 2
+    assert stand_in.requests["ranges"] == 1
+
+    # Same file is taken from the cache, also in other projects
+    projects.set_current("another project")
+    register_geocollections(stand_in)
+    remote.fetch_intersections([("countries", "provinces")])
+    assert ("countries", "provinces") in intersections
+    assert stand_in.requests["/intersection"] == 2
+
+
+@bw2test
+def test_concurrent_downloads_are_locked(stand_in):
+    remote = PandarusRemote("http://127.0.0.1:{}".format(stand_in.server_port))
+    data = {"first": "a", "second": "b"}
+    with ThreadPoolExecutor(4) as executor:
+        filepaths = list(
+            executor.map(lambda _: remote._fetch("/intersection", data), range(4))
+        )
+    assert all(os.path.isfile(fp) for fp in filepaths)
+    assert stand_in.requests["/intersection"] == 1
+    key = remote.cache.request_key(remote.url + "/intersection", data)
+    assert not os.path.exists(remote.cache.partial(key)[0])
@@ -0,0 +1,139 @@
+import os
+
+import pytest
+import requests
+from bw2data import geomapping
+from bw2data.tests import bw2test
+
+from bw2regional import extension_tables, geocollections, intersections
+from bw2regional.gis_tasks import calculate_intersection, raster_as_extension_table
+from bw2regional.intersection import Intersection
+from bw2regional.pandarus import import_from_pandarus
+from bw2regional.pandarus_remote import PandarusRemote, run_job
+from bw2regional.server import PandarusServer
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    with PandarusServer(
+        tmp_path_factory.mktemp("server"), port=0, processes=2
+    ) as server:
+        yield server
+
+
+def register_geocollections():
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["provinces"] = {
+        "filepath": os.path.join(data_dir, "test_provinces.gpkg"),
+        "field": "OBJECTID_1",
+    }
+    geocollections["cfs"] = {
+        "filepath": os.path.join(data_dir, "test_raster_cfs.tif"),
+        "band": 1,
+    }
+
+
+def matrix_entries(name):
+    package = Intersection(name).datapackage()
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    indices = package.get_resource("{}_{}_matrix_data.indices".format(*name))[0]
+    data = package.get_resource("{}_{}_matrix_data.data".format(*name))[0]
+    return {
+        (reversed_geomapping[row], reversed_geomapping[col]): value
+        for (row, col), value in zip(indices.tolist(), data)
+    }
+
+
+@bw2test
+def test_server_intersection(server):
+    register_geocollections()
+    remote = PandarusRemote(server.url)
+    assert remote.alive
+    calculate_intersection("countries", "provinces", engine=remote, use_store=False)
+    assert ("countries", "provinces") in intersections
+    assert ("provinces", "countries") in intersections
+    catalog = remote.catalog(refresh=True)
+    assert len(catalog["files"]) == 2
+    assert len(catalog["intersections"]) == 1
+
+    # Result is reused instead of calculated again
+    assert remote.calculate_intersection("countries", "provinces") is None
+
+
+@bw2test
+def test_server_matches_geopandas(server):
+    register_geocollections()
+    remote = PandarusRemote(server.url)
+    run_job(remote.calculate_intersection("countries", "provinces"))
+    remote.intersection("countries", "provinces")
+    expected = matrix_entries(("countries", "provinces"))
+
+    calculate_intersection(
+        "countries", "provinces", engine="geopandas", overwrite=True, use_store=False
+    )
+    result = matrix_entries(("countries", "provinces"))
+    assert result.keys() == expected.keys()
+    for key, value in expected.items():
+        assert result[key] == pytest.approx(value)
+
+
+@bw2test
+def test_server_intersection_as_new_geocollection(server):
+    register_geocollections()
+    remote = PandarusRemote(server.url)
+    run_job(remote.calculate_intersection("countries", "provinces"))
+    remote.intersection_as_new_geocollection("countries", "provinces", "both")
+    assert geocollections["both"]["field"] == "id"
+    # Intersected spatial units are in the server catalog, so aren't uploaded
+    remote.intersection("both", "countries")
+    assert ("both", "countries") in intersections
+    assert len(remote.catalog(refresh=True)["files"]) == 3
+
+
+@bw2test
+def test_server_rasterstats(server):
+    register_geocollections()
+    remote = PandarusRemote(server.url)
+    xt = raster_as_extension_table("countries", "cfs", engine=remote)
+    assert xt.name in extension_tables
+    assert xt.load()
+
+
+@bw2test
+def test_server_raster_intersection(server):
+    register_geocollections()
+    remote = PandarusRemote(server.url)
+    run_job(remote.calculate_intersection("countries", "cfs"))
+    remote.intersection("countries", "cfs")
+    result = matrix_entries(("countries", "cfs"))
+
+    del intersections[("countries", "cfs")]
+    del intersections[("cfs", "countries")]
+    import_from_pandarus(os.path.join(data_dir, "intersect-countries-cfs.json.bz2"))
+    expected = matrix_entries(("countries", "cfs"))
+    assert result.keys() == expected.keys()
+    for key, value in expected.items():
+        assert result[key] == pytest.approx(value, rel=1e-2)
+
+
+@bw2test
+def test_server_errors(server):
+    register_geocollections()
+    assert requests.get(server.url + "/status/missing").status_code == 404
+    assert (
+        requests.post(
+            server.url + "/intersection", data={"first": "a", "second": "b"}
+        ).status_code
+        == 404
+    )
+    resp = requests.post(
+        server.url + "/upload",
+        data={"sha256": "0" * 64, "name": "x.gpkg"},
+        files={"file": b"data"},
+    )
+    assert resp.status_code == 400
@@ -1,11 +1,32 @@
+import os
+
 import numpy as np
 import pytest
-from bw2data import Database, Method, databases, geomapping, get_id, methods
+import rasterio
+from bw2data import (
+    Database,
+    Method,
+    databases,
+    geomapping,
+    get_id,
+    methods,
+    projects,
+)
 from bw2data.tests import bw2test
 
+from bw2regional import geocollections
+from bw2regional.errors import MissingIntersection
 from bw2regional.intersection import Intersection
 from bw2regional.lca import TwoSpatialScalesLCA as LCA
 from bw2regional.meta import intersections, loadings
+from bw2regional.pandarus import import_from_pandarus, load_file
+from bw2regional.results import RegionalResult
+from bw2regional.utils import (
+    import_regionalized_cfs,
+    raster_cell_indices,
+    set_datapackage_layout,
+    unpack_datapackage,
+)
 
 
 @bw2test
@@ -229,3 +250,384 @@ def test_lca_score():
     lca.lci()
     lca.lcia()
     assert lca.score == 3
+
+
+def test_lca_score_reversed_intersection():
+    import_data()
+    forward = Intersection(("places", "regions"))
+    inter = Intersection(("regions", "places"))
+    inter.write([[b, a, c] for a, b, c in forward.load()])
+    forward.deregister()
+    assert inter.create_reversed_intersection().is_reversed
+
+    lca = LCA({("inventory", "U"): 1}, method=("a", "method"))
+    lca.lci()
+    lca.lcia()
+    assert lca.geo_transform_matrix.sum() == 32
+    assert lca.score == 3
+
+
+def test_lca_score_directory_layout():
+    import_data()
+    set_datapackage_layout("directory")
+    inter = Intersection(("places", "regions"))
+    inter.process()
+    assert not inter.filepath_processed().exists()
+    unpack_datapackage(Method(("a", "method")).filepath_processed())
+
+    lca = LCA({("inventory", "U"): 1}, method=("a", "method"))
+    lca.lci()
+    lca.lcia()
+    assert lca.score == 3
+
+
+@pytest.mark.parametrize("name", ["result", "result.npz"])
+def test_regional_result(tmpdir, name):
+    lca = get_lca()
+    lca.lci()
+    lca.lcia()
+    result = lca.regional_result()
+    assert result.ia_geocollections == {"regions"}
+    assert result.inventory_geocollections == {"places"}
+
+    fp = result.save(str(tmpdir / name))
+    loaded = RegionalResult.load(fp)
+    assert loaded.score == pytest.approx(lca.score)
+    for method in ("results_ia_spatial_scale", "results_inv_spatial_scale"):
+        assert np.allclose(
+            getattr(loaded, method)().todense(), getattr(lca, method)().todense()
+        )
+    with pytest.raises(NotImplementedError):
+        loaded.results_xtable_spatial_scale()
+
+    expected = lca.geodataframe_ia_spatial_scale(sum_flows=False)
+    given = loaded.geodataframe_ia_spatial_scale(sum_flows=False)
+    assert given["location_key"].tolist() == expected["location_key"].tolist()
+    assert np.allclose(given["score_abs"], expected["score_abs"])
+    assert given["row_index"].tolist() == expected["row_index"].tolist()
+    assert given["score_abs"].sum() == pytest.approx(lca.score)
+
+    assert loaded.flows == [("biosphere", "F"), ("biosphere", "G")]
+    assert loaded.dicts.biosphere == lca.dicts.biosphere
+
+    if name.endswith(".npz"):
+        # The archive is closed after loading, so it can be replaced
+        os.remove(fp)
+        result.save(fp)
+        assert loaded.score == pytest.approx(lca.score)
+
+    # Rendering in another project doesn't need the LCA data, and doesn't add
+    # the result locations to its ``geomapping``
+    projects.set_current("rendering")
+    loaded = RegionalResult.load(fp)
+    assert ("regions", "A") not in geomapping
+    assert sorted(loaded.dicts.biosphere) == [-2, -1]
+    given = loaded.geodataframe_ia_spatial_scale(sum_flows=False)
+    assert given["location_key"].tolist() == expected["location_key"].tolist()
+    assert given["score_abs"].sum() == pytest.approx(lca.score)
+    assert ("regions", "A") not in geomapping
+
+
+def multiple_activities_lca():
+    import_data()
+    inventory = Database("inventory")
+    data = inventory.load()
+    data[("inventory", "V")]["exchanges"] = [
+        {"input": ("biosphere", "F"), "type": "biosphere", "amount": 1}
+    ]
+    data[("inventory", "X")]["exchanges"] = [
+        {"input": ("biosphere", "G"), "type": "biosphere", "amount": 1}
+    ]
+    inventory.write(data)
+    lca = LCA(
+        {("inventory", "U"): 1, ("inventory", "V"): 1, ("inventory", "X"): 1},
+        method=("a", "method"),
+    )
+    lca.lci()
+    lca.lcia()
+    return lca
+
+
+@bw2test
+def test_top_spatial_contributions():
+    lca = multiple_activities_lca()
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    for scale, method in (
+        ("ia", lca.results_ia_spatial_scale),
+        ("inv", lca.results_inv_spatial_scale),
+    ):
+        totals = np.ravel(method().sum(axis=0))
+        reversed_spatial = getattr(lca.dicts, scale + "_spatial").reversed
+        expected = sorted(
+            (
+                (value, reversed_geomapping[reversed_spatial[index]])
+                for index, value in enumerate(totals)
+                if value
+            ),
+            reverse=True,
+        )
+        for block_size in (1, 10000):
+            given = lca.top_spatial_contributions(scale, k=2, block_size=block_size)
+            assert [x[1] for x in given] == [x[1] for x in expected[:2]]
+            assert np.allclose([x[0] for x in given], [x[0] for x in expected[:2]])
+
+        given = lca.top_spatial_contributions(scale, k=100, activities=True)
+        assert sum(x[0] for x in given) == pytest.approx(lca.score)
+
+    # Regions A, B, and C contribute 3.4, 3.34, and 3.69
+    given = lca.top_spatial_contributions("ia", k=10, cutoff=0.325)
+    assert [x[1] for x in given] == [("regions", "C"), ("regions", "A")]
+
+    # Activity X in C, U in A, V in B, X in B, and V in A
+    U, V, X = [get_id(("inventory", x)) for x in "UVX"]
+    given = lca.top_spatial_contributions("ia", k=4, activities=True, block_size=2)
+    assert [x[1:] for x in given] == [
+        (X, ("regions", "C")),
+        (U, ("regions", "A")),
+        (V, ("regions", "B")),
+        (X, ("regions", "B")),
+    ]
+    assert given[0][0] == pytest.approx(48 / 13)
+    given = lca.top_spatial_contributions(
+        "ia", k=10, cutoff=0.2, activities=True, block_size=1
+    )
+    assert [x[1:] for x in given] == [(X, ("regions", "C")), (U, ("regions", "A"))]
+    assert lca.top_spatial_contributions("ia", cutoff=0.99) == []
+    assert lca.top_spatial_contributions("ia", cutoff=0.99, activities=True) == []
+    for scale in ("foo", "xtable"):
+        with pytest.raises(ValueError):
+            lca.top_spatial_contributions(scale)
+
+    # Skipping activities by their upper bounds doesn't change the results
+    pairs = lca.top_spatial_contributions("ia", k=100, activities=True)
+    for k in range(1, len(pairs) + 1):
+        for block_size in (1, 2):
+            given = lca.top_spatial_contributions(
+                "ia", k=k, activities=True, block_size=block_size
+            )
+            assert np.allclose([x[0] for x in given], [x[0] for x in pairs[:k]])
+
+
+@bw2test
+def test_spatial_contributions_by_scale(check_spatial_contributions):
+    check_spatial_contributions(multiple_activities_lca(), ["ia", "inv"])
+
+
+@bw2test
+def test_spatial_contributions():
+    lca = multiple_activities_lca()
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    for scale, method in (
+        ("ia", lca.results_ia_spatial_scale),
+        ("inv", lca.results_inv_spatial_scale),
+    ):
+        for block_size in (1, 1000):
+            blocks = list(lca.spatial_contributions(scale, block_size=block_size))
+            assert len(blocks) == (3 if block_size == 1 else 1)
+            given = np.hstack(blocks)
+            assert given["amount"].sum() == pytest.approx(lca.score)
+
+        # Summed over activities, same as results by flow and spatial unit
+        results = method().tocoo()
+        spatial = getattr(lca.dicts, scale + "_spatial")
+        expected = {
+            (lca.dicts.biosphere.reversed[row], spatial.reversed[col]): value
+            for row, col, value in zip(results.row, results.col, results.data)
+            if value
+        }
+        summed = {}
+        for row in given:
+            key = (row["flow"], row["location"])
+            summed[key] = summed.get(key, 0) + row["amount"]
+        assert summed.keys() == expected.keys()
+        for key, value in expected.items():
+            assert summed[key] == pytest.approx(value)
+
+    # Unlike ``top_spatial_contributions``, flows are not summed
+    U, V, X = [get_id(("inventory", x)) for x in "UVX"]
+    given = np.hstack(list(lca.spatial_contributions("ia", cutoff=0.15)))
+    assert sorted(
+        (row["activity"], reversed_geomapping[row["location"]]) for row in given
+    ) == sorted([(X, ("regions", "C")), (V, ("regions", "B")), (U, ("regions", "A"))])
+    assert list(lca.spatial_contributions("ia", cutoff=0.99)) == []
+
+    # Same contributions as filtering all contributions afterwards
+    everything = np.hstack(list(lca.spatial_contributions("ia")))
+    for cutoff in (0.01, 0.1, 0.2, 0.3):
+        given = np.hstack(
+            list(lca.spatial_contributions("ia", cutoff=cutoff, block_size=1))
+            or [np.zeros(0, dtype=everything.dtype)]
+        )
+        expected = everything[np.abs(everything["amount"]) >= cutoff * lca.score]
+        assert sorted(given.tolist()) == sorted(expected.tolist())
+
+
+@bw2test
+def test_write_spatial_contributions(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    lca = multiple_activities_lca()
+    fp = lca.write_spatial_contributions(tmp_path / "c.parquet", block_size=1)
+    table = pq.read_table(fp)
+    assert table.column_names == ["activity", "flow", "location", "amount"]
+    assert pq.ParquetFile(fp).num_row_groups == 3
+    assert sum(table.column("amount").to_pylist()) == pytest.approx(lca.score)
+
+    fp = lca.write_spatial_contributions(tmp_path / "e.parquet", cutoff=0.99)
+    assert pq.read_table(fp).num_rows == 0
+
+
+@bw2test
+def test_spatial_unit_contributions():
+    lca = multiple_activities_lca()
+    U, V, X = [get_id(("inventory", x)) for x in "UVX"]
+    for scale, method in (
+        ("ia", lca.results_ia_spatial_scale),
+        ("inv", lca.results_inv_spatial_scale),
+    ):
+        totals = np.ravel(method().sum(axis=0))
+        spatial = getattr(lca.dicts, scale + "_spatial")
+        for location in {key for key, value in geomapping.items() if value in spatial}:
+            given = lca.spatial_unit_contributions(location, scale)
+            assert sorted(x[1] for x in given) == sorted(
+                lca.spatial_unit_activities(location, scale)
+            )
+            assert sum(x[0] for x in given) == pytest.approx(
+                totals[spatial[geomapping[location]]]
+            )
+
+    assert sorted(lca.spatial_unit_activities(("regions", "A"))) == sorted([U, V])
+    given = lca.spatial_unit_contributions(("regions", "B"))
+    assert [x[1] for x in given] == [V, X]
+    assert given[0][0] == pytest.approx(0.1725663704867207 * lca.score)
+
+    # Cached operators are rebuilt when the LCIA matrices are loaded again
+    operator = lca.transfer_operator("ia")
+    assert lca.transfer_operator("ia") is operator
+    lca.load_lcia_data()
+    assert lca.transfer_operator("ia") is not operator
+    operator = lca.transfer_operator("ia")
+    lca.after_matrix_iteration()
+    assert lca.transfer_operator("ia") is not operator
+
+    # Cached CSR inventory follows the current inventory
+    inventory = lca._inventory_csr()
+    assert lca._inventory_csr() is inventory
+    lca.lci()
+    lca.lcia()
+    assert lca._inventory_csr() is not inventory
+    assert [x[1] for x in lca.spatial_unit_contributions(("regions", "B"))] == [V, X]
+
+    with pytest.raises(ValueError):
+        lca.spatial_unit_activities(("regions", "missing"))
+
+
+@bw2test
+def test_results_reporting_scale(monkeypatch):
+    from bw2regional.reporting import reporting_operators
+
+    lca = multiple_activities_lca()
+
+    def by_location(matrix, col_dict):
+        reversed_geomapping = {v: k for k, v in geomapping.items()}
+        totals = np.ravel(matrix.sum(axis=0))
+        return {
+            reversed_geomapping[col_dict.reversed[index]]: value
+            for index, value in enumerate(totals)
+        }
+
+    ia = by_location(lca.results_ia_spatial_scale(), lca.dicts.ia_spatial)
+    inv = by_location(lca.results_inv_spatial_scale(), lca.dicts.inv_spatial)
+
+    # Same geocollection: unchanged
+    given = by_location(*lca.results_reporting_scale("regions"))
+    assert given.keys() == ia.keys()
+    for key, value in ia.items():
+        assert given[key] == pytest.approx(value)
+
+    # Inventory spatial units are split by intersected area, as in the LCA
+    given = by_location(*lca.results_reporting_scale("regions", scale="inv"))
+    places = {x: inv.get(("places", x), 0) for x in "LMNO"}
+    expected = {
+        ("regions", "A"): places["L"] + places["M"] * 2 / 5,
+        ("regions", "B"): places["M"] * 3 / 5 + places["N"] * 5 / 13,
+        ("regions", "C"): places["N"] * 8 / 13 + places["O"],
+    }
+    assert given.keys() == expected.keys()
+    for key, value in expected.items():
+        assert given[key] == pytest.approx(value)
+    assert sum(given.values()) == pytest.approx(lca.score)
+
+    Intersection(("regions", "admin")).write(
+        [
+            [("regions", "A"), ("admin", 1), 1],
+            [("regions", "B"), ("admin", 1), 1],
+            [("regions", "B"), ("admin", 2), 3],
+            [("regions", "C"), ("admin", 2), 2],
+        ]
+    )
+    given = by_location(*lca.results_reporting_scale("admin"))
+    expected = {
+        ("admin", 1): ia[("regions", "A")] + ia[("regions", "B")] / 4,
+        ("admin", 2): ia[("regions", "B")] * 3 / 4 + ia[("regions", "C")],
+    }
+    assert given.keys() == expected.keys()
+    for key, value in expected.items():
+        assert given[key] == pytest.approx(value)
+
+    gdf = lca.geodataframe_reporting_scale("admin")
+    assert gdf["score_abs"].sum() == pytest.approx(sum(expected.values()))
+
+    with pytest.raises(MissingIntersection):
+        lca.results_reporting_scale("admin", scale="inv")
+    with pytest.raises(ValueError):
+        lca.results_reporting_scale("admin", scale="foo")
+    with pytest.raises(ValueError):
+        lca.results_reporting_scale("admin", scale="xtable")
+
+    # Operators are reused from the project after the in-memory cache is cleared
+    assert len(list(reporting_operators.dirpath.iterdir())) == 2
+    reporting_operators.clear()
+    monkeypatch.setattr(Intersection, "datapackage", None)
+    assert by_location(*lca.results_reporting_scale("admin")) == given
+
+
+@bw2test
+def test_raster_cfs_with_pandarus_intersection():
+    data_dir = os.path.join(os.path.dirname(__file__), "data")
+    raster_fp = os.path.join(data_dir, "test_raster_cfs.tif")
+    intersection_fp = os.path.join(data_dir, "intersect-countries-cfs.json.bz2")
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["cfs"] = {"filepath": raster_fp}
+    Database("biosphere").write({("biosphere", "F"): {"type": "emission"}})
+    Database("inventory").write(
+        {
+            ("inventory", "U"): {
+                "type": "process",
+                "location": ("countries", "Benin"),
+                "exchanges": [
+                    {"input": ("biosphere", "F"), "type": "biosphere", "amount": 1}
+                ],
+            }
+        }
+    )
+    import_from_pandarus(intersection_fp)
+    import_regionalized_cfs("cfs", ("a", "method"), {1: [("biosphere", "F")]})
+
+    lca = LCA({("inventory", "U"): 1}, method=("a", "method"))
+    lca.lci()
+    lca.lcia()
+
+    with rasterio.open(raster_fp) as src:
+        array, shape, transform = src.read(1), (src.height, src.width), src.transform
+    _, data = load_file(intersection_fp)
+    rows = [row for row in data if row[0] == "Benin"]
+    cells = raster_cell_indices([row[1] for row in rows], shape, transform)
+    areas = np.array([row[2] for row in rows])
+    cfs = array.ravel()[cells]
+    assert (cells >= 0).all() and (cfs != -1).any()
+    expected = (areas * np.where(cfs != -1, cfs, 0)).sum() / areas.sum()
+    assert lca.score == pytest.approx(expected)
+    assert lca.score > 0
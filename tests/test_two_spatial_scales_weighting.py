@@ -283,3 +283,24 @@ def test_lca_score():
     lca.lci()
     lca.lcia()
     assert lca.score == 3
+
+
+def test_spatial_contributions(check_spatial_contributions):
+    import_data()
+    inventory = Database("inventory")
+    data = inventory.load()
+    data[("inventory", "V")]["exchanges"] = [
+        {"input": ("biosphere", "F"), "type": "biosphere", "amount": 1}
+    ]
+    data[("inventory", "X")]["exchanges"] = [
+        {"input": ("biosphere", "G"), "type": "biosphere", "amount": 1}
+    ]
+    inventory.write(data)
+    lca = LCA(
+        {("inventory", "U"): 1, ("inventory", "V"): 1, ("inventory", "X"): 1},
+        method=("A", "method"),
+        loading="loading",
+    )
+    lca.lci()
+    lca.lcia()
+    check_spatial_contributions(lca, ["ia", "inv"])
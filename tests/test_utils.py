@@ -1,8 +1,30 @@
+import os
+
 import numpy as np
 import pytest
+import rasterio
+from bw2data import Database, Method, geomapping, get_id, methods
+from bw2data.tests import bw2test
 from scipy.sparse import dok_matrix
 
-from bw2regional.utils import filter_columns, filter_fiona_metadata, filter_rows
+from bw2regional import geocollections
+from bw2regional.intersection import Intersection
+from bw2regional.utils import (
+    datapackage_layout,
+    directory_path,
+    dp,
+    filter_columns,
+    filter_fiona_metadata,
+    filter_rows,
+    import_regionalized_cfs,
+    raster_cell_ids,
+    raster_cell_indices,
+    raster_cell_labels,
+    set_datapackage_layout,
+    unpack_datapackage,
+)
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
 
 
 @pytest.fixture
@@ -48,3 +70,178 @@ def test_filter_fiona_metadata():
     result = filter_fiona_metadata(given)
     assert result == expected
     assert result is not given
+
+
+@bw2test
+def test_datapackage_layout_preference():
+    assert datapackage_layout() == "zip"
+    set_datapackage_layout("directory")
+    assert datapackage_layout() == "directory"
+    with pytest.raises(ValueError):
+        set_datapackage_layout("tarball")
+
+
+@bw2test
+def test_directory_layout_memory_maps_arrays():
+    set_datapackage_layout("directory")
+    inter = Intersection(("foo", "bar"))
+    inter.write_arrays(["a", "b"], [1, 2], [3.0, 4])
+    assert not inter.filepath_processed().exists()
+    assert directory_path(inter.filepath_processed()).is_dir()
+
+    data = inter.datapackage().get_resource("foo_bar_matrix_data.data")[0]
+    assert isinstance(data, np.memmap)
+    assert np.allclose(data, [3, 4])
+
+    set_datapackage_layout("zip")
+    inter.write_arrays(["a"], [1], [5.0])
+    assert inter.filepath_processed().exists()
+    assert not directory_path(inter.filepath_processed()).exists()
+    data = inter.datapackage().get_resource("foo_bar_matrix_data.data")[0]
+    assert not isinstance(data, np.memmap)
+    assert np.allclose(data, [5])
+
+
+@bw2test
+def test_unpack_datapackage():
+    inter = Intersection(("foo", "bar"))
+    inter.write_arrays(["a", "b"], [1, 2], [3.0, 4])
+    dirpath = unpack_datapackage(inter.filepath_processed())
+    assert (dirpath / "datapackage.json").is_file()
+    data = dp(inter.filepath_processed()).get_resource("foo_bar_matrix_data.data")[0]
+    assert isinstance(data, np.memmap)
+
+
+def method_cfs(method):
+    package = dp(Method(method).filepath_processed())
+    indices = package.get_resource(
+        "{}_matrix_data.indices".format(package.metadata["name"])
+    )[0]
+    data = package.get_resource("{}_matrix_data.data".format(package.metadata["name"]))[
+        0
+    ]
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    cfs = {}
+    for (row, col), value in zip(indices.tolist(), data):
+        key = (row, reversed_geomapping[col])
+        cfs[key] = cfs.get(key, 0) + value
+    return cfs
+
+
+@bw2test
+def test_import_regionalized_cfs_vector():
+    Database("biosphere").write(
+        {
+            ("biosphere", "F"): {"type": "emission"},
+            ("biosphere", "G"): {"type": "emission"},
+        }
+    )
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    import_regionalized_cfs(
+        "countries",
+        ("a", "method"),
+        {
+            "uncode": [("biosphere", "F"), ("biosphere", "G")],
+            "latitude": [("biosphere", "F")],
+            # All ``NaN``
+            "unregioncode": [("biosphere", "G")],
+        },
+        scaling_factor=2,
+        global_cfs=[(("biosphere", "G"), 7)],
+        nan_value=204,
+    )
+    F, G = get_id(("biosphere", "F")), get_id(("biosphere", "G"))
+    cfs = method_cfs(("a", "method"))
+    assert cfs[(G, "GLO")] == 7
+    assert cfs[(F, ("countries", "Togo"))] == pytest.approx(2 * (768 + 8.526788))
+    assert cfs[(G, ("countries", "Togo"))] == 2 * 768
+    # ``uncode`` of Benin is ``nan_value``
+    assert cfs[(F, ("countries", "Benin"))] == pytest.approx(2 * 9.641217)
+    assert (G, ("countries", "Benin")) not in cfs
+    assert methods[("a", "method")]["geocollections"] == ["countries", "world"]
+    assert methods[("a", "method")]["num_cfs"] == 5
+    # Intermediate data has the regionalized CFs too
+    given = {}
+    for row in Method(("a", "method")).load():
+        key = (row[0], row[2] if len(row) == 3 else "GLO")
+        given[key] = given.get(key, 0) + row[1]
+    assert given == pytest.approx(
+        {
+            (G, "GLO"): 7,
+            (F, ("countries", "Togo")): 2 * (768 + 8.526788),
+            (G, ("countries", "Togo")): 2 * 768,
+            (F, ("countries", "Benin")): 2 * 9.641217,
+        }
+    )
+
+
+@bw2test
+def test_import_regionalized_cfs_raster():
+    Database("biosphere").write({("biosphere", "F"): {"type": "emission"}})
+    fp = os.path.join(data_dir, "test_raster_cfs.tif")
+    geocollections["cfs"] = {"filepath": fp}
+    import_regionalized_cfs("cfs", ("a", "method"), {1: [("biosphere", "F")]}, 10)
+
+    with rasterio.open(fp) as src:
+        array, transform = src.read(1), src.transform
+    valid = array != -1
+    cfs = method_cfs(("a", "method"))
+    assert len(cfs) == valid.sum()
+    F = get_id(("biosphere", "F"))
+    labels = raster_cell_labels(raster_cell_ids(array)[valid], array.shape, transform)
+    for label, value in zip(labels, array[valid]):
+        assert cfs[(F, ("cfs", label))] == pytest.approx(value * 10)
+    # Only cells with CFs are added to ``geomapping``
+    assert sum(1 for key in geomapping if key[0] == "cfs") == valid.sum()
+
+
+@bw2test
+def test_import_regionalized_cfs_directory_layout():
+    Database("biosphere").write({("biosphere", "F"): {"type": "emission"}})
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    set_datapackage_layout("directory")
+    import_regionalized_cfs(
+        "countries",
+        ("a", "method"),
+        {"latitude": [("biosphere", "F")]},
+        global_cfs=[
+            (("biosphere", "F"), {"amount": 7, "uncertainty_type": 3, "scale": 1})
+        ],
+    )
+    fp = Method(("a", "method")).filepath_processed()
+    assert fp.is_file()
+    assert directory_path(fp).is_dir()
+
+    # ``bw2data`` reads the zip archive, ``dp`` the memory-mapped directory
+    F = get_id(("biosphere", "F"))
+    name = Method(("a", "method")).datapackage().metadata["name"]
+    for package in (Method(("a", "method")).datapackage(), dp(fp)):
+        distributions = package.get_resource(name + "_matrix_data.distributions")[0]
+        assert distributions["uncertainty_type"].tolist() == [3, 0, 0]
+    data = dp(fp).get_resource(name + "_matrix_data.data")[0]
+    assert isinstance(data, np.memmap)
+    assert method_cfs(("a", "method"))[(F, "GLO")] == 7
+    assert method_cfs(("a", "method"))[(F, ("countries", "Togo"))] == pytest.approx(
+        8.526788
+    )
+
+
+def test_raster_cell_labels_round_trip():
+    with rasterio.open(os.path.join(data_dir, "test_raster_cfs.tif")) as src:
+        shape, transform = (src.height, src.width), src.transform
+    cells = raster_cell_ids(shape).ravel()
+    labels = raster_cell_labels(cells, shape, transform)
+    assert len(set(labels)) == len(cells)
+    assert (raster_cell_indices(labels, shape, transform) == cells).all()
+    # Pandarus labels have rounded coordinates
+    assert raster_cell_indices(
+        ["Cell(2.36904500e+00, 8.80577500e+00)", "Cell(1e3, 0)", "foo", 1],
+        shape,
+        transform,
+    ).tolist() == [6 * 25 + 14, -1, -1, -1]
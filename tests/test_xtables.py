@@ -1,7 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+from bw2data import geomapping
+from bw2data.tests import bw2test
+
+from bw2regional import extension_tables, geocollections
+from bw2regional.utils import set_datapackage_layout
 from bw2regional.xtables import ExtensionTable
 
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
 
 def test_xtable_filename():
     lg = ExtensionTable("some loading with a crazy name")
     assert ".xtable" in lg.filename
     assert ".loading" not in lg.filename
+
+
+@bw2test
+def test_import_from_map():
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    extension_tables["xt"] = {"geocollection": "countries", "xt_field": "uncode"}
+    xt = ExtensionTable("xt")
+    xt.import_from_map(mask=204)
+    package = xt.datapackage()
+    indices = package.get_resource("xt_matrix_data.indices")[0]
+    assert indices["row"].tolist() == [geomapping[("countries", "Togo")]]
+    assert package.get_resource("xt_matrix_data.data")[0].tolist() == [768]
+
+    del extension_tables["xt"]["xt_field"]
+    with pytest.raises(ValueError):
+        xt.import_from_map()
+
+
+@bw2test
+def test_directory_layout():
+    set_datapackage_layout("directory")
+    extension_tables["xt"] = {"geocollection": "countries"}
+    xt = ExtensionTable("xt")
+    xt.write_arrays(["Togo", "Benin"], [1, 2.5])
+    assert not xt.filepath_processed().exists()
+    package = xt.datapackage()
+    data = package.get_resource("xt_matrix_data.data")[0]
+    assert isinstance(data, np.memmap)
+    assert np.allclose(data, [1, 2.5])
+    indices = package.get_resource("xt_matrix_data.indices")[0]
+    assert indices["row"].tolist() == [
+        geomapping[("countries", "Togo")],
+        geomapping[("countries", "Benin")],
+    ]
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from bw2data import geomapping
+from bw2data.tests import bw2test
+from shapely.geometry import box
+
+from bw2regional import geocollections
+from bw2regional.gis_tasks import raster_as_extension_table
+from bw2regional.zonal import zonal_means, zonal_means_chunk
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+
+def xt_values(xt):
+    package = xt.datapackage()
+    reversed_geomapping = {v: k for k, v in geomapping.items()}
+    resource = package.resources[0]["group"]
+    indices = package.get_resource(resource + ".indices")[0]
+    data = package.get_resource(resource + ".data")[0]
+    return {reversed_geomapping[row]: value for row, value in zip(indices["row"], data)}
+
+
+@bw2test
+def test_windowed_engine_matches_rasterstats():
+    geocollections["countries"] = {
+        "filepath": os.path.join(data_dir, "test_countries.gpkg"),
+        "field": "name",
+    }
+    geocollections["cfs"] = {"filepath": os.path.join(data_dir, "test_raster_cfs.tif")}
+    expected = xt_values(
+        raster_as_extension_table("countries", "cfs", "expected", engine="rasterstats")
+    )
+    for processes in (1, 2):
+        xt = raster_as_extension_table(
+            "countries",
+            "cfs",
+            "windowed-{}".format(processes),
+            engine="windowed",
+            weighted=False,
+            processes=processes,
+        )
+        result = xt_values(xt)
+        assert result.keys() == expected.keys()
+        for key, value in expected.items():
+            assert result[key] == pytest.approx(value)
+
+
+def test_zonal_means_chunk_weighting(tmpdir):
+    fp = str(tmpdir / "raster.tif")
+    with rasterio.open(
+        fp,
+        "w",
+        driver="GTiff",
+        width=2,
+        height=2,
+        count=1,
+        dtype="float64",
+        crs="EPSG:4326",
+        transform=rasterio.transform.from_origin(0, 80, 40, 40),
+        nodata=-1,
+    ) as sink:
+        sink.write(np.array([[1.0, 1.0], [3.0, -1.0]]), 1)
+
+    zone = box(0, 0, 80, 80)
+    unweighted, weighted, outside = zonal_means_chunk(
+        fp, [zone, zone, box(100, 0, 120, 10)], weighted=False
+    )
+    assert unweighted == pytest.approx(5 / 3)
+    assert np.isnan(outside)
+    # Cells between 0 and 40 degrees are larger, so have more weight
+    assert zonal_means_chunk(fp, [zone])[0] > unweighted
+
+    half = zonal_means_chunk(fp, [box(0, 0, 60, 80)], weighted=False, supersample=4)
+    # Right column is half covered: (1 + 3 + 0.5 * 1) / 2.5
+    assert half[0] == pytest.approx(4.5 / 2.5)
+
+
+def test_zonal_means_reprojects(tmpdir):
+    import geopandas as gp
+
+    fp = str(tmpdir / "zones.gpkg")
+    gp.GeoDataFrame(
+        {"id": ["a"]}, geometry=[box(0, 0, 10, 10)], crs="EPSG:4326"
+    ).to_crs("EPSG:3857").to_file(fp)
+    ids, means = zonal_means(
+        fp, "id", os.path.join(data_dir, "test_raster_cfs.tif"), processes=1
+    )
+    assert list(ids) == ["a"]
+    assert means.shape == (1,)